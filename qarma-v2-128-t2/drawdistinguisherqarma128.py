@@ -26,7 +26,6 @@ Email: hsn.hadipour@gmail.com
 
 
 import sys
-import itertools
 
 def trim(docstring):
     if not docstring:
@@ -71,17 +70,34 @@ class Draw():
         self.lazy_tweak_cells_numeric_zero = integral_object.lazy_tweak_cells_numeric_zero
         self.lazy_tweak_cells_numeric_one = integral_object.lazy_tweak_cells_numeric_one
 
+    def pack(self, state, permutation=None):
+        """
+        Pack the fill codes of one half of a state into one digit per cell (see \PackedFill in qarmavtwo128.sty);
+        cell j of the half is drawn at cell permutation[j]
+        """
+
+        packed = ["0"]*16
+        for j in range(16):
+            packed[j if permutation is None else permutation[j]] = str(state[j])
+        return "".join(packed)
+
+    def pack_frames(self, round_number, half):
+        """
+        Pack the cells of one half of the subtweakey of a round into which a lazy tweak cell is added
+        """
+
+        tk_permutation_per_round = self.result["tk_permutation_per_round"][round_number]
+        lazy_tweak_cells = self.lazy_tweak_cells_numeric_zero if round_number%2 == 0 else self.lazy_tweak_cells_numeric_one
+        return "".join("1" if tk_permutation_per_round[16*half + j] in lazy_tweak_cells else "0" for j in range(16))
+
     def gen_round_tweakey_labels(self, round_number):
         """
         Generate the round tweakey labels
         """
         
         round_tweakey_state = self.result["tk_permutation_per_round"][round_number]          
-        text1, text2 = "", ""
-        for i in range(16):
-            text1 += "\Cell{{s{0}}}{{\\texttt{{{1}}}}}".format(i, round_tweakey_state[i])
-        for i in range(16):
-            text2 += "\Cell{{s{0}}}{{\\texttt{{{1}}}}}".format(i, round_tweakey_state[16 + i])
+        text1 = "\\PackedLabels{{{0}}}".format(",".join(str(round_tweakey_state[i]) for i in range(16)))
+        text2 = "\\PackedLabels{{{0}}}".format(",".join(str(round_tweakey_state[16 + i]) for i in range(16)))
         return text1, text2
     
     def draw_eu(self, r):
@@ -97,24 +113,14 @@ class Draw():
         output["after_pr"] = ["", ""]
         output["subtweakey"] = ["", ""]
         output["after_mix_columns"] = ["", ""]
-        tk_permutation_per_round = self.result["tk_permutation_per_round"][r]              
-        for i, j in itertools.product(range(2), range(16)):
-            output["before_sb"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][r][i][j]], j)
-            output["after_sb"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i][j]], j)
-            output["after_exr"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_exx"][r][i][j]], j)
-            output["after_addtk"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_exx"][r][i][j]], j)
-            output["after_pr"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i][j]], self.inv_permutation[j])
-            output["after_mix_columns"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][r + 1][i][j]], j)
-        for i, j in itertools.product(range(2), range(16)):
-            output["subtweakey"][i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_exx"][r][i][j]], j)
         for i in range(2):
-            for j in range(16):
-                if r%2 == 0:
-                    if tk_permutation_per_round[16*i + j] in self.lazy_tweak_cells_numeric_zero:
-                        output["subtweakey"][i] += "\FrameCell[filter]{{s{0}}}".format(j)
-                else:
-                    if tk_permutation_per_round[16*i + j] in self.lazy_tweak_cells_numeric_one:
-                        output["subtweakey"][i] += "\FrameCell[filter]{{s{0}}}".format(j)
+            output["before_sb"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][r][i]))
+            output["after_sb"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_sbx"][r][i]))
+            output["after_exr"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_exx"][r][i]))
+            output["after_addtk"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_exx"][r][i]))
+            output["after_pr"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_sbx"][r][i], self.inv_permutation))
+            output["after_mix_columns"][i] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][r + 1][i]))
+            output["subtweakey"][i] = "\\PackedFill{{{0}}}\\PackedFrame{{{1}}}".format(self.pack(self.result["forward_mask_exx"][r][i]), self.pack_frames(r, i))
         return output
 
     def draw_el(self, r):
@@ -129,32 +135,18 @@ class Draw():
         output["subtweakey"] = ["", ""]
         output["before_exr"] = ["", ""]
         output["after_exr"] = ["", ""]
-        tk_permutation_per_round = self.result["tk_permutation_per_round"][self.RU + r]
-        for i, j in itertools.product(range(2), range(16)):            
-            output["after_sinv"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL - r][0][i][j]], j)
-            output["after_minv"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][0][i][j]], self.inv_permutation[j]) 
-            output["after_prinv"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][0][i][j]], j)
-            output["before_exr"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][0][i][j]], j)
-            output["after_exr"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][0][i][j]], j)
-        for i, j in itertools.product(range(2), range(16)):
-            output["subtweakey"][i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][0][i][j]], j)
-
-        for i, j in itertools.product(range(2), range(16)):            
-            output["after_sinv"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL - r][1][i][j]], j)
-            output["after_minv"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][1][i][j]], self.inv_permutation[j]) 
-            output["after_prinv"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][1][i][j]], j)
-            output["before_exr"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][1][i][j]], j)
-            output["after_exr"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][1][i][j]], j)
-        for i, j in itertools.product(range(2), range(16)):
-            output["subtweakey"][i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_exx"][self.RL - r - 1][1][i][j]], j)
+        backward_mask_x = self.result["backward_mask_x"][self.RL - r]
+        backward_mask_exx = self.result["backward_mask_exx"][self.RL - r - 1]
+        backward_mask_sbx = self.result["backward_mask_sbx"][self.RL - r - 1]
         for i in range(2):
-            for j in range(16):
-                if (self.RU + r)%2 == 0:
-                    if tk_permutation_per_round[16*i + j] in self.lazy_tweak_cells_numeric_zero:
-                        output["subtweakey"][i] += "\FrameCell[filter]{{s{0}}}".format(j)
-                else:
-                    if tk_permutation_per_round[16*i + j] in self.lazy_tweak_cells_numeric_one:
-                        output["subtweakey"][i] += "\FrameCell[filter]{{s{0}}}".format(j)
+            output["after_sinv"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_x[0][i]), self.pack(backward_mask_x[1][i]))
+            output["after_minv"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_exx[0][i], self.inv_permutation),
+                                                                                     self.pack(backward_mask_exx[1][i], self.inv_permutation))
+            output["after_prinv"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_exx[0][i]), self.pack(backward_mask_exx[1][i]))
+            output["before_exr"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_exx[0][i]), self.pack(backward_mask_exx[1][i]))
+            output["after_exr"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_sbx[0][i]), self.pack(backward_mask_sbx[1][i]))
+            output["subtweakey"][i] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}\\PackedFrame{{{2}}}".format(self.pack(backward_mask_exx[0][i]), self.pack(backward_mask_exx[1][i]),
+                                                                                                        self.pack_frames(self.RU + r, i))
         return output
     
     def generate_attack_shape(self):
@@ -162,12 +154,10 @@ class Draw():
         Draw the figure of the Rectangle distinguisher
         """
 
-        contents = ""
-        initial_state = ["", ""]
-        for i, j in itertools.product(range(2), range(16)):
-            initial_state[i] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][0][i][j]], j)
+        contents = []
+        initial_state = ["\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][0][i])) for i in range(2)]
         # head lines
-        contents += trim(r"""
+        contents.append(trim(r"""
                     \documentclass[varwidth=50cm]{standalone}
                     \usepackage{qarmavtwo128}
                     \usepackage{comment}
@@ -175,7 +165,7 @@ class Draw():
                     %\begin{figure}
                     %\centering
                     \begin{tikzpicture}
-                    \QarmaInit{""" + initial_state[0] + r"""}{""" + initial_state[1] + r"""}""") + "\n\n"                    
+                    \QarmaInit{""" + initial_state[0] + r"""}{""" + initial_state[1] + r"""}""") + "\n\n")
         # draw EU
         for r in range(0, self.RU):
             state = self.draw_eu(r)
@@ -183,7 +173,7 @@ class Draw():
             state["subtweakey"][0] += temp[0]
             state["subtweakey"][1] += temp[1]
             if r == 0:
-                contents += trim(r"""
+                contents.append(trim(r"""
                 \QarmaForwardNewLineInitZero               
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][0] + r"""} % state after first operation (S)
@@ -192,8 +182,8 @@ class Draw():
                     {$\tau$} % second operation name (\tau or S')
                     {""" + state["after_pr"][0] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
-                    {""" + state["after_mix_columns"][0] + r"""} % state after third operation (M)""") + "\n\n"
-                contents += trim(r"""
+                    {""" + state["after_mix_columns"][0] + r"""} % state after third operation (M)""") + "\n\n")
+                contents.append(trim(r"""
                 \QarmaForwardNewLineInitOne              
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][1] + r"""} % state after first operation (S)
@@ -202,10 +192,10 @@ class Draw():
                     {$\tau$} % second operation name (\tau or S')
                     {""" + state["after_pr"][1] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
-                    {""" + state["after_mix_columns"][1] + r"""} % state after third operation (M)""") + "\n\n"
+                    {""" + state["after_mix_columns"][1] + r"""} % state after third operation (M)""") + "\n\n")
 
             elif r < self.RU - 1:
-                contents += trim(r"""
+                contents.append(trim(r"""
                 \QarmaForwardNewLineZero
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][0] + r"""} % state after first operation (S)
@@ -215,8 +205,8 @@ class Draw():
                     {""" + state["after_pr"][0] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
                     {""" + state["after_mix_columns"][0] + r"""} % state after third operation (M)
-                    {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n"
-                contents += trim(r"""
+                    {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n")
+                contents.append(trim(r"""
                 \QarmaForwardNewLineOne
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][1] + r"""} % state after first operation (S)
@@ -226,9 +216,9 @@ class Draw():
                     {""" + state["after_pr"][1] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
                     {""" + state["after_mix_columns"][1] + r"""} % state after third operation (M)
-                    {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n"
+                    {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n")
             elif r == (self.RU - 1):               
-                contents += trim(r"""
+                contents.append(trim(r"""
                 \QarmaForwardFinalZero           
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][0] + r"""} % state after first operation (S)
@@ -238,8 +228,8 @@ class Draw():
                     {""" + state["after_pr"][0] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
                     {""" + state["after_mix_columns"][0] + r"""} % state after third operation (M)
-                    {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n"
-                contents += trim(r"""
+                    {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n")
+                contents.append(trim(r"""
                 \QarmaForwardFinalOne          
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"][1] + r"""} % state after first operation (S)
@@ -249,7 +239,7 @@ class Draw():
                     {""" + state["after_pr"][1] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
                     {""" + state["after_mix_columns"][1] + r"""} % state after third operation (M)
-                    {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n"                
+                    {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n")
                             
         # draw EL
         for r in range(0, self.RL):
@@ -258,7 +248,7 @@ class Draw():
             state["subtweakey"][0] += temp[0]
             state["subtweakey"][1] += temp[1]
             if r < self.RL - 1:
-                contents += trim(r"""
+                contents.append(trim(r"""
                             \QarmaBackwardNewLineZero
                                 {$\bar{S}$} % S^-1
                                 {""" + state["after_sinv"][0] + r"""} % state after S^-1
@@ -268,8 +258,8 @@ class Draw():
                                 {""" + state["after_prinv"][0] + r"""} % state after permutation
                                 {""" + state["subtweakey"][0] + r"""} %
                                 {""" + state["before_exr"][0] + r"""} % state befoe XR
-                                {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n"
-                contents += trim(r"""
+                                {""" + state["after_exr"][0] + r"""} % state after XR""") + "\n\n")
+                contents.append(trim(r"""
                             \QarmaBackwardNewLineOne
                                 {$\bar{S}$} % S^-1
                                 {""" + state["after_sinv"][1] + r"""} % state after S^-1
@@ -279,13 +269,11 @@ class Draw():
                                 {""" + state["after_prinv"][1] + r"""} % state after permutation
                                 {""" + state["subtweakey"][1] + r"""} %
                                 {""" + state["before_exr"][1] + r"""} % state befoe XR
-                                {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n"
+                                {""" + state["after_exr"][1] + r"""} % state after XR""") + "\n\n")
             elif r == (self.RL - 1):
-                before_sinv = ["", ""]
-                for i, j in itertools.product(range(2), range(16)):
-                    before_sinv[i] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][0][0][i][j]], j)
-                    before_sinv[i] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][0][1][i][j]], j)
-                contents += trim(r"""
+                before_sinv = ["\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(self.result["backward_mask_x"][0][0][i]),
+                                                                                self.pack(self.result["backward_mask_x"][0][1][i])) for i in range(2)]
+                contents.append(trim(r"""
                             \QarmaBackwardFinalZero
                                 {$\bar{S}$} % S^-1
                                 {""" + state["after_sinv"][0] + r"""} % state after S^-1
@@ -295,8 +283,8 @@ class Draw():
                                 {""" + state["after_prinv"][0] + r"""} % state after permutation
                                 {""" + state["subtweakey"][0] + r"""} %
                                 {""" + state["before_exr"][0] + r"""} % state befoe XR
-                                {""" + before_sinv[0] + r"""} % state after XR""") + "\n\n"
-                contents += trim(r"""
+                                {""" + before_sinv[0] + r"""} % state after XR""") + "\n\n")
+                contents.append(trim(r"""
                             \QarmaBackwardFinalOne
                                 {$\bar{S}$} % S^-1
                                 {""" + state["after_sinv"][1] + r"""} % state after S^-1
@@ -306,16 +294,16 @@ class Draw():
                                 {""" + state["after_prinv"][1] + r"""} % state after permutation
                                 {""" + state["subtweakey"][1] + r"""} %
                                 {""" + state["before_exr"][1] + r"""} % state befoe XR
-                                {""" + before_sinv[1] + r"""} % state after XR""") + "\n\n"
+                                {""" + before_sinv[1] + r"""} % state after XR""") + "\n\n")
     
-        contents += r"""%\IntegralDistinguisherLegend""" + "\n"
-        contents += r"""\end{tikzpicture}""" + "\n"
-        contents += r"""%\caption{Integral distinguisher for """ +  str(self.RD + 2) +\
-                    r""" rounds of QARMA-v2-128""" + "}\n"
-        contents += trim(r"""%\end{figure}""") + "\n"
-        contents += trim(r"""\begin{comment}""") + "\n"
-        contents += self.attack_summary
-        contents += trim(r"""\end{comment}""") + "\n"
-        contents += trim(r"""\end{document}""")
-        with open(self.output_file_name, "w") as output_file:
-            output_file.write(contents)
+        contents.append(r"""%\IntegralDistinguisherLegend""" + "\n")
+        contents.append(r"""\end{tikzpicture}""" + "\n")
+        contents.append(r"""%\caption{Integral distinguisher for """ +  str(self.RD + 2) +\
+                    r""" rounds of QARMA-v2-128""" + "}\n")
+        contents.append(trim(r"""%\end{figure}""") + "\n")
+        contents.append(trim(r"""\begin{comment}""") + "\n")
+        contents.append(self.attack_summary)
+        contents.append(trim(r"""\end{comment}""") + "\n")
+        contents.append(trim(r"""\end{document}"""))
+        with open(self.output_file_name, "w", buffering=2**16) as output_file:
+            output_file.writelines(contents)
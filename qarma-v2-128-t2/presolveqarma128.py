@@ -0,0 +1,309 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import time
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from mixcolumnqarma128 import MixColumnTable
+from propagatorqarma128 import MaskPropagator
+line_separator = "#"*55
+
+class Presolve:
+    """
+    Fix the variables of distinguisherqarma128.mzn that are forced before search
+
+    The domain of a cell is a set of the 18 cell states (mask, class) of MixColumnTable. The domains
+    of forward_mask_x[0] (any mask) and backward_mask_x[0] (masks in {0, 1}, at most one active cell
+    per half and branch) are propagated through sb_operation, the exchange of rows (fixed by the round
+    index, as exchange_row_enable) and mix_column with the semantics of the model
+    (mix_column is evaluated on every combination of the input states of a column), which gives the
+    domains of all masks and classes of EU and EL. The subtweakey activity, its counts and contradict
+    are bounded from these domains and the fixed tweak permutations. The outcome is a set of MiniZinc
+    constraints fixing the forced variables and restricting the other ones to their domains.
+    """
+
+    num_of_states = MixColumnTable.num_of_states
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.mix_column_table = MixColumnTable.load()
+        propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        self.tkp_sequence = np.array(propagator.generate_tkp_sequence())
+        self.tk_permutation_per_round = propagator.tk_permutation_per_round
+        self.state_permutation = propagator.state_permutation
+        # sb_states[s] is the state of the output of sb_operation for the input state s
+        sb_mask = propagator.sb_table[MixColumnTable.state_mask]
+        self.sb_states = MixColumnTable.state_id(sb_mask, propagator.mask_to_class[sb_mask])
+        self.domains = dict()
+        self.bounds = dict()
+        self.num_of_variables = 0
+        self.num_of_fixed = 0
+        self.num_of_tightened = 0
+        self.num_of_removed_values = 0
+        self.elapsed_time = None
+
+    #############################################################################################################################################
+    # Propagation of the cell domains
+
+    def initial_domain(self, masks, shape):
+        """
+        Return the domain of cells whose mask is in masks (any class allowed by link_mask_class)
+        """
+
+        domain = np.isin(MixColumnTable.state_mask, masks)
+        return np.broadcast_to(domain, shape + (self.num_of_states,)).copy()
+
+    def sb_operation(self, domain):
+        """
+        Image of a domain under sb_operation
+        """
+
+        image = np.zeros(domain.shape, dtype=bool)
+        for state in range(self.num_of_states):
+            image[..., self.sb_states[state]] |= domain[..., state]
+        return image
+
+    def mix_column(self, domain):
+        """
+        Image of the domains of a half of the state (shape (..., 16, 18)) under mix_column
+
+        Returns the domains of the output cells (..., 16, 18) and of the auxiliary cells (..., 4, 2, 18)
+        """
+
+        out_domain = np.zeros(domain.shape, dtype=bool)
+        aux_domain = np.zeros(domain.shape[:-2] + (4, 2, self.num_of_states), dtype=bool)
+        for index in np.ndindex(domain.shape[:-2]):
+            for j in range(4):
+                in_states = [np.flatnonzero(domain[index + (self.state_permutation[4*k + j],)]) for k in range(4)]
+                out_states = np.asarray(self.mix_column_table.table[np.ix_(*in_states)]).reshape(-1, 6)
+                for k in range(4):
+                    out_domain[index + (4*k + j, np.unique(out_states[:, k]))] = True
+                for k in range(2):
+                    aux_domain[index + (j, k, np.unique(out_states[:, 4 + k]))] = True
+        return out_domain, aux_domain
+
+    @staticmethod
+    def exchange_rows(domain, enable):
+        """
+        Image of the domains of a state (shape (..., 2, 16, 18)) under the exchange of rows
+
+        Only the masks are exchanged in the model, the classes follow from link_mask_class
+        """
+
+        if enable:
+            domain = np.concatenate([domain[..., ::-1, :8, :], domain[..., 8:, :]], axis=-2)
+        masks = MixColumnTable.state_mask
+        return (domain[..., None, :] & (masks[:, None] == masks[None, :])).any(axis=-1)
+
+    def propagate(self, x_domain, num_of_rounds, extra_sb=False):
+        """
+        Propagate the domain of the state of round 0 over num_of_rounds rounds
+        (with extra_sb, sb_operation is applied once more to the last state, as in EL)
+        """
+
+        domains = {"x": [x_domain], "sbx": [], "exx": [], "aux": []}
+        for r in range(num_of_rounds):
+            domains["sbx"].append(self.sb_operation(domains["x"][-1]))
+            domains["exx"].append(self.exchange_rows(domains["sbx"][-1], r % 2 == num_of_rounds % 2))
+            x_domain, aux_domain = self.mix_column(domains["exx"][-1])
+            domains["x"].append(x_domain)
+            domains["aux"].append(aux_domain)
+        if extra_sb:
+            domains["sbx"].append(self.sb_operation(domains["x"][-1]))
+        return {state: np.stack(value) for state, value in domains.items()}
+
+    #############################################################################################################################################
+    # Subtweakeys, counts and contradict
+
+    @staticmethod
+    def activity_bounds(domain):
+        """
+        Bound any_or_nonzero and only_nonzero of a cell from the domain of its mask
+
+        Returns (lower, upper) arrays for any_or_nonzero and for only_nonzero
+        """
+
+        mask = MixColumnTable.state_mask
+        any_lower = ~(domain & (mask == 0)).any(axis=-1)
+        any_upper = (domain & (mask != 0)).any(axis=-1)
+        only_lower = ~(domain & ((mask == 0) | (mask == 3))).any(axis=-1)
+        only_upper = (domain & ((mask == 1) | (mask == 2))).any(axis=-1)
+        return any_lower, any_upper, only_lower, only_upper
+
+    def subtweakey_bounds(self):
+        """
+        Bound any_or_nonzero_subtweakey and only_nonzero_subtweakeys (shape (RD, 2, 32)) from the domains of the exx cells
+        (the cell (i, j) meets the tweak cell tk_permutation_per_round[r, 16*i + j])
+        """
+
+        bounds = {name: np.zeros((self.RD, 2, 32), dtype=np.int64) for name in ["any_lower", "any_upper", "only_lower", "only_upper"]}
+        forward = self.activity_bounds(self.domains["forward_mask_exx"])
+        for r in range(self.RU):
+            for name, value in zip(bounds, forward):
+                bounds[name][r, :, self.tk_permutation_per_round[r]] = value[r].reshape(32)[:, None]
+        backward = self.activity_bounds(self.domains["backward_mask_exx"])
+        for r in range(self.RL):
+            q = self.RD - r - 1
+            for name, value in zip(bounds, backward):
+                bounds[name][q][:, self.tk_permutation_per_round[q]] = value[r].reshape(2, 32)
+        return bounds
+
+    def count_bounds(self, subtweakey_bounds):
+        """
+        Bound no_of_any_or_nonzero, no_of_only_nonzero and contradict (indexed by [parity, branch, tweak cell])
+        """
+
+        bounds = {name: np.stack([value[parity::2].sum(axis=0) for parity in range(2)], axis=0) for name, value in subtweakey_bounds.items()}
+        contradict_lower = (bounds["any_upper"] == 0) | ((bounds["any_upper"] <= self.NPT) & (bounds["only_lower"] >= 1))
+        contradict_upper = (bounds["any_lower"] == 0) | ((bounds["any_lower"] <= self.NPT) & (bounds["only_upper"] >= 1))
+        bounds["contradict_lower"] = contradict_lower.astype(np.int64)
+        bounds["contradict_upper"] = contradict_upper.astype(np.int64)
+        return bounds
+
+    def run(self):
+        """
+        Compute the domains of all cells and the bounds of the tweakey contradiction
+        """
+
+        start_time = time.time()
+        forward = self.propagate(self.initial_domain([0, 1, 2, 3], (2, 16)), self.RU)
+        backward = self.propagate(self.initial_domain([0, 1], (2, 2, 16)), self.RL, extra_sb=True)
+        for state in ["x", "sbx", "exx", "aux"]:
+            self.domains["forward_mask_" + state] = forward[state]
+            self.domains["backward_mask_" + state] = backward[state]
+        subtweakey_bounds = self.subtweakey_bounds()
+        self.bounds = self.count_bounds(subtweakey_bounds)
+        self.bounds.update({"subtweakey_" + name: value for name, value in subtweakey_bounds.items()})
+        self.elapsed_time = time.time() - start_time
+        return self
+
+    #############################################################################################################################################
+    # Constraints
+
+    def fix_or_restrict(self, name, index, values, full_domain):
+        """
+        Return the constraint fixing or restricting one variable (None if its domain is not reduced)
+
+        full_domain is the declared domain of the variable (None for var int)
+        """
+
+        self.num_of_variables += 1
+        values = sorted(set(int(value) for value in values))
+        variable = "{}[{}]".format(name, ", ".join(map(str, index)))
+        if len(values) == 1:
+            self.num_of_fixed += 1
+            self.num_of_removed_values += 0 if full_domain is None else len(full_domain) - 1
+            return "constraint {} = {};".format(variable, values[0])
+        if full_domain is not None and len(values) < len(full_domain):
+            self.num_of_tightened += 1
+            self.num_of_removed_values += len(full_domain) - len(values)
+            if values == list(range(values[0], values[-1] + 1)):
+                return "constraint {} in {}..{};".format(variable, values[0], values[-1])
+            return "constraint {} in {{{}}};".format(variable, ", ".join(map(str, values)))
+        return None
+
+    def constraints(self):
+        """
+        Generate the MiniZinc constraints of the presolve
+        """
+
+        if self.elapsed_time is None:
+            self.run()
+        self.num_of_variables = self.num_of_fixed = self.num_of_tightened = self.num_of_removed_values = 0
+        lines = []
+        exchange_row_enable = np.array([r % 2 == self.RU % 2 for r in range(self.RU)] + [r % 2 == self.RL % 2 for r in range(self.RL)], dtype=np.int64)
+        for index in np.ndindex(exchange_row_enable.shape):
+            lines.append(self.fix_or_restrict("exchange_row_enable", index, [exchange_row_enable[index]], range(2)))
+        for name, value in [("tkp_sequence", self.tkp_sequence), ("tk_permutation_per_round", self.tk_permutation_per_round)]:
+            for index in np.ndindex(value.shape):
+                lines.append(self.fix_or_restrict(name, index, [value[index]], None))
+        for mask_name, domain in self.domains.items():
+            class_name = mask_name.replace("mask", "class")
+            for index in np.ndindex(domain.shape[:-1]):
+                states = np.flatnonzero(domain[index])
+                lines.append(self.fix_or_restrict(mask_name, index, MixColumnTable.state_mask[states], range(4)))
+                lines.append(self.fix_or_restrict(class_name, index, MixColumnTable.state_class[states], range(-2, 16)))
+        for name, prefix in [("any_or_nonzero_subtweakey", "subtweakey_any"), ("only_nonzero_subtweakeys", "subtweakey_only"),
+                             ("no_of_any_or_nonzero", "any"), ("no_of_only_nonzero", "only"), ("contradict", "contradict")]:
+            lower, upper = self.bounds[prefix + "_lower"], self.bounds[prefix + "_upper"]
+            full_domain = range(2) if prefix.startswith("subtweakey") or prefix == "contradict" else range(self.RD + 1)
+            for index in np.ndindex(lower.shape):
+                lines.append(self.fix_or_restrict(name, index, range(lower[index], upper[index] + 1), full_domain))
+        return "\n".join(line for line in lines if line is not None) + "\n"
+
+    def print_summary(self):
+        """
+        Print the outcome of the presolve
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Presolve:\n"
+        str_output += "Number of variables:             {}\n".format(self.num_of_variables)
+        str_output += "Number of fixed variables:       {}\n".format(self.num_of_fixed)
+        str_output += "Number of tightened domains:     {}\n".format(self.num_of_tightened)
+        str_output += "Number of removed values:        {}\n".format(self.num_of_removed_values)
+        str_output += "Elapsed time:                    {:0.03f} seconds\n".format(self.elapsed_time)
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and run the presolve
+    '''
+
+    parser = ArgumentParser(description="This tool fixes the variables of the integral distinguisher model of Qarma-v2-128 that are forced before search\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=6, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=16, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-o", default=None, type=str, help="write the constraints of the presolve to this file\n")
+    args = parser.parse_args()
+    presolve = Presolve(args.RU - 1, args.RL - 1, args.KR, args.NPT, args.tki)
+    constraints = presolve.constraints()
+    print(presolve.print_summary())
+    if args.o is not None:
+        with open(args.o, "w") as output_file:
+            output_file.write(constraints)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import json
+import contextlib
+import numpy as np
+
+class PackedResult:
+    """
+    Read-only view of one result of a ResultArchive
+
+    It supports the item access of minizinc.Result (result["forward_mask_x"], ...), hence it can
+    be used in place of a solver result by print_attack_parameters, KeyRecoveryEstimator and Draw.
+    """
+
+    def __init__(self, archive, index) -> None:
+        self.archive = archive
+        self.index = index
+        self.record = archive.records[index]
+        self.status = archive.statuses[int(self.record["status"])]
+
+    def __getitem__(self, name):
+        return self.archive.unpack_field(self.record, name)
+
+    def __contains__(self, name):
+        return name in self.archive.kinds
+
+    @property
+    def objective(self):
+        return int(self.record["inputmask_distinguisher"])
+
+class ResultArchive:
+    """
+    Compact storage of the results of IntegralDistinguisher
+
+    Masks and 0/1 flags are packed with 2 bits per value, classes and counters are stored as int8,
+    and tk_permutation_per_round is stored as a uint8 index into a table shared by the archive.
+    The file consists of a small JSON header followed by the raw records and tables, so that it
+    can be memory-mapped and loaded without any copy.
+    RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1).
+    tk_interpretation is the tweakey interpretation the results were searched with (None if unknown).
+    """
+
+    magic = b"QARMARES"
+    alignment = 64
+    variant = "qarma-v2-128-t2"
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=None) -> None:
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.max_ru_rl = max(self.RU, self.RL, 2)
+        self.shapes = dict()
+        self.kinds = dict()
+        for name, shape, kind in self.schema():
+            self.shapes[name] = shape
+            self.kinds[name] = kind
+        self.record_dtype = self.generate_record_dtype()
+        self.records = np.zeros(0, dtype=self.record_dtype)
+        self.tk_permutations = np.zeros((0, self.RD + self.KR, 32), dtype=np.uint8)
+        self.tkp_sequence = None
+        self.statuses = []
+
+    def schema(self):
+        """
+        List the stored variables of distinguisherqarma128.mzn as (name, shape, kind)
+        """
+
+        return [("forward_mask_x", (self.RU + 1, 2, 16), "mask"),
+                ("forward_class_x", (self.RU + 1, 2, 16), "int8"),
+                ("forward_mask_sbx", (self.RU, 2, 16), "mask"),
+                ("forward_class_sbx", (self.RU, 2, 16), "int8"),
+                ("forward_mask_exx", (self.RU, 2, 16), "mask"),
+                ("forward_class_exx", (self.RU, 2, 16), "int8"),
+                ("forward_mask_aux", (self.RU, 2, 4, 2), "mask"),
+                ("forward_class_aux", (self.RU, 2, 4, 2), "int8"),
+                ("backward_mask_x", (self.RL + 1, 2, 2, 16), "mask"),
+                ("backward_class_x", (self.RL + 1, 2, 2, 16), "int8"),
+                ("backward_mask_sbx", (self.RL + 1, 2, 2, 16), "mask"),
+                ("backward_class_sbx", (self.RL + 1, 2, 2, 16), "int8"),
+                ("backward_mask_exx", (self.RL, 2, 2, 16), "mask"),
+                ("backward_class_exx", (self.RL, 2, 2, 16), "int8"),
+                ("backward_mask_aux", (self.RL, 2, 2, 4, 2), "mask"),
+                ("backward_class_aux", (self.RL, 2, 2, 4, 2), "int8"),
+                ("exchange_row_enable", (self.RD,), "mask"),
+                ("any_or_nonzero_subtweakey", (self.RD, 2, 32), "mask"),
+                ("only_nonzero_subtweakeys", (self.RD, 2, 32), "mask"),
+                ("no_of_any_or_nonzero", (2, 2, 32), "int8"),
+                ("no_of_only_nonzero", (2, 2, 32), "int8"),
+                ("contradict", (2, 2, 32), "mask"),
+                ("inputmask_distinguisher", (), "int16"),
+                ("outputmask_distinguisher1", (), "int16"),
+                ("outputmask_distinguisher2", (), "int16"),
+                ("tk_permutation_per_round", (self.RD + self.KR, 32), "tk_permutation"),
+                ("tkp_sequence", (self.max_ru_rl + self.KR + 1, 32), "tkp_sequence")]
+
+    def generate_record_dtype(self):
+        """
+        Build the structured dtype of one record
+        """
+
+        fields = []
+        for name, shape, kind in self.schema():
+            if kind == "mask":
+                fields.append((name, np.uint8, ((int(np.prod(shape)) + 3) // 4,)))
+            elif kind == "int8":
+                fields.append((name, np.int8, shape))
+            elif kind == "int16":
+                fields.append((name, np.int16, shape))
+        fields.append(("tk_permutation_index", np.uint8))
+        fields.append(("status", np.uint8))
+        return np.dtype(fields)
+
+    #############################################################################################################################################
+    # Packing
+
+    @staticmethod
+    def pack_masks(values):
+        """
+        Pack a batch of arrays with values in 0..3 (shape (N, ...)) into (N, ceil(size/4)) bytes
+        """
+
+        values = np.asarray(values, dtype=np.uint8).reshape(values.shape[0], -1)
+        padding = (-values.shape[1]) % 4
+        values = np.pad(values, ((0, 0), (0, padding))).reshape(values.shape[0], -1, 4)
+        return values[..., 0] | (values[..., 1] << 2) | (values[..., 2] << 4) | (values[..., 3] << 6)
+
+    @staticmethod
+    def unpack_masks(packed, shape):
+        """
+        Inverse of pack_masks for the given shape of one array (the leading axes of packed are kept)
+        """
+
+        size = int(np.prod(shape))
+        values = (packed[..., None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+        return values.reshape(packed.shape[:-1] + (-1,))[..., :size].reshape(packed.shape[:-1] + tuple(shape))
+
+    def status_index(self, result):
+        """
+        Return the index of the status of a result (minizinc.Result or PackedResult)
+        """
+
+        status = getattr(result, "status", None)
+        status = "UNKNOWN" if status is None else getattr(status, "name", status)
+        if status not in self.statuses:
+            self.statuses.append(status)
+        return self.statuses.index(status)
+
+    def tk_permutation_index(self, tk_permutation_per_round):
+        """
+        Return the index of tk_permutation_per_round in the table of the archive (extending it if needed)
+        """
+
+        matches = np.flatnonzero((self.tk_permutations == tk_permutation_per_round).all(axis=(1, 2)))
+        if len(matches) != 0:
+            return int(matches[0])
+        assert(len(self.tk_permutations) < 256)
+        self.tk_permutations = np.concatenate([self.tk_permutations, tk_permutation_per_round[None]])
+        return len(self.tk_permutations) - 1
+
+    def pack(self, results):
+        """
+        Pack a batch of results into records
+        """
+
+        records = np.zeros(len(results), dtype=self.record_dtype)
+        for name, shape, kind in self.schema():
+            values = np.array([np.asarray(result[name], dtype=np.int16).reshape(shape) for result in results],
+                              dtype=np.int16).reshape((len(results),) + shape)
+            if kind == "mask":
+                records[name] = self.pack_masks(values)
+            elif kind in ["int8", "int16"]:
+                records[name] = values
+            elif kind == "tk_permutation":
+                records["tk_permutation_index"] = [self.tk_permutation_index(value.astype(np.uint8)) for value in values]
+            elif kind == "tkp_sequence" and len(results) != 0:
+                if self.tkp_sequence is None:
+                    self.tkp_sequence = values[0].astype(np.uint8)
+                assert((values == self.tkp_sequence).all())
+        records["status"] = [self.status_index(result) for result in results]
+        return records
+
+    def append(self, results):
+        """
+        Append a batch of results to the archive
+        """
+
+        self.records = np.concatenate([self.records, self.pack(results)])
+
+    def unpack_field(self, records, name):
+        """
+        Unpack one variable of a record (or of a batch of records)
+        """
+
+        kind = self.kinds[name]
+        if kind == "mask":
+            return self.unpack_masks(records[name], self.shapes[name])
+        if kind == "tk_permutation":
+            return self.tk_permutations[records["tk_permutation_index"]]
+        if kind == "tkp_sequence":
+            return np.broadcast_to(self.tkp_sequence, np.shape(records) + self.tkp_sequence.shape)
+        return records[name]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return PackedResult(self, index)
+
+    #############################################################################################################################################
+    # File format
+
+    def header(self):
+        """
+        Return the header of the archive
+        """
+
+        return {"variant": self.variant,
+                "RU": self.RU,
+                "RL": self.RL,
+                "KR": self.KR,
+                "NPT": self.NPT,
+                "tk_interpretation": self.tk_interpretation,
+                "num_of_results": len(self.records),
+                "num_of_tk_permutations": len(self.tk_permutations),
+                "record_dtype": np.lib.format.dtype_to_descr(self.record_dtype),
+                "statuses": self.statuses}
+
+    def write(self, file_name):
+        """
+        Write the archive to file_name (the file is replaced atomically)
+        """
+
+        header = json.dumps(self.header()).encode()
+        header_size = len(self.magic) + 4 + len(header)
+        header += b" "*((-header_size) % self.alignment)
+        tkp_sequence = np.zeros((self.max_ru_rl + self.KR + 1, 32), dtype=np.uint8) if self.tkp_sequence is None else self.tkp_sequence
+        temporary_file_name = "{}.{}.tmp".format(file_name, os.getpid())
+        with open(temporary_file_name, "wb") as archive_file:
+            archive_file.write(self.magic)
+            archive_file.write(np.uint32(len(header)).tobytes())
+            archive_file.write(header)
+            archive_file.write(np.ascontiguousarray(self.records).tobytes())
+            archive_file.write(np.ascontiguousarray(self.tk_permutations, dtype=np.uint8).tobytes())
+            archive_file.write(np.ascontiguousarray(tkp_sequence, dtype=np.uint8).tobytes())
+        os.replace(temporary_file_name, file_name)
+
+    @classmethod
+    def read_header(cls, file_name):
+        """
+        Read the header of an archive file and return it with its length in bytes
+        """
+
+        with open(file_name, "rb") as archive_file:
+            assert(archive_file.read(len(cls.magic)) == cls.magic)
+            header_length = int(np.frombuffer(archive_file.read(4), dtype=np.uint32)[0])
+            header = json.loads(archive_file.read(header_length))
+        return header, header_length
+
+    @classmethod
+    def check_file(cls, file_name, RU, RL, KR, NPT=1, tk_interpretation=None):
+        """
+        Check that results of the given parameters can be appended to file_name (if it exists)
+        without loading the records, so that a mismatch is found before solving
+
+        An unknown tweakey interpretation (None, e.g., in archives written before it was stored) matches any other.
+        """
+
+        if not os.path.exists(file_name):
+            return
+        header, _ = cls.read_header(file_name)
+        expected = {"variant": cls.variant, "RU": RU, "RL": RL, "KR": KR, "NPT": NPT}
+        mismatches = ["{} = {} (expected {})".format(key, header[key], value) for key, value in expected.items() if header[key] != value]
+        if tk_interpretation is not None and header.get("tk_interpretation") not in [None, tk_interpretation]:
+            mismatches.append("tk_interpretation = {} (expected {})".format(header["tk_interpretation"], tk_interpretation))
+        if mismatches != []:
+            raise ValueError("The archive {} holds results of other parameters: {}".format(file_name, ", ".join(mismatches)))
+
+    @classmethod
+    def load(cls, file_name, mmap=True):
+        """
+        Load an archive; with mmap the records and tables are memory-mapped (read-only, no copy)
+        """
+
+        header, header_length = cls.read_header(file_name)
+        assert(header["variant"] == cls.variant)
+        archive = cls(header["RU"], header["RL"], header["KR"], header["NPT"], header.get("tk_interpretation"))
+        assert(np.lib.format.descr_to_dtype(header["record_dtype"]) == archive.record_dtype)
+        archive.statuses = header["statuses"]
+        offset = len(cls.magic) + 4 + header_length
+        sections = [("records", archive.record_dtype, (header["num_of_results"],)),
+                    ("tk_permutations", np.uint8, (header["num_of_tk_permutations"], archive.RD + archive.KR, 32)),
+                    ("tkp_sequence", np.uint8, (archive.max_ru_rl + archive.KR + 1, 32))]
+        if mmap:
+            buffer = np.memmap(file_name, dtype=np.uint8, mode="r")
+        else:
+            with open(file_name, "rb") as archive_file:
+                buffer = np.frombuffer(archive_file.read(), dtype=np.uint8)
+        for name, dtype, shape in sections:
+            size = int(np.prod(shape))*np.dtype(dtype).itemsize
+            setattr(archive, name, buffer[offset:offset + size].view(dtype).reshape(shape))
+            offset += size
+        if header["num_of_results"] == 0:
+            archive.tkp_sequence = None
+        return archive
+
+    @staticmethod
+    @contextlib.contextmanager
+    def locked(file_name):
+        """
+        Hold an exclusive lock for file_name (on the lock file <file_name>.lock, since the archive
+        itself is replaced by write)
+        """
+
+        import fcntl
+        with open(file_name + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @classmethod
+    def append_to_file(cls, file_name, results, RU, RL, KR, NPT=1, tk_interpretation=None):
+        """
+        Append a batch of results to the archive file_name (created if it does not exist)
+
+        Concurrent appends (e.g., of several drivers, sweeps or the daemon) are serialized by a lock,
+        so that none of them is lost. The archive is rewritten and replaced atomically rather than
+        extended in place, which keeps memory-mapped readers of the previous version valid.
+        Raises ValueError if the archive holds results of other parameters (see check_file).
+        """
+
+        with cls.locked(file_name):
+            cls.check_file(file_name, RU, RL, KR, NPT, tk_interpretation)
+            if os.path.exists(file_name):
+                archive = cls.load(file_name, mmap=False)
+                if archive.tk_interpretation is None:
+                    archive.tk_interpretation = tk_interpretation
+                archive.records = archive.records.copy()
+                archive.tk_permutations = archive.tk_permutations.copy()
+            else:
+                archive = cls(RU, RL, KR, NPT, tk_interpretation)
+            archive.append(results)
+            archive.write(file_name)
+        return archive
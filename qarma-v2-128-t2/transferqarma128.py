@@ -0,0 +1,277 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import json
+import time
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from mitmqarma128 import MeetInTheMiddle
+from checkerqarma128 import CertificateChecker
+from storageqarma128 import ResultArchive
+line_separator = "#"*55
+
+class SolutionTransfer:
+    """
+    Map a solved distinguisher of Qarma-v2-64 or of another Qarma-v2-128 instance (e.g., a smaller KR)
+    onto this instance of Qarma-v2-128, to seed the solver
+
+    Only the input mask and the output cells are transferred; the rest of the assignment is
+    propagated with MaskPropagator and checked with CertificateChecker. A 64-bit mask is placed on
+    one half of the 128-bit state or on both halves (the input mask and the output cells separately,
+    which gives 9 mappings), a 128-bit mask is kept as it is. If no mapping leads to a contradiction,
+    input cells are removed greedily until one does. The best mapped assignment is a solution of
+    distinguisherqarma128.mzn, hence it gives a warm start for the solver, a lower bound on
+    inputmask_distinguisher and, optionally, the output cells to fix. If nothing can be mapped,
+    the search runs without any of them.
+    """
+
+    source_variants = {"qarma-v2-64-t1": (16,), "qarma-v2-64-t2": (16,), "qarma-v2-128-t2": (2, 16)}
+    halves = {"half 0": [0], "half 1": [1], "both halves": [0, 1]}
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.mitm = MeetInTheMiddle(RU, RL, KR, NPT, tk_interpretation)
+        self.propagator = self.mitm.propagator
+        self.checker = CertificateChecker(RU, RL, KR, NPT, tk_interpretation)
+
+    #############################################################################################################################################
+    # Source
+
+    @classmethod
+    def read_source(cls, archive_file_name, index=0):
+        """
+        Read the input mask and the output cells of one result of an archive of any variant
+        """
+
+        with open(archive_file_name, "rb") as archive_file:
+            assert(archive_file.read(len(ResultArchive.magic)) == ResultArchive.magic), "Not a result archive: {}".format(archive_file_name)
+            header_length = int(np.frombuffer(archive_file.read(4), dtype=np.uint32)[0])
+            header = json.loads(archive_file.read(header_length))
+            assert(header["variant"] in cls.source_variants), "Unknown variant: {}".format(header["variant"])
+            assert(0 <= index < header["num_of_results"]), "The archive has {} results".format(header["num_of_results"])
+            record_dtype = np.lib.format.descr_to_dtype(header["record_dtype"])
+            archive_file.seek(index*record_dtype.itemsize, 1)
+            record = np.frombuffer(archive_file.read(record_dtype.itemsize), dtype=record_dtype)[0]
+        state_shape = cls.source_variants[header["variant"]]
+        # The masks of the first round are at the beginning of forward_mask_x and backward_mask_x
+        return {"variant": header["variant"],
+                "RU": header["RU"],
+                "RL": header["RL"],
+                "KR": header["KR"],
+                "NPT": header["NPT"],
+                "index": index,
+                "objective": int(record["inputmask_distinguisher"]),
+                "input_mask": ResultArchive.unpack_masks(record["forward_mask_x"], (header["RU"] + 1,) + state_shape)[0].astype(np.int8),
+                "output_mask": ResultArchive.unpack_masks(record["backward_mask_x"], (header["RL"] + 1, 2) + state_shape)[0].astype(np.int8)}
+
+    def mappings(self, source):
+        """
+        List the mappings of the masks of a source onto the cell layout of Qarma-v2-128 as
+        (description, input mask of shape (2, 16), output mask of shape (2, 2, 16))
+        """
+
+        if source["variant"] == "qarma-v2-128-t2":
+            return [("identity", source["input_mask"], source["output_mask"])]
+        mappings = []
+        for input_name, input_halves in self.halves.items():
+            for output_name, output_halves in self.halves.items():
+                input_mask = np.zeros((2, 16), dtype=np.int8)
+                input_mask[input_halves] = source["input_mask"]
+                output_mask = np.zeros((2, 2, 16), dtype=np.int8)
+                output_mask[:, output_halves] = source["output_mask"][:, None]
+                mappings.append(("input on {}, output on {}".format(input_name, output_name), input_mask, output_mask))
+        return mappings
+
+    #############################################################################################################################################
+    # Mapping
+
+    def evaluate(self, input_mask, output_mask):
+        """
+        Return contradict for a batch of input masks with one output mask
+        """
+
+        propagator = self.propagator
+        forward_any, forward_only = propagator.forward_activity(propagator.forward(input_mask)["forward_mask_exx"])
+        backward_any, backward_only = propagator.backward_activity(propagator.backward(output_mask[None])["backward_mask_exx"])
+        return propagator.contradict(forward_any, forward_only, backward_any[0], backward_only[0])
+
+    def repair(self, input_mask, output_mask):
+        """
+        Remove input cells greedily until the input mask leads to a contradiction (None if it never does)
+
+        Every step removes the cell whose removal maximizes the number of entries of contradict.
+        """
+
+        input_mask = input_mask.copy()
+        while input_mask.any():
+            if self.propagator.is_contradiction(self.evaluate(input_mask[None], output_mask))[0]:
+                return input_mask
+            cells = np.flatnonzero(input_mask)
+            candidates = np.repeat(input_mask.reshape(1, -1), len(cells), axis=0)
+            candidates[np.arange(len(cells)), cells] = 0
+            candidates = candidates.reshape(-1, 2, 16)
+            contradict = self.evaluate(candidates, output_mask)
+            feasible = self.propagator.is_contradiction(contradict)
+            if feasible.any():
+                objective = np.where(feasible, candidates.sum(axis=(1, 2)), -1)
+                return candidates[int(objective.argmax())]
+            input_mask = candidates[int(contradict.sum(axis=(1, 2, 3)).argmax())]
+        return None
+
+    def run(self, archive_file_name, index=0):
+        """
+        Map one result of an archive and return the best mapped assignment (result is None if nothing can be mapped)
+        """
+
+        start_time = time.time()
+        source = self.read_source(archive_file_name, index)
+        mappings = self.mappings(source)
+        outcome = {"source": source, "num_of_mappings": len(mappings), "num_of_feasible": 0,
+                   "mapping": None, "num_of_removed_cells": 0, "objective": None, "result": None, "violations": []}
+        mapped = []
+        for name, input_mask, output_mask in mappings:
+            if self.propagator.is_contradiction(self.evaluate(input_mask[None], output_mask))[0]:
+                mapped.append((name, input_mask, output_mask, 0))
+        outcome["num_of_feasible"] = len(mapped)
+        if mapped == []:
+            # Fall back on the largest contradicting subsets of the mapped input masks
+            for name, input_mask, output_mask in mappings:
+                repaired = self.repair(input_mask, output_mask)
+                if repaired is not None:
+                    mapped.append((name, repaired, output_mask, int(np.count_nonzero(input_mask) - np.count_nonzero(repaired))))
+        if mapped != []:
+            name, input_mask, output_mask, num_of_removed_cells = max(mapped, key=lambda mapping: int(mapping[1].sum()))
+            result = self.mitm.build_result(input_mask, output_mask)
+            outcome["violations"] = self.checker.check(result)
+            if outcome["violations"] == []:
+                outcome.update(mapping=name, num_of_removed_cells=num_of_removed_cells, objective=result["inputmask_distinguisher"], result=result)
+        outcome["elapsed_time"] = time.time() - start_time
+        return outcome
+
+    #############################################################################################################################################
+    # Seeding
+
+    @staticmethod
+    def hint_annotation(result):
+        """
+        Return a warm_start_array annotation with the whole mapped assignment (integer encoding)
+        """
+
+        hints = []
+        for name, _, kind in ResultArchive(0, 0, 0).schema():
+            if kind in ["mask", "int8"]:
+                values = np.asarray(result[name]).ravel()
+                hints.append("warm_start(array1d({}), [{}])".format(name, ", ".join(map(str, values))))
+        return "warm_start_array([{}])".format(", ".join(hints))
+
+    @staticmethod
+    def constraints(outcome, fix_output=False):
+        """
+        Generate the constraints seeded by the mapped assignment: the lower bound on the input mask
+        and, with fix_output, the output cells
+        """
+
+        if outcome["result"] is None:
+            return ""
+        constraints = "constraint inputmask_distinguisher >= {};\n".format(outcome["objective"])
+        if fix_output:
+            output_mask = np.asarray(outcome["result"]["backward_mask_x"])[0]
+            for index in np.ndindex(output_mask.shape):
+                constraints += "constraint backward_mask_x[0, {}] = {};\n".format(", ".join(map(str, index)), output_mask[index])
+        return constraints
+
+    @staticmethod
+    def print_summary(outcome):
+        """
+        Print the outcome of the transfer
+        """
+
+        source = outcome["source"]
+        str_output = line_separator + "\n"
+        str_output += "Solution transfer:\n"
+        str_output += "Source:                          result {} of {} (RU = {}, RL = {}, KR = {}, objective {})\n".format(
+            source["index"], source["variant"], source["RU"] + 1, source["RL"] + 1, source["KR"], source["objective"])
+        str_output += "Contradicting mappings:          {} of {}\n".format(outcome["num_of_feasible"], outcome["num_of_mappings"])
+        if outcome["result"] is None:
+            str_output += "No mapping leads to a contradiction{}, the search is not seeded\n".format(
+                "" if outcome["violations"] == [] else " accepted by the checker")
+        else:
+            str_output += "Mapping:                         {}\n".format(outcome["mapping"])
+            str_output += "Removed input cells:             {}\n".format(outcome["num_of_removed_cells"])
+            str_output += "Objective of the mapped result:  {}\n".format(outcome["objective"])
+        str_output += "Elapsed time:                    {:0.03f} seconds\n".format(outcome["elapsed_time"])
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and map a solved distinguisher onto Qarma-v2-128
+    '''
+
+    parser = ArgumentParser(description="This tool maps a solved distinguisher of Qarma-v2-64 or of another Qarma-v2-128 instance onto Qarma-v2-128\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("source", type=str, help="packed archive of the solved distinguisher (any variant)\n")
+    parser.add_argument("-i", default=0, type=int, help="index of the result in the archive\n")
+    parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=6, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=16, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the mapped result is appended\n")
+    parser.add_argument("-o", default=None, type=str, help="output file including the Tikz code to generate the shape of the mapped distinguisher\n")
+    args = parser.parse_args()
+    transfer = SolutionTransfer(args.RU - 1, args.RL - 1, args.KR, args.NPT, args.tki)
+    outcome = transfer.run(args.source, args.i)
+    print(transfer.print_summary(outcome))
+    if outcome["result"] is None:
+        return
+    if args.ar is not None:
+        ResultArchive.append_to_file(args.ar, [outcome["result"]], transfer.RU, transfer.RL, transfer.KR, transfer.NPT, transfer.tk_interpretation)
+    if args.o is not None:
+        from distinguisherqarma128 import IntegralDistinguisher, default_parameters
+        params = default_parameters()
+        params.update(RU=args.RU, RL=args.RL, KR=args.KR, NPT=args.NPT, tk_interpretation=args.tki, output_file_name=args.o)
+        distinguisher = IntegralDistinguisher(params)
+        distinguisher.result = outcome["result"]
+        distinguisher.report()
+
+if __name__ == "__main__":
+    main()
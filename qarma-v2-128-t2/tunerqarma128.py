@@ -0,0 +1,263 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import json
+import random
+import asyncio
+import itertools
+from pathlib import Path
+from argparse import ArgumentParser, RawTextHelpFormatter
+from distinguisherqarma128 import IntegralDistinguisher, default_parameters, lookup_solver, line_separator, cipher_variant
+
+class Autotuner:
+    """
+    Tune the search annotation, the restart policy and the solver flags of one solver on a training
+    set of small (RU, RL) instances and write the best configuration to a per-variant profile
+
+    A configuration is scored by the number of training instances it solves to optimality within the
+    time limit, then by its PAR2 time (the elapsed time of the solved instances, twice the time limit
+    of the others), then by the sum of the gaps to the best objective found for every instance. The
+    runs share one parsed model and run concurrently. The profile (profile_file_name) holds one entry
+    per solver and is loaded by distinguisherqarma128.py unless -nt is given.
+    """
+
+    # Next to the module, so that the profile is found from any working directory
+    profile_file_name = str(Path(__file__).parent / "tunedqarma128.json")
+    default_training_set = [(2, 2), (2, 3), (3, 3), (3, 4)]
+    # Decision variables of the search annotations (MiniZinc arrays)
+    decision_variables = {"output": "[backward_mask_x[0, b, h, i] | b in 0..1, h in 0..1, i in 0..15]",
+                          "input": "[forward_mask_x[0, h, i] | h in 0..1, i in 0..15]",
+                          "contradict": "array1d(contradict)"}
+    orders = {"output_first": ["output", "input", "contradict"],
+              "input_first": ["input", "output", "contradict"],
+              "contradict_first": ["contradict", "output", "input"]}
+    variable_choices = ["input_order", "first_fail", "dom_w_deg"]
+    restart_annotations = ["restart_none", "restart_luby(250)", "restart_geometric(1.5, 100)", "restart_constant(1000)"]
+    # Solvers that follow the restart annotations and solvers that accept free search
+    restart_solvers = ["gecode", "chuffed"]
+    free_search_solvers = ["chuffed", "ortools"]
+
+    def __init__(self, params, training_set=None, max_concurrent=None, workers=None, num_of_samples=None, seed=0) -> None:
+        """
+        params are the parameters of IntegralDistinguisher used by every run (RU and RL are taken
+        from the training set); workers lists the numbers of threads tried with ortools
+        """
+
+        self.params = params
+        self.training_set = self.default_training_set if training_set is None else training_set
+        self.max_concurrent = max_concurrent
+        self.cp_solver_name = params["cp_solver_name"]
+        self.workers = [params["num_of_threads"]] if workers is None or self.cp_solver_name != "ortools" else workers
+        self.configurations = self.all_configurations()
+        if num_of_samples is not None and num_of_samples < len(self.configurations):
+            # Keep the default configuration as the reference
+            self.configurations = self.configurations[:1] + random.Random(seed).sample(self.configurations[1:], num_of_samples - 1)
+        self.runs = []
+
+    @classmethod
+    def search_annotation(cls, order, variable_choice):
+        """
+        Return the MiniZinc search annotation that branches on the groups of order in turn
+        """
+
+        if order is None:
+            return "seq_search([])"
+        return "seq_search([{}])".format(", ".join("int_search({}, {}, indomain_max)".format(cls.decision_variables[group], variable_choice)
+                                                  for group in cls.orders[order]))
+
+    def all_configurations(self):
+        """
+        List the configurations for the selected solver, starting with the default configuration
+        """
+
+        searches = [("default", None, None)] + [("{}/{}".format(order, variable_choice), order, variable_choice)
+                                                for order, variable_choice in itertools.product(self.orders, self.variable_choices)]
+        restarts = self.restart_annotations if self.cp_solver_name in self.restart_solvers else self.restart_annotations[:1]
+        free_searches = [False, True] if self.cp_solver_name in self.free_search_solvers else [False]
+        configurations = []
+        for (name, order, variable_choice), restart, free_search, workers in itertools.product(searches, restarts, free_searches, self.workers):
+            configuration = {"name": name,
+                             "search_annotation": self.search_annotation(order, variable_choice),
+                             "restart_annotation": restart,
+                             "solver_flags": {"free_search": True} if free_search else {}}
+            if restart != "restart_none":
+                configuration["name"] += "/" + restart
+            if free_search:
+                configuration["name"] += "/free"
+            if len(self.workers) > 1:
+                # Only a tuned number of threads is stored in the profile
+                configuration["name"] += "/{}t".format(workers)
+                configuration["num_of_threads"] = workers
+            configurations.append(configuration)
+        return configurations
+
+    async def run_async(self):
+        """
+        Run every configuration on every training instance and return the ranked configurations
+        """
+
+        import minizinc
+        base = IntegralDistinguisher(self.params)
+        cp_solver = lookup_solver(base.cp_solver_name)
+        cp_model = minizinc.Model()
+        cp_model.add_file(base.mzn_file_name)
+        max_concurrent = self.max_concurrent
+        if max_concurrent is None:
+            max_concurrent = max(1, (os.cpu_count() or 1) // max(self.workers))
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def run_one(configuration, RU, RL):
+            params = dict(self.params)
+            params.update(RU=RU, RL=RL, search_profile=configuration)
+            distinguisher = IntegralDistinguisher(params)
+            distinguisher.cp_solver = cp_solver
+            async with semaphore:
+                search_result = await distinguisher.solve_async(cp_model=cp_model, monitor_memory=False)
+            return {"configuration": configuration["name"], "RU": RU, "RL": RL, "status": search_result.status,
+                    "objective": search_result.objective, "elapsed_time": search_result.record["elapsed_time"]}
+        self.runs = await asyncio.gather(*[run_one(configuration, RU, RL) for configuration in self.configurations
+                                           for RU, RL in self.training_set])
+        return self.ranking()
+
+    def run(self):
+        """
+        Blocking version of run_async
+        """
+
+        return asyncio.run(self.run_async())
+
+    def ranking(self):
+        """
+        Score every configuration on the training set, the best configuration first
+        """
+
+        best_objective = dict()
+        for run in self.runs:
+            if run["objective"] is not None:
+                key = (run["RU"], run["RL"])
+                best_objective[key] = max(best_objective.get(key, 0), run["objective"])
+        time_limit = self.params["time_limit"]
+        scores = {configuration["name"]: {"configuration": configuration, "solved": 0, "par2": 0.0, "gap": 0}
+                  for configuration in self.configurations}
+        for run in self.runs:
+            score = scores[run["configuration"]]
+            proven = run["status"] in ["OPTIMAL_SOLUTION", "UNSATISFIABLE"]
+            score["solved"] += proven
+            score["par2"] += run["elapsed_time"] if proven or time_limit in [None, -1] else 2*time_limit
+            score["gap"] += best_objective.get((run["RU"], run["RL"]), 0) - (run["objective"] or 0)
+        return sorted(scores.values(), key=lambda score: (-score["solved"], score["par2"], score["gap"]))
+
+    def write_profile(self, ranking, file_name=None):
+        """
+        Store the best configuration as the profile of the solver, keeping the profiles of the other solvers
+        """
+
+        file_name = self.profile_file_name if file_name is None else file_name
+        profiles = {"variant": cipher_variant, "profiles": dict()}
+        if os.path.exists(file_name):
+            with open(file_name, "r") as profile_file:
+                existing = json.load(profile_file)
+            if existing.get("variant") == cipher_variant:
+                profiles = existing
+        best = ranking[0]
+        profile = dict(best["configuration"])
+        profile.update(training_set=[list(instance) for instance in self.training_set], time_limit=self.params["time_limit"],
+                       KR=self.params["KR"], solved=best["solved"], par2=best["par2"])
+        profiles["profiles"][self.cp_solver_name] = profile
+        with open(file_name, "w") as profile_file:
+            json.dump(profiles, profile_file, indent=4)
+        return profile
+
+    @classmethod
+    def load_profile(cls, cp_solver_name, file_name=None):
+        """
+        Return the tuned profile of a solver (None if the solver has not been tuned)
+        """
+
+        file_name = cls.profile_file_name if file_name is None else file_name
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, "r") as profile_file:
+            profiles = json.load(profile_file)
+        if profiles.get("variant", cipher_variant) != cipher_variant:
+            return None
+        return profiles["profiles"].get(cp_solver_name)
+
+    def print_ranking(self, ranking, num_of_lines=None):
+        """
+        Print the scores of the configurations
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Autotuning {} on {} instances ({} configurations):\n".format(self.cp_solver_name, len(self.training_set), len(self.configurations))
+        str_output += "{:<72}{:>8}{:>12}{:>6}\n".format("Configuration", "Solved", "PAR2 (s)", "Gap")
+        for score in ranking[:num_of_lines]:
+            str_output += "{:<72}{:>8}{:>12.02f}{:>6}\n".format(score["configuration"]["name"], "{}/{}".format(score["solved"], len(self.training_set)),
+                                                              score["par2"], score["gap"])
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and tune the solver
+    '''
+
+    parser = ArgumentParser(description="This tool tunes the search annotation, the restart policy and the solver flags for Qarma-v2-128\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-train", default=None, type=str, nargs="*",
+                        help="training instances as RU,RL (default: {})\n".format(" ".join("{},{}".format(*instance) for instance in Autotuner.default_training_set)))
+    parser.add_argument("-KR", default=16, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-sl", default="ortools", type=str,
+                        choices=['gecode', 'chuffed', 'cbc', 'gurobi', 'picat', 'scip', 'choco', 'ortools'],
+                        help="choose a cp solver\n")
+    parser.add_argument("-p", default=2, type=int, help="number of threads of every run\n")
+    parser.add_argument("-workers", default=None, type=int, nargs="*", help="numbers of threads tried with ortools (default: -p)\n")
+    parser.add_argument("-tl", default=60, type=int, help="time limit of every run in seconds\n")
+    parser.add_argument("-j", default=None, type=int, help="number of runs in parallel (default: number of CPUs / threads)\n")
+    parser.add_argument("-n", default=None, type=int, help="number of randomly sampled configurations (default: all)\n")
+    parser.add_argument("-seed", default=0, type=int, help="seed of the sampling of the configurations\n")
+    parser.add_argument("-o", default=Autotuner.profile_file_name, type=str, help="profile file to which the best configuration is written\n")
+    args = parser.parse_args()
+    params = default_parameters()
+    params.update(KR=args.KR, NPT=args.NPT, cp_solver_name=args.sl, num_of_threads=args.p, time_limit=args.tl, tuned_profile=False)
+    training_set = None if args.train is None else [tuple(map(int, instance.split(","))) for instance in args.train]
+    tuner = Autotuner(params, training_set=training_set, max_concurrent=args.j, workers=args.workers, num_of_samples=args.n, seed=args.seed)
+    ranking = tuner.run()
+    print(tuner.print_ranking(ranking))
+    profile = tuner.write_profile(ranking, args.o)
+    print("Profile of {} written to {}: {}".format(args.sl, args.o, profile["name"]))
+
+if __name__ == "__main__":
+    main()
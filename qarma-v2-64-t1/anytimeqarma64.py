@@ -0,0 +1,213 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import json
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+line_separator = "#"*55
+
+class AnytimeTraces:
+    """
+    Aggregate the objective-versus-time traces written by distinguisherqarma64.py -trace
+
+    A run is scored against the best objective known for its instance (variant, RU, RL, KR, NPT,
+    tweakey interpretation) over all runs: its anytime curve is the best objective found up to time t
+    divided by the best known objective, on the horizon [0, T] of the instance (the largest time limit
+    of its runs, or their largest elapsed time without time limit). The area under the curve, divided
+    by T, is 1 for a run that finds the best known objective immediately and 0 for a run without solution.
+    The traces of different variants can be mixed.
+    """
+
+    def __init__(self, records, num_of_points=65) -> None:
+        self.records = [record for record in records if "status" in record]
+        self.num_of_points = num_of_points
+        self.best_objective = dict()
+        self.horizon = dict()
+        for record in self.records:
+            key = self.instance_key(record)
+            objectives = [entry["objective"] for entry in record.get("trace", [])]
+            if record.get("objective") is not None:
+                objectives.append(record["objective"])
+            self.best_objective[key] = max([self.best_objective.get(key, 0)] + objectives)
+            run_horizon = record["time_limit"] if record.get("time_limit") not in [None, -1] else record["elapsed_time"]
+            self.horizon[key] = max(self.horizon.get(key, 0.0), float(run_horizon))
+
+    @classmethod
+    def load(cls, file_names, num_of_points=65):
+        """
+        Read the run records of one or more JSON lines files
+        """
+
+        records = []
+        for file_name in file_names:
+            with open(file_name, "r") as trace_file:
+                records += [json.loads(line) for line in trace_file if line.strip() != ""]
+        return cls(records, num_of_points)
+
+    @staticmethod
+    def instance_key(record):
+        return (record.get("variant", "-"), record["RU"], record["RL"], record["KR"], record["NPT"], record.get("tk_interpretation", "-"))
+
+    @staticmethod
+    def group_key(record):
+        """
+        Runs of the same variant and round counts with the same solver configuration form a group
+        """
+
+        configuration = "{}/{}t/{}".format(record["cp_solver_name"], record["num_of_threads"], record.get("encoding", "int"))
+        if record.get("backend", "minizinc") != "minizinc":
+            configuration += "/" + record["backend"]
+        if record.get("mix_column_table"):
+            configuration += "/table"
+        if record.get("search_profile"):
+            configuration += "/" + record["search_profile"]
+        if record.get("implied_constraints"):
+            configuration += "/" + "+".join(record["implied_constraints"])
+        return (record.get("variant", "-"), record["RU"], record["RL"], configuration)
+
+    def incumbents(self, record):
+        """
+        Return the times and the normalized objectives at which the incumbent of a run improves
+        """
+
+        best_objective = self.best_objective[self.instance_key(record)]
+        times, values = [], []
+        for entry in sorted(record.get("trace", []), key=lambda entry: entry["elapsed_time"]):
+            value = entry["objective"]/best_objective if best_objective > 0 else 0.0
+            if values == [] or value > values[-1]:
+                times.append(entry["elapsed_time"])
+                values.append(value)
+        return np.array(times, dtype=np.float64), np.array(values, dtype=np.float64)
+
+    def curve(self, record):
+        """
+        Sample the anytime curve of a run on num_of_points equidistant times of its horizon
+        """
+
+        times, values = self.incumbents(record)
+        grid = np.linspace(0.0, self.horizon[self.instance_key(record)], self.num_of_points)
+        index = np.searchsorted(times, grid, side="right") - 1
+        return grid, np.where(index >= 0, values[np.maximum(index, 0)] if len(values) > 0 else 0.0, 0.0)
+
+    def area_under_curve(self, record):
+        """
+        Integrate the step function of the incumbents exactly over the horizon (normalized to [0, 1])
+        """
+
+        horizon = self.horizon[self.instance_key(record)]
+        if horizon <= 0:
+            return 0.0
+        times, values = self.incumbents(record)
+        ends = np.append(times[1:], horizon)
+        return float(np.sum(values*np.clip(np.minimum(ends, horizon) - times, 0.0, None)) / horizon)
+
+    def time_to_best(self, record):
+        """
+        Return the first time at which a run reaches the best known objective of its instance (None if never)
+        """
+
+        times, values = self.incumbents(record)
+        reached = np.flatnonzero(values >= 1.0)
+        return float(times[reached[0]]) if len(reached) > 0 else None
+
+    def aggregate(self):
+        """
+        Average the curves and the scores of every group of runs
+        """
+
+        groups = dict()
+        for record in self.records:
+            groups.setdefault(self.group_key(record), []).append(record)
+        summary = dict()
+        for key in sorted(groups, key=str):
+            runs = groups[key]
+            curves = np.array([self.curve(record)[1] for record in runs])
+            scores = np.array([self.area_under_curve(record) for record in runs])
+            reached = [self.time_to_best(record) for record in runs]
+            summary[key] = {"num_of_runs": len(runs),
+                            "auc_mean": float(scores.mean()),
+                            "auc_std": float(scores.std()),
+                            "num_of_best": sum(time is not None for time in reached),
+                            "time_to_best": float(np.median([time for time in reached if time is not None])) if any(time is not None for time in reached) else None,
+                            "fraction": np.linspace(0.0, 1.0, self.num_of_points),
+                            "curve": curves.mean(axis=0)}
+        return summary
+
+    def print_summary(self, summary):
+        """
+        Print the scores of every group, the best groups of every instance first
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Anytime performance ({} runs):\n".format(len(self.records))
+        str_output += "{:<18}{:>4}{:>4}  {:<36}{:>6}{:>14}{:>8}{:>16}\n".format("Variant", "RU", "RL", "Configuration", "Runs",
+                                                                               "AUC", "Best", "Time to best")
+        order = sorted(summary, key=lambda key: (key[0], key[1], key[2], -summary[key]["auc_mean"]))
+        for key in order:
+            group = summary[key]
+            str_output += "{:<18}{:>4}{:>4}  {:<36}{:>6}{:>8.03f}±{:<5.03f}{:>8}{:>16}\n".format(key[0], key[1], key[2], key[3], group["num_of_runs"],
+                group["auc_mean"], group["auc_std"], "{}/{}".format(group["num_of_best"], group["num_of_runs"]),
+                "-" if group["time_to_best"] is None else "{:0.02f} s".format(group["time_to_best"]))
+        str_output += line_separator
+        return str_output
+
+    def write_csv(self, summary, file_name):
+        """
+        Write the mean anytime curve of every group (time as a fraction of the horizon) for plotting
+        """
+
+        with open(file_name, "w") as csv_file:
+            csv_file.write("variant,RU,RL,configuration,fraction,score\n")
+            for key, group in summary.items():
+                for fraction, score in zip(group["fraction"], group["curve"]):
+                    csv_file.write("{},{},{},{},{:0.04f},{:0.06f}\n".format(key[0], key[1], key[2], key[3], fraction, score))
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and aggregate the traces
+    '''
+
+    parser = ArgumentParser(description="This tool aggregates the objective-versus-time traces of integral distinguisher searches into anytime curves\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("traces", nargs="+", type=str, help="JSON lines files written with -trace\n")
+    parser.add_argument("-n", default=65, type=int, help="number of sampling points of the anytime curves\n")
+    parser.add_argument("-csv", default=None, type=str, help="CSV file to which the mean anytime curves are written\n")
+    args = parser.parse_args()
+    traces = AnytimeTraces.load(args.traces, num_of_points=args.n)
+    summary = traces.aggregate()
+    print(traces.print_summary(summary))
+    if args.csv is not None:
+        traces.write_csv(summary, args.csv)
+
+if __name__ == "__main__":
+    main()
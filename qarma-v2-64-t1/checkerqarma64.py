@@ -0,0 +1,288 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import math
+import itertools
+import sys
+import time
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from storageqarma64 import ResultArchive
+line_separator = "#"*55
+
+class CertificateChecker:
+    """
+    Independent check of the results of distinguisherqarma64.mzn
+
+    Every constraint of the model is evaluated on the returned assignment as a relation: the
+    masks and classes of every round transition (sb_operation and the xor chains of mix_column),
+    the subtweakey activity derived from tk_permutation_per_round, the counts no_of_any_or_nonzero
+    and no_of_only_nonzero, contradict, the objective and the conditions on the input and output
+    masks. Neither the solver nor the propagator is used. All checks are vectorized over a batch
+    of results, so that a whole archive is checked at once.
+    """
+
+    tweakey_permutation = np.array([1, 10, 14, 6, 2, 9, 13, 5, 0, 8, 12, 4, 3, 11, 15, 7])
+    inv_tweakey_permutation = np.array([8, 0, 4, 12, 11, 7, 3, 15, 9, 5, 1, 13, 10, 6, 2, 14])
+    state_permutation = np.array([0, 11, 6, 13, 10, 1, 12, 7, 5, 14, 3, 8, 15, 4, 9, 2])
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=None) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        tk_interpretation restricts round 1 of tk_permutation_per_round to one interpretation (None accepts all three)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.max_ru_rl = max(self.RU, self.RL, 2)
+        min_ru_rl = min(self.RU, self.RL)
+        tk_starts = [self.max_ru_rl - 1, min_ru_rl - 1, math.ceil((self.KR - 2) / 2) - 1]
+        self.tk_starts = tk_starts if tk_interpretation is None else [tk_starts[tk_interpretation]]
+        self.shapes = {name: shape for name, shape, _ in ResultArchive(RU, RL, KR, NPT).schema()}
+        # columns[j, k] is the cell in row k of column j before mix_column, and rows[j, k] the cell after it
+        self.columns = np.array([[self.state_permutation[4*k + j] for k in range(4)] for j in range(4)])
+        self.rows = np.array([[4*k + j for k in range(4)] for j in range(4)])
+
+    #############################################################################################################################################
+    # Collecting the variables
+
+    def fields(self, results):
+        """
+        Stack the variables of a batch of results (minizinc.Result or PackedResult) into arrays of shape (N, ...)
+        """
+
+        return {name: np.array([np.asarray(result[name], dtype=np.int64).reshape(shape) for result in results],
+                               dtype=np.int64).reshape((len(results),) + shape) for name, shape in self.shapes.items()}
+
+    def archive_fields(self, archive, start=0, stop=None):
+        """
+        Unpack the variables of the records start..stop of an archive into arrays of shape (N, ...)
+        """
+
+        records = archive.records[start:stop]
+        return {name: np.asarray(archive.unpack_field(records, name), dtype=np.int64) for name in self.shapes}
+
+    #############################################################################################################################################
+    # Predicates of the model
+
+    @staticmethod
+    def link_mask_class(mask, cls):
+        return np.select([mask == 0, mask == 1, mask == 2, mask == 3],
+                         [cls == 0, (cls > 0) & (cls <= 15), cls == -1, cls == -2], default=False)
+
+    @staticmethod
+    def sb_operation(mask_in, mask_out):
+        return (mask_out != 1) & np.isin(mask_in + mask_out, [0, 3, 4, 6]) & (mask_out >= mask_in) & (mask_out - mask_in <= 1)
+
+    @staticmethod
+    def xor_operation(mask_a, class_a, mask_b, class_b, mask_c, class_c):
+        mask_sum = mask_a + mask_b
+        conditions = [mask_sum > 2,
+                      mask_sum == 1,
+                      (mask_a == 0) & (mask_b == 0),
+                      class_a + class_b < 0,
+                      class_a == class_b]
+        expected_mask = np.select(conditions, [3, 1, 0, 2, 0], default=1)
+        expected_class = np.select(conditions, [-2, class_a + class_b, 0, -1, 0], default=np.bitwise_xor(class_a, class_b))
+        return (mask_c == expected_mask) & (class_c == expected_class)
+
+    def mix_column(self, in_mask, in_class, out_mask, out_class, aux_mask, aux_class):
+        """
+        Check mix_column on all columns of a state; in/out have shape (..., 16) and aux (..., 4, 2)
+
+        Returns an array of shape (..., 4, 6): column, then the six xor operations of mix_column
+        """
+
+        a = [(in_mask[..., self.columns[:, k]], in_class[..., self.columns[:, k]]) for k in range(4)]
+        b = [(out_mask[..., self.rows[:, k]], out_class[..., self.rows[:, k]]) for k in range(4)]
+        aux = [(aux_mask[..., k], aux_class[..., k]) for k in range(2)]
+        return np.stack([self.xor_operation(*a[2], *a[3], *aux[0]),
+                         self.xor_operation(*a[1], *aux[0], *b[0]),
+                         self.xor_operation(*a[0], *aux[0], *b[1]),
+                         self.xor_operation(*a[0], *a[1], *aux[1]),
+                         self.xor_operation(*aux[1], *a[3], *b[2]),
+                         self.xor_operation(*aux[1], *a[2], *b[3])], axis=-1)
+
+    #############################################################################################################################################
+    # Checks
+
+    def violations(self, fields):
+        """
+        Evaluate every constraint of the model on a batch of assignments
+
+        Returns a dictionary mapping the name of every constraint to a boolean array of shape (N, ...)
+        that is True where the constraint is violated
+        """
+
+        f = fields
+        num_of_results = len(f["inputmask_distinguisher"])
+        bad = dict()
+        # Tweakey schedule
+        tkp_sequence = f["tkp_sequence"]
+        tk_permutation_per_round = f["tk_permutation_per_round"]
+        bad["tkp_sequence"] = np.concatenate([tkp_sequence[:, :1] != np.arange(16),
+                                              tkp_sequence[:, 1:] != self.tweakey_permutation[np.clip(tkp_sequence[:, :-1], 0, 15)]], axis=1)
+        expected = np.zeros(tk_permutation_per_round.shape, dtype=np.int64)
+        expected[:, 0] = np.arange(16)
+        start_matches = [(tk_permutation_per_round[:, 1] == tkp_sequence[:, tk_start]).all(axis=-1) for tk_start in self.tk_starts]
+        expected[:, 1] = np.where(np.any(start_matches, axis=0)[:, None], tk_permutation_per_round[:, 1], tkp_sequence[:, self.tk_starts[0]])
+        tk = np.clip(tk_permutation_per_round, 0, 15)
+        expected[:, 2::2] = self.tweakey_permutation[tk[:, 0:-2:2]]
+        expected[:, 3::2] = self.inv_tweakey_permutation[tk[:, 1:-2:2]]
+        bad["tk_permutation_per_round"] = tk_permutation_per_round != expected
+        for direction, state in itertools.product(["forward", "backward"], ["x", "sbx", "aux"]):
+            mask_name = "{}_mask_{}".format(direction, state)
+            bad["link_mask_class ({})".format(mask_name)] = ~self.link_mask_class(f[mask_name], f["{}_class_{}".format(direction, state)])
+        # EU
+        bad["sb_operation (EU)"] = ~self.sb_operation(f["forward_mask_x"][:, :self.RU], f["forward_mask_sbx"])
+        bad["mix_column (EU)"] = ~self.mix_column(f["forward_mask_sbx"], f["forward_class_sbx"],
+                                                  f["forward_mask_x"][:, 1:], f["forward_class_x"][:, 1:],
+                                                  f["forward_mask_aux"], f["forward_class_aux"])
+        # EL
+        bad["sb_operation (EL)"] = ~self.sb_operation(f["backward_mask_x"], f["backward_mask_sbx"])
+        bad["mix_column (EL)"] = ~self.mix_column(f["backward_mask_sbx"][:, :self.RL], f["backward_class_sbx"][:, :self.RL],
+                                                  f["backward_mask_x"][:, 1:], f["backward_class_x"][:, 1:],
+                                                  f["backward_mask_aux"], f["backward_class_aux"])
+        # Subtweakeys: the cell j of round r meets the tweak cell tk_permutation_per_round[r, j]
+        any_or_nonzero = f["any_or_nonzero_subtweakey"]
+        only_nonzero = f["only_nonzero_subtweakeys"]
+        forward_index = np.broadcast_to(tk[:, :self.RU, None, :], (num_of_results, self.RU, 2, 16))
+        forward_mask = f["forward_mask_sbx"][:, :, None, :]
+        bad["subtweakey (EU)"] = ((np.take_along_axis(any_or_nonzero[:, :self.RU], forward_index, axis=-1) != (forward_mask != 0)) |
+                                  (np.take_along_axis(only_nonzero[:, :self.RU], forward_index, axis=-1) != ((forward_mask == 1) | (forward_mask == 2))))
+        backward_rounds = self.RD - 1 - np.arange(self.RL)
+        backward_index = np.broadcast_to(tk[:, backward_rounds, None, :], (num_of_results, self.RL, 2, 16))
+        backward_mask = f["backward_mask_sbx"][:, :self.RL]
+        bad["subtweakey (EL)"] = ((np.take_along_axis(any_or_nonzero[:, backward_rounds], backward_index, axis=-1) != (backward_mask != 0)) |
+                                  (np.take_along_axis(only_nonzero[:, backward_rounds], backward_index, axis=-1) != ((backward_mask == 1) | (backward_mask == 2))))
+        # Tweakey contradiction, indexed by [branch, tweak cell]
+        no_of_any_or_nonzero = any_or_nonzero.sum(axis=1)
+        no_of_only_nonzero = only_nonzero.sum(axis=1)
+        bad["no_of_any_or_nonzero"] = f["no_of_any_or_nonzero"] != no_of_any_or_nonzero
+        bad["no_of_only_nonzero"] = f["no_of_only_nonzero"] != no_of_only_nonzero
+        contradict = (((no_of_any_or_nonzero <= self.NPT) & (no_of_only_nonzero >= 1)) | (no_of_any_or_nonzero == 0)).astype(np.int64)
+        bad["contradict"] = f["contradict"] != contradict
+        bad["lazy tweak cell"] = ~((contradict[:, 0] + contradict[:, 1]) == 2).any(axis=-1)
+        # Input and output masks
+        input_mask = f["forward_mask_x"][:, 0]
+        output_mask = f["backward_mask_x"][:, 0]
+        bad["input mask"] = ~np.isin(input_mask, [0, 3])
+        bad["inputmask_distinguisher"] = (f["inputmask_distinguisher"] != input_mask.sum(axis=-1)) | (f["inputmask_distinguisher"] < 1)
+        bad["outputmask_distinguisher"] = (f["outputmask_distinguisher1"] != output_mask[:, 0].sum(axis=-1)) | \
+                                          (f["outputmask_distinguisher2"] != output_mask[:, 1].sum(axis=-1)) | \
+                                          (f["outputmask_distinguisher1"] == 0) | (f["outputmask_distinguisher2"] == 0)
+        same_column = ((output_mask.reshape(num_of_results, 2, 4, 4) == 1).any(axis=2)).all(axis=1).any(axis=-1)
+        bad["output cells"] = ~same_column | (output_mask.sum(axis=-1) > 1).any(axis=-1) | (output_mask[:, 0] == output_mask[:, 1]).all(axis=-1)
+        return bad
+
+    def check_fields(self, fields):
+        """
+        Return whether every assignment of a batch is valid and, for every constraint, which assignments violate it
+        """
+
+        violated = {name: bad.reshape(bad.shape[0], -1).any(axis=1) for name, bad in self.violations(fields).items()}
+        valid = ~np.any(list(violated.values()), axis=0)
+        return valid, violated
+
+    def check(self, result):
+        """
+        Check one result and list its violated constraints with the index of the first violation
+        """
+
+        messages = []
+        for name, bad in self.violations(self.fields([result])).items():
+            if bad.any():
+                messages.append("{} at {}".format(name, tuple(int(i) for i in np.argwhere(bad[0])[0]) if bad.ndim > 1 else "()"))
+        return messages
+
+    def check_archive(self, archive, chunk_size=65536):
+        """
+        Check all records of an archive chunk by chunk
+        """
+
+        valid = np.zeros(len(archive), dtype=bool)
+        violated = dict()
+        for start in range(0, len(archive), chunk_size):
+            chunk_valid, chunk_violated = self.check_fields(self.archive_fields(archive, start, start + chunk_size))
+            valid[start:start + chunk_size] = chunk_valid
+            for name, indices in chunk_violated.items():
+                violated.setdefault(name, np.zeros(len(archive), dtype=bool))[start:start + chunk_size] = indices
+        return valid, violated
+
+    def print_archive_summary(self, file_name, valid, violated, elapsed_time):
+        """
+        Print the outcome of check_archive
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Certificate check of {}:\n".format(file_name)
+        str_output += "Number of results:                           {}\n".format(len(valid))
+        str_output += "Number of valid results:                     {}\n".format(int(valid.sum()))
+        for name, indices in violated.items():
+            if indices.any():
+                str_output += "Violated {:<36}{} results (first: {})\n".format(name + ":", int(indices.sum()), int(np.flatnonzero(indices)[0]))
+        str_output += "Elapsed time:                                {:0.03f} seconds ({:0.03f} ms per result)\n".format(elapsed_time, 1000*elapsed_time/max(1, len(valid)))
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and check the results of one or more archives
+    '''
+
+    parser = ArgumentParser(description="This tool independently checks the results of integral distinguisher searches for Qarma-v2-64\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("archives", nargs="+", type=str, help="packed archives written with -ar\n")
+    parser.add_argument("-tki", default=None, type=int, choices=[0, 1, 2],
+                        help="tweakey interpretation the results were searched with\n"
+                             "(default: the one stored in the archive, or accept all for archives without it)\n")
+    parser.add_argument("-v", default=False, action="store_true", help="list the violated constraints of every invalid result\n")
+    args = parser.parse_args()
+    all_valid = True
+    for file_name in args.archives:
+        start_time = time.time()
+        archive = ResultArchive.load(file_name)
+        checker = CertificateChecker(archive.RU, archive.RL, archive.KR, archive.NPT, tk_interpretation=args.tki if args.tki is not None else archive.tk_interpretation)
+        valid, violated = checker.check_archive(archive)
+        print(checker.print_archive_summary(file_name, valid, violated, time.time() - start_time))
+        if args.v:
+            for index in np.flatnonzero(~valid):
+                print("Result {}: {}".format(index, "; ".join(checker.check(archive[index]))))
+        all_valid = all_valid and bool(valid.all())
+    return 0 if all_valid else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+
+import time
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from propagatorqarma64 import MaskPropagator, line_separator
+
+class CpSatResult:
+    """
+    Outcome of CpSatModel.solve: the status (named like minizinc.Status), the values of the variables
+    of distinguisherqarma64.mzn (solution, None without solution) and the solver statistics
+
+    It supports the item access of minizinc.Result (result["forward_mask_x"], ...), hence it can be used
+    in place of a solver result by print_attack_parameters, Draw, ResultArchive and CertificateChecker.
+    """
+
+    def __init__(self, status, solution=None, statistics=None) -> None:
+        self.status = status
+        self.solution = solution
+        self.statistics = dict() if statistics is None else statistics
+
+    def __getitem__(self, name):
+        return self.solution[name]
+
+    def __contains__(self, name):
+        return self.solution is not None and name in self.solution
+
+    @property
+    def objective(self):
+        return None if self.solution is None else self.solution["inputmask_distinguisher"]
+
+class CpSatModel:
+    """
+    Native OR-Tools CP-SAT version of distinguisherqarma64.mzn, built without MiniZinc and FlatZinc
+
+    The variables keep the names, shapes and domains of the MiniZinc model. The relations on small
+    domains (link_mask_class, sb_operation, mix_column and the link between the subtweakeys and the
+    state) are table constraints, mix_column over the precomputed relation of mixcolumnqarma64.py
+    restricted to the column states that sb_operation can produce. The subtweakey activities and the
+    contradiction are boolean literals, so that the counts are only compared with NPT once per tweak cell.
+    """
+
+    statuses = {"OPTIMAL": "OPTIMAL_SOLUTION", "FEASIBLE": "SATISFIED", "INFEASIBLE": "UNSATISFIABLE",
+                "MODEL_INVALID": "ERROR", "UNKNOWN": "UNKNOWN"}
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=2) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        # The asserts of the MiniZinc model on RU, RL and tk_interpretation
+        assert(RU >= 1 and RL >= 1)
+        assert(tk_interpretation in range(3))
+        from ortools.sat.python import cp_model
+        self.cp_model = cp_model
+        self.propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.model = cp_model.CpModel()
+        self.solver = None
+        self.variables = dict()
+        self.build_time = None
+
+    #############################################################################################################################################
+    # Relations of the model as tables
+
+    @staticmethod
+    def link_mask_class_table():
+        return [(0, 0)] + [(1, cell_class) for cell_class in range(1, 16)] + [(2, -1), (3, -2)]
+
+    @staticmethod
+    def sb_operation_table():
+        return [(mask_in, mask_out) for mask_in in range(4) for mask_out in range(4)
+                if mask_out != 1 and mask_in + mask_out in [0, 3, 4, 6] and 0 <= mask_out - mask_in <= 1]
+
+    @staticmethod
+    def subtweakey_table():
+        """
+        Rows (mask of the state cell, any_or_nonzero_subtweakey, only_nonzero_subtweakeys)
+        """
+
+        return [(0, 0, 0), (1, 1, 1), (2, 1, 1), (3, 1, 0)]
+
+    def mix_column_table(self):
+        """
+        Rows of the relation of mix_column whose input cells are outputs of sb_operation
+        (the inputs of mix_column are always the state after sb_operation)
+        """
+
+        transitions = self.propagator.mix_column_table.transitions()
+        sb_image = sorted(set(mask_out for _, mask_out in self.sb_operation_table()))
+        return transitions[np.isin(transitions[:, [0, 2, 4, 6]], sb_image).all(axis=1)].tolist()
+
+    #############################################################################################################################################
+    # Model
+
+    def new_array(self, name, shape, lower, upper):
+        """
+        Create an array of integer variables named like the variables of the MiniZinc model
+        """
+
+        array = np.empty(shape, dtype=object)
+        for index in np.ndindex(shape):
+            array[index] = self.model.new_int_var(lower, upper, "{}[{}]".format(name, ",".join(map(str, index))))
+        self.variables[name] = array
+        return array
+
+    def new_mask_class_arrays(self, direction, state, shape):
+        mask = self.new_array("{}_mask_{}".format(direction, state), shape, 0, 3)
+        cls = self.new_array("{}_class_{}".format(direction, state), shape, -2, 15)
+        for index in np.ndindex(shape):
+            self.model.add_allowed_assignments([mask[index], cls[index]], self.link_mask_class)
+        return mask, cls
+
+    def mix_column(self, in_mask, in_class, out_mask, out_class, aux_mask, aux_class):
+        """
+        Add mix_column on one column: four input cells, four output cells and two auxiliary cells
+        """
+
+        arguments = []
+        for mask, cls in zip(list(in_mask) + list(out_mask) + list(aux_mask), list(in_class) + list(out_class) + list(aux_class)):
+            arguments += [mask, cls]
+        self.model.add_allowed_assignments(arguments, self.mix_column_transitions)
+
+    def build(self):
+        """
+        Build the constraints of distinguisherqarma64.mzn
+        """
+
+        start_time = time.time()
+        model = self.model
+        self.link_mask_class = self.link_mask_class_table()
+        self.mix_column_transitions = self.mix_column_table()
+        sb_operation = self.sb_operation_table()
+        subtweakey = self.subtweakey_table()
+        tk_permutation_per_round = self.propagator.tk_permutation_per_round
+        state_permutation = self.propagator.state_permutation
+        # Tweakey schedule
+        any_or_nonzero_subtweakey = np.empty((self.RD, 2, 16), dtype=object)
+        only_nonzero_subtweakeys = np.empty((self.RD, 2, 16), dtype=object)
+        for index in np.ndindex(any_or_nonzero_subtweakey.shape):
+            any_or_nonzero_subtweakey[index] = model.new_bool_var("any_or_nonzero_subtweakey[{},{},{}]".format(*index))
+            only_nonzero_subtweakeys[index] = model.new_bool_var("only_nonzero_subtweakeys[{},{},{}]".format(*index))
+        self.variables["any_or_nonzero_subtweakey"] = any_or_nonzero_subtweakey
+        self.variables["only_nonzero_subtweakeys"] = only_nonzero_subtweakeys
+        # EU
+        forward_mask_x, forward_class_x = self.new_mask_class_arrays("forward", "x", (self.RU + 1, 16))
+        forward_mask_sbx, forward_class_sbx = self.new_mask_class_arrays("forward", "sbx", (self.RU, 16))
+        forward_mask_aux, forward_class_aux = self.new_mask_class_arrays("forward", "aux", (self.RU, 4, 2))
+        for i in range(16):
+            # forward_mask_x[0, i] in {0, 3}
+            model.add_linear_expression_in_domain(forward_mask_x[0, i], self.cp_model.Domain.from_values([0, 3]))
+        inputmask_distinguisher = self.new_array("inputmask_distinguisher", (), 0, 48)
+        model.add(inputmask_distinguisher[()] == sum(forward_mask_x[0]))
+        model.add(inputmask_distinguisher[()] >= 1)
+        for r in range(self.RU):
+            for i in range(16):
+                model.add_allowed_assignments([forward_mask_x[r, i], forward_mask_sbx[r, i]], sb_operation)
+            for j in range(4):
+                columns = [state_permutation[4*k + j] for k in range(4)]
+                self.mix_column(forward_mask_sbx[r, columns], forward_class_sbx[r, columns],
+                                forward_mask_x[r + 1, j::4], forward_class_x[r + 1, j::4],
+                                forward_mask_aux[r, j], forward_class_aux[r, j])
+            for i in range(2):
+                for j in range(16):
+                    t = tk_permutation_per_round[r, j]
+                    model.add_allowed_assignments([forward_mask_sbx[r, j], any_or_nonzero_subtweakey[r, i, t],
+                                                   only_nonzero_subtweakeys[r, i, t]], subtweakey)
+        # EL
+        backward_mask_x, backward_class_x = self.new_mask_class_arrays("backward", "x", (self.RL + 1, 2, 16))
+        backward_mask_sbx, backward_class_sbx = self.new_mask_class_arrays("backward", "sbx", (self.RL + 1, 2, 16))
+        backward_mask_aux, backward_class_aux = self.new_mask_class_arrays("backward", "aux", (self.RL, 2, 4, 2))
+        outputmask_distinguisher1 = self.new_array("outputmask_distinguisher1", (), 0, 48)
+        outputmask_distinguisher2 = self.new_array("outputmask_distinguisher2", (), 0, 48)
+        model.add(outputmask_distinguisher1[()] == sum(backward_mask_x[0, 0]))
+        model.add(outputmask_distinguisher2[()] == sum(backward_mask_x[0, 1]))
+        for r in range(self.RL + 1):
+            for i in range(2):
+                for j in range(16):
+                    model.add_allowed_assignments([backward_mask_x[r, i, j], backward_mask_sbx[r, i, j]], sb_operation)
+        for r in range(self.RL):
+            for i in range(2):
+                for j in range(4):
+                    columns = [state_permutation[4*k + j] for k in range(4)]
+                    self.mix_column(backward_mask_sbx[r, i, columns], backward_class_sbx[r, i, columns],
+                                    backward_mask_x[r + 1, i, j::4], backward_class_x[r + 1, i, j::4],
+                                    backward_mask_aux[r, i, j], backward_class_aux[r, i, j])
+                for j in range(16):
+                    t = tk_permutation_per_round[self.RD - r - 1, j]
+                    model.add_allowed_assignments([backward_mask_sbx[r, i, j], any_or_nonzero_subtweakey[self.RD - r - 1, i, t],
+                                                   only_nonzero_subtweakeys[self.RD - r - 1, i, t]], subtweakey)
+        # Output mask: at most one cell of mask 1 per branch (sum <= 1 forces the masks of backward_mask_x[0]
+        # into {0, 1}), both in the same column and in different cells; the column condition makes it exactly one
+        output_cells = backward_mask_x[0]
+        for i in range(2):
+            model.add(sum(output_cells[i]) == 1)
+            for j in range(16):
+                model.add(output_cells[i, j] <= 1)
+        for j in range(4):
+            model.add(sum(output_cells[0, j::4]) == sum(output_cells[1, j::4]))
+        for j in range(16):
+            model.add(output_cells[0, j] + output_cells[1, j] <= 1)
+        # Contradiction in the tweakey schedule
+        no_of_any_or_nonzero = self.new_array("no_of_any_or_nonzero", (2, 16), 0, self.RD)
+        no_of_only_nonzero = self.new_array("no_of_only_nonzero", (2, 16), 0, self.RD)
+        contradict = np.empty((2, 16), dtype=object)
+        for i, j in np.ndindex(contradict.shape):
+            any_literals = list(any_or_nonzero_subtweakey[:, i, j])
+            only_literals = list(only_nonzero_subtweakeys[:, i, j])
+            model.add(no_of_any_or_nonzero[i, j] == sum(any_literals))
+            model.add(no_of_only_nonzero[i, j] == sum(only_literals))
+            # contradict <-> (no_of_any_or_nonzero <= NPT /\ no_of_only_nonzero >= 1) \/ no_of_any_or_nonzero == 0
+            at_most_npt = model.new_bool_var("")
+            model.add(no_of_any_or_nonzero[i, j] <= self.NPT).only_enforce_if(at_most_npt)
+            model.add(no_of_any_or_nonzero[i, j] >= self.NPT + 1).only_enforce_if(~at_most_npt)
+            any_active = model.new_bool_var("")
+            model.add_max_equality(any_active, any_literals)
+            only_active = model.new_bool_var("")
+            model.add_max_equality(only_active, only_literals)
+            contradict[i, j] = model.new_bool_var("contradict[{},{}]".format(i, j))
+            model.add_bool_and([at_most_npt]).only_enforce_if(contradict[i, j])
+            model.add_bool_or([only_active, ~any_active]).only_enforce_if(contradict[i, j])
+            model.add_bool_or([~at_most_npt, ~only_active, contradict[i, j]])
+            model.add_bool_or([~at_most_npt, any_active, contradict[i, j]])
+        self.variables["contradict"] = contradict
+        lazy_cells = []
+        for j in range(16):
+            lazy_cells.append(model.new_bool_var(""))
+            model.add_implication(lazy_cells[-1], contradict[0, j])
+            model.add_implication(lazy_cells[-1], contradict[1, j])
+        model.add_bool_or(lazy_cells)
+        model.maximize(inputmask_distinguisher[()])
+        self.build_time = time.time() - start_time
+        return self
+
+    #############################################################################################################################################
+    # Additional constraints and hints
+
+    def restrict_lazy_cells(self, lazy_cell_index):
+        """
+        Native version of LazyCellIndex.constraints
+        """
+
+        candidates = lazy_cell_index.candidates()
+        min_any = lazy_cell_index.min_any()
+        for index in np.ndindex(candidates.shape):
+            if not candidates[index]:
+                self.model.add(self.variables["contradict"][index] == 0)
+            if min_any[index] > 0:
+                self.model.add(self.variables["no_of_any_or_nonzero"][index] >= int(min_any[index]))
+        contradict = self.variables["contradict"]
+        lazy_cells = []
+        for j in np.flatnonzero(lazy_cell_index.lazy_candidates()):
+            lazy_cells.append(self.model.new_bool_var(""))
+            self.model.add_implication(lazy_cells[-1], contradict[0, j])
+            self.model.add_implication(lazy_cells[-1], contradict[1, j])
+        # An empty clause makes the model unsatisfiable before search
+        self.model.add_bool_or(lazy_cells)
+
+    def restrict_output_pairs(self, prefilter):
+        """
+        Native version of MaskPropagator.prefilter_constraints
+        """
+
+        self.model.add(self.variables["inputmask_distinguisher"][()] <= int(prefilter["upper_bound"].max()))
+        output_cells = self.variables["backward_mask_x"][0]
+        pairs = []
+        for q in np.flatnonzero(prefilter["feasible"]):
+            a = int(np.flatnonzero(prefilter["output_mask"][q, 0])[0])
+            b = int(np.flatnonzero(prefilter["output_mask"][q, 1])[0])
+            pairs.append(self.model.new_bool_var(""))
+            self.model.add(output_cells[0, a] == 1).only_enforce_if(pairs[-1])
+            self.model.add(output_cells[1, b] == 1).only_enforce_if(pairs[-1])
+        self.model.add_bool_or(pairs)
+
+    def add_lower_bound(self, objective):
+        self.model.add(self.variables["inputmask_distinguisher"][()] >= objective)
+
+    def add_hint(self, result):
+        """
+        Hint the values of a result (solver result, PackedResult or dictionary) to the search
+        """
+
+        for name, array in self.variables.items():
+            if name in result:
+                values = np.asarray(result[name], dtype=np.int64).reshape(array.shape)
+                for index in np.ndindex(array.shape):
+                    self.model.add_hint(array[index], int(values[index]))
+
+    #############################################################################################################################################
+    # Solving
+
+    def solve(self, num_of_workers=8, time_limit=None, random_seed=None, on_solution=None):
+        """
+        Solve the model with num_of_workers parallel workers and return a CpSatResult
+
+        on_solution, if given, is called with the objective and the statistics of every intermediate solution
+        """
+
+        self.solver = self.cp_model.CpSolver()
+        self.solver.parameters.num_workers = num_of_workers
+        if time_limit is not None:
+            self.solver.parameters.max_time_in_seconds = time_limit
+        if random_seed is not None:
+            self.solver.parameters.random_seed = random_seed
+        callback = None if on_solution is None else self.solution_callback(on_solution)
+        status = self.statuses[self.solver.status_name(self.solver.solve(self.model, callback))]
+        statistics = {"num_conflicts": self.solver.num_conflicts,
+                      "num_branches": self.solver.num_branches,
+                      "wall_time": self.solver.wall_time,
+                      "best_objective_bound": self.solver.best_objective_bound,
+                      "build_time": self.build_time,
+                      "num_of_variables": len(self.model.proto.variables),
+                      "num_of_constraints": len(self.model.proto.constraints)}
+        solution = None
+        if status in ["OPTIMAL_SOLUTION", "SATISFIED"]:
+            solution = self.extract()
+        return CpSatResult(status, solution, statistics)
+
+    def solution_callback(self, on_solution):
+        """
+        Report the objective and the statistics of every intermediate solution to on_solution (called from the solver thread)
+        """
+
+        class SolutionCallback(self.cp_model.CpSolverSolutionCallback):
+            def on_solution_callback(self):
+                on_solution(int(self.objective_value), {"num_conflicts": self.num_conflicts,
+                                                        "num_branches": self.num_branches,
+                                                        "wall_time": self.wall_time})
+        return SolutionCallback()
+
+    def stop(self):
+        """
+        Stop a running solve (thread-safe), which then returns the best solution found so far
+        """
+
+        if self.solver is not None:
+            self.solver.stop_search()
+
+    def extract(self):
+        """
+        Collect the values of the variables of distinguisherqarma64.mzn in the shape of a solver result
+        """
+
+        solution = dict()
+        for name, array in self.variables.items():
+            values = np.array([self.solver.value(variable) for variable in array.flat], dtype=np.int64)
+            solution[name] = values.reshape(array.shape).tolist()
+        solution["tk_permutation_per_round"] = self.propagator.tk_permutation_per_round.tolist()
+        solution["tkp_sequence"] = self.propagator.generate_tkp_sequence()
+        return solution
+
+    def print_model_summary(self):
+        str_output = line_separator + "\n"
+        str_output += "Native CP-SAT model:\n"
+        str_output += "Number of variables:             {}\n".format(len(self.model.proto.variables))
+        str_output += "Number of constraints:           {}\n".format(len(self.model.proto.constraints))
+        str_output += "Rows of the mix_column table:    {}\n".format(len(self.mix_column_transitions))
+        str_output += "Build time:                      {:0.02f} seconds\n".format(self.build_time)
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and solve the native CP-SAT model
+    '''
+
+    parser = ArgumentParser(description="This tool finds the optimum integral distinguisher for Qarma-v2-64 with a native CP-SAT model (without MiniZinc)\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-KR", default=14, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-tki", default=2, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-p", default=8, type=int, help="number of parallel workers of CP-SAT\n")
+    parser.add_argument("-tl", default=4000, type=int, help="set a time limit for the solver in seconds\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the result is appended\n")
+    parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    args = parser.parse_args()
+    from distinguisherqarma64 import IntegralDistinguisher, default_parameters
+    params = default_parameters()
+    params.update(RU=args.RU, RL=args.RL, KR=args.KR, NPT=args.NPT, tk_interpretation=args.tki, output_file_name=args.o)
+    integral__distinguisher = IntegralDistinguisher(params)
+    native = CpSatModel(integral__distinguisher.RU, integral__distinguisher.RL, args.KR, args.NPT, args.tki).build()
+    print(native.print_model_summary())
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        ResultArchive.check_file(args.ar, native.RU, native.RL, native.KR, native.NPT, native.tk_interpretation)
+    start_time = time.time()
+    result = native.solve(num_of_workers=args.p, time_limit=args.tl)
+    print("Status: {}".format(result.status))
+    print("Elapsed time: {:0.02f} seconds".format(time.time() - start_time))
+    if result.solution is None:
+        return
+    integral__distinguisher.result = result
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        ResultArchive.append_to_file(args.ar, [result], native.RU, native.RL, native.KR, native.NPT, native.tk_interpretation)
+    integral__distinguisher.report()
+
+if __name__ == "__main__":
+    main()
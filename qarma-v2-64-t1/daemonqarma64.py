@@ -0,0 +1,376 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import io
+import json
+import time
+import socket
+import asyncio
+import tempfile
+import contextlib
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser, RawTextHelpFormatter
+from distinguisherqarma64 import IntegralDistinguisher, default_parameters, lookup_solver, compile_one, cipher_variant, line_separator
+
+default_socket_file_name = os.path.join(tempfile.gettempdir(), "{}-{}.sock".format(cipher_variant, os.getuid()))
+
+class SearchDaemon:
+    """
+    Long-running search service on a Unix domain socket
+
+    The daemon keeps the parsed models, the solver configurations, the NumPy tables and a process
+    pool loaded between jobs. Clients send one JSON object per line, {"id": ..., "job": ..., ...},
+    and receive JSON lines tagged with the id of the job: any number of {"event": "progress"} lines
+    followed by one {"event": "result"} or {"event": "error"} line. A connection may run several
+    jobs at a time. Jobs:
+
+    search   -- solve "params" (parameters of IntegralDistinguisher, missing ones take their default
+                values) with optional extra MiniZinc "constraints"; every intermediate solution is
+                streamed as progress, and the variables of the solution are returned with "variables"
+    compile  -- flatten the parameter sets "param_sets" in the process pool (see compile_one); every
+                compile record is streamed as progress as soon as it is ready
+    draw     -- report and draw the result of the search job "result_id" or the record "index" of
+                the archive "archive_file_name" into "output_file_name"
+    status   -- list the running jobs and the loaded models and solvers
+    cancel   -- cancel the job "job_id"
+    shutdown -- cancel all jobs and stop the daemon
+    """
+
+    def __init__(self, socket_file_name=default_socket_file_name, max_concurrent=None, max_workers=None, max_results=64) -> None:
+        self.socket_file_name = socket_file_name
+        self.max_concurrent = max(1, (os.cpu_count() or 1) // 2) if max_concurrent is None else max_concurrent
+        self.max_workers = max_workers
+        self.max_results = max_results
+        self.cp_models = dict()
+        self.cp_solvers = dict()
+        # results[job id]: the distinguishers of the last max_results search jobs, for draw jobs
+        self.results = collections.OrderedDict()
+        self.jobs = dict()
+        self.num_of_jobs = 0
+        self.start_time = None
+
+    #############################################################################################################################################
+    # Warm state
+
+    def cp_model(self, mzn_file_name):
+        """
+        Return the shared minizinc.Model of a model file
+        """
+
+        import minizinc
+        if mzn_file_name not in self.cp_models:
+            self.cp_models[mzn_file_name] = minizinc.Model()
+            self.cp_models[mzn_file_name].add_file(mzn_file_name)
+        return self.cp_models[mzn_file_name]
+
+    def cp_solver(self, cp_solver_name):
+        """
+        Return the solver configuration of a solver, looked up once
+        """
+
+        if cp_solver_name not in self.cp_solvers:
+            self.cp_solvers[cp_solver_name] = lookup_solver(cp_solver_name)
+        return self.cp_solvers[cp_solver_name]
+
+    def keep_result(self, job_id, distinguisher):
+        self.results[job_id] = distinguisher
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+
+    #############################################################################################################################################
+    # Jobs
+
+    async def search(self, request, send):
+        params = default_parameters()
+        params.update(request.get("params", dict()))
+        if params["memory_limit"] is not None:
+            raise ValueError("Memory limits are not supported by the daemon")
+        distinguisher = IntegralDistinguisher(params)
+        cp_model = None
+        if distinguisher.backend == "minizinc":
+            distinguisher.cp_solver = self.cp_solver(distinguisher.cp_solver_name)
+            cp_model = self.cp_model(distinguisher.mzn_file_name)
+        async with self.semaphore:
+            send({"event": "progress", "state": "started"})
+            search_result = await distinguisher.solve_async(cp_model=cp_model, monitor_memory=False, constraints=request.get("constraints"),
+                                                            progress=lambda entry: send({"event": "progress", "trace": entry}))
+        response = {"record": search_result.record}
+        result = distinguisher.result if search_result.solved else distinguisher.heuristic_result
+        if result is not None:
+            distinguisher.result = result
+            self.keep_result(request["id"], distinguisher)
+            response["result_id"] = request["id"]
+            if request.get("variables", False):
+                from storageqarma64 import ResultArchive
+                schema = ResultArchive(distinguisher.RU, distinguisher.RL, distinguisher.KR, distinguisher.NPT).schema()
+                response["variables"] = {name: np.asarray(result[name]).tolist() for name, _, _ in schema}
+        return response
+
+    async def compile(self, request, send):
+        loop = asyncio.get_running_loop()
+        param_sets = request.get("param_sets", [request.get("params", dict())])
+        futures = [loop.run_in_executor(self.executor, compile_one, param_set, request.get("time_limit"), request.get("fzn_directory"))
+                   for param_set in param_sets]
+        for index, future in enumerate(futures):
+            future.add_done_callback(lambda done, index=index: send({"event": "progress", "index": index, "record": done.result()})
+                                     if not done.cancelled() and done.exception() is None else None)
+        return {"records": await asyncio.gather(*futures)}
+
+    async def draw(self, request, send):
+        if "result_id" in request:
+            if request["result_id"] not in self.results:
+                raise KeyError("No result of job {} (the daemon keeps the last {} results)".format(request["result_id"], self.max_results))
+            distinguisher = self.results[request["result_id"]]
+        else:
+            params = default_parameters()
+            params.update(request.get("params", dict()))
+            distinguisher = IntegralDistinguisher(params)
+            distinguisher.load_result(request["archive_file_name"], request["index"])
+        distinguisher.output_file_name = request.get("output_file_name", distinguisher.output_file_name)
+        attack_summary = io.StringIO()
+        with contextlib.redirect_stdout(attack_summary):
+            distinguisher.report()
+        return {"output_file_name": distinguisher.output_file_name, "attack_summary": attack_summary.getvalue()}
+
+    async def status(self, request, send):
+        return {"variant": cipher_variant,
+                "uptime": time.time() - self.start_time,
+                "num_of_jobs": self.num_of_jobs,
+                "running_jobs": [{"id": job_id, "job": job} for job_id, (job, _) in self.jobs.items() if job_id != request["id"]],
+                "cp_models": list(self.cp_models),
+                "cp_solvers": list(self.cp_solvers),
+                "results": list(self.results)}
+
+    async def cancel(self, request, send):
+        if request.get("job_id") not in self.jobs:
+            raise KeyError("No running job {}".format(request.get("job_id")))
+        self.jobs[request["job_id"]][1].cancel()
+        return {"cancelled": request["job_id"]}
+
+    async def shutdown(self, request, send):
+        for job_id, (_, task) in list(self.jobs.items()):
+            if job_id != request["id"]:
+                task.cancel()
+        self.server.close()
+        return {"shutdown": True}
+
+    #############################################################################################################################################
+    # Protocol
+
+    async def run_job(self, request, writer):
+        """
+        Run one request and write its events to the connection
+        """
+
+        def send(event):
+            event["id"] = request["id"]
+            if not writer.is_closing():
+                writer.write((json.dumps(event, default=str) + "\n").encode())
+        handlers = {"search": self.search, "compile": self.compile, "draw": self.draw,
+                    "status": self.status, "cancel": self.cancel, "shutdown": self.shutdown}
+        try:
+            if request.get("job") not in handlers:
+                raise ValueError("Unknown job {} (expected one of {})".format(request.get("job"), ", ".join(handlers)))
+            response = await handlers[request["job"]](request, send)
+            response["event"] = "result"
+        except asyncio.CancelledError:
+            response = {"event": "error", "error": "Cancelled"}
+        except Exception as error:
+            if str(error) != "":
+                response = {"event": "error", "error": "{}: {}".format(type(error).__name__, error)}
+            else:
+                # An error without a message, e.g. a bare assert: name the rejected parameters instead
+                response = {"event": "error", "error": "{} (params: {})".format(type(error).__name__, json.dumps(request.get("params", dict()), default=str))}
+        finally:
+            self.jobs.pop(request["id"], None)
+        send(response)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Read the requests of one client and run each of them as a task
+        """
+
+        tasks = []
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b"":
+                    break
+                if line.strip() == b"":
+                    continue
+                try:
+                    request = json.loads(line)
+                    assert(isinstance(request, dict))
+                except (ValueError, AssertionError):
+                    writer.write((json.dumps({"id": None, "event": "error", "error": "Invalid request"}) + "\n").encode())
+                    continue
+                self.num_of_jobs += 1
+                request.setdefault("id", self.num_of_jobs)
+                task = asyncio.create_task(self.run_job(request, writer))
+                self.jobs[request["id"]] = (request.get("job"), task)
+                tasks.append(task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            # The daemon is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def serve_async(self):
+        """
+        Serve until a shutdown job arrives
+        """
+
+        self.start_time = time.time()
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        if os.path.exists(self.socket_file_name):
+            os.remove(self.socket_file_name)
+        self.server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_file_name)
+        with ProcessPoolExecutor(max_workers=self.max_workers) as self.executor:
+            try:
+                async with self.server:
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await self.server.serve_forever()
+            finally:
+                if os.path.exists(self.socket_file_name):
+                    os.remove(self.socket_file_name)
+
+    def serve(self):
+        """
+        Blocking version of serve_async
+        """
+
+        asyncio.run(self.serve_async())
+
+class DaemonClient:
+    """
+    Blocking client of SearchDaemon, e.g., for notebooks and scripts
+
+    Every method sends one job and returns the fields of its result; progress events are passed to
+    the callback on_progress while waiting. A DaemonError is raised if the job fails.
+    """
+
+    def __init__(self, socket_file_name=default_socket_file_name) -> None:
+        self.socket_file_name = socket_file_name
+        self.num_of_requests = 0
+
+    def request(self, job, on_progress=None, **fields):
+        """
+        Send one job on a new connection and wait for its result (pass id to be able to cancel it)
+        """
+
+        self.num_of_requests += 1
+        request = dict(fields, job=job)
+        request.setdefault("id", "{}-{}".format(os.getpid(), self.num_of_requests))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_file_name)
+            connection.sendall((json.dumps(request) + "\n").encode())
+            with connection.makefile("r") as events:
+                for line in events:
+                    event = json.loads(line)
+                    if event["event"] == "progress":
+                        if on_progress is not None:
+                            on_progress(event)
+                    elif event["event"] == "error":
+                        raise DaemonError(event["error"])
+                    else:
+                        return event
+        raise DaemonError("Connection closed before the result of {}".format(request["id"]))
+
+    def search(self, params, constraints=None, variables=False, on_progress=None):
+        return self.request("search", on_progress=on_progress, params=params, constraints=constraints, variables=variables)
+
+    def compile(self, param_sets, time_limit=None, fzn_directory=None, on_progress=None):
+        return self.request("compile", on_progress=on_progress, param_sets=param_sets, time_limit=time_limit, fzn_directory=fzn_directory)
+
+    def draw(self, result_id=None, archive_file_name=None, index=None, output_file_name="output.tex"):
+        if result_id is not None:
+            return self.request("draw", result_id=result_id, output_file_name=output_file_name)
+        return self.request("draw", archive_file_name=archive_file_name, index=index, output_file_name=output_file_name)
+
+    def status(self):
+        return self.request("status")
+
+    def cancel(self, job_id):
+        return self.request("cancel", job_id=job_id)
+
+    def shutdown(self):
+        return self.request("shutdown")
+
+class DaemonError(Exception):
+    pass
+
+def print_status(status):
+    '''
+    Print the status of a daemon
+    '''
+
+    str_output = line_separator + "\n"
+    str_output += "Daemon for {} (up {:0.02f} seconds, {} jobs so far)\n".format(status["variant"], status["uptime"], status["num_of_jobs"])
+    str_output += "Running jobs:    {}\n".format(", ".join("{} ({})".format(job["id"], job["job"]) for job in status["running_jobs"]) or None)
+    str_output += "Loaded models:   {}\n".format(", ".join(status["cp_models"]) or None)
+    str_output += "Loaded solvers:  {}\n".format(", ".join(status["cp_solvers"]) or None)
+    str_output += "Kept results:    {}\n".format(", ".join(map(str, status["results"])) or None)
+    str_output += line_separator
+    return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and start, query or stop the daemon
+    '''
+
+    parser = ArgumentParser(description="This tool serves integral distinguisher searches for Qarma-v2-64 over a Unix domain socket\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-s", default=default_socket_file_name, type=str, help="path of the Unix domain socket\n")
+    parser.add_argument("-j", default=None, type=int, help="number of searches run at the same time (default: number of CPUs / 2)\n")
+    parser.add_argument("-w", default=None, type=int, help="number of worker processes of the compile jobs (default: number of CPUs)\n")
+    parser.add_argument("-status", default=False, action="store_true", help="print the status of the running daemon\n")
+    parser.add_argument("-stop", default=False, action="store_true", help="stop the running daemon\n")
+    args = parser.parse_args()
+    if args.status or args.stop:
+        client = DaemonClient(args.s)
+        if args.status:
+            print(print_status(client.status()))
+        if args.stop:
+            client.shutdown()
+        return
+    print("Serving on {}".format(args.s))
+    SearchDaemon(args.s, max_concurrent=args.j, max_workers=args.w).serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import asyncio
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from distinguisherqarma64 import IntegralDistinguisher, default_parameters, lookup_solver, line_separator
+from propagatorqarma64 import MaskPropagator
+from lazycellsqarma64 import LazyCellIndex
+
+class ParetoFront:
+    """
+    Pareto front between the input mask (inputmask_distinguisher, maximized) and the number of
+    lazy tweak cells, i.e., the tweak cells for which contradict holds in both branches
+
+    The front is computed with epsilon-constraint sub-solves: every sub-solve maximizes the input
+    mask with the number of lazy tweak cells fixed to one value (and, with spread, the number of
+    state columns into which the lazy tweak cells are added in the first round, according to
+    tk_permutation_per_round). The sub-solves run concurrently on one parsed model
+    and one solver configuration. Fewer lazy tweak cells (and a smaller spread) is considered
+    better unless direction is "max".
+    """
+
+    num_of_columns = 4
+
+    def __init__(self, params, max_concurrent=None, spread=False, direction="min", max_lazy_cells=None) -> None:
+        """
+        params are the parameters of IntegralDistinguisher used by every sub-solve
+        """
+
+        assert(direction in ["min", "max"])
+        self.params = params
+        self.max_concurrent = max_concurrent
+        self.spread = spread
+        self.direction = direction
+        base = IntegralDistinguisher(params)
+        propagator = MaskPropagator(base.RU, base.RL, base.KR, base.NPT, base.tk_interpretation)
+        # lazy_cells[cell]: the entries of contradict of both branches and the state column
+        # into which the tweak cell is added in the first round, for the tweak cells that can
+        # be lazy at all (see LazyCellIndex)
+        lazy_candidates = LazyCellIndex.load(base.RU, base.RL, base.KR, base.NPT, base.tk_interpretation).lazy_candidates()
+        self.lazy_cells = dict()
+        for cell in np.flatnonzero(lazy_candidates).tolist():
+            entries = [(branch, cell) for branch in range(2)]
+            self.lazy_cells[cell] = (entries, self.state_column(propagator.inv_tk_permutation_per_round[0][cell]))
+        self.max_lazy_cells = len(self.lazy_cells) if max_lazy_cells is None else max_lazy_cells
+        self.points = []
+
+    def state_column(self, state_cell):
+        """
+        Return the column of a state cell
+        """
+
+        return int(state_cell) % 4
+
+    def lazy_expression(self, entries):
+        return "(contradict[{}] + contradict[{}] == 2)".format(", ".join(map(str, entries[0])), ", ".join(map(str, entries[1])))
+
+    def epsilon_constraints(self, num_of_lazy_cells, spread=None):
+        """
+        Generate the constraints of one sub-solve
+        """
+
+        constraints = "constraint sum([{}]) = {};\n".format(", ".join("bool2int{}".format(self.lazy_expression(entries))
+                                                                      for entries, _ in self.lazy_cells.values()), num_of_lazy_cells)
+        if spread is not None:
+            columns = []
+            for column in range(self.num_of_columns):
+                literals = [self.lazy_expression(entries) for entries, state_column in self.lazy_cells.values() if state_column == column]
+                if literals != []:
+                    columns.append("bool2int({})".format(" \\/ ".join(literals)))
+            constraints += "constraint sum([{}]) = {};\n".format(", ".join(columns), spread)
+        return constraints
+
+    def sub_problems(self):
+        """
+        List the (number of lazy tweak cells, spread) of all sub-solves
+        """
+
+        if not self.spread:
+            return [(count, None) for count in range(1, self.max_lazy_cells + 1)]
+        return [(count, spread) for count in range(1, self.max_lazy_cells + 1) for spread in range(1, min(count, self.num_of_columns) + 1)]
+
+    async def run_async(self):
+        """
+        Solve all sub-problems concurrently and return the points of the front
+        """
+
+        import minizinc
+        base = IntegralDistinguisher(self.params)
+        cp_solver = lookup_solver(base.cp_solver_name)
+        cp_model = minizinc.Model()
+        cp_model.add_file(base.mzn_file_name)
+        max_concurrent = self.max_concurrent
+        if max_concurrent is None:
+            max_concurrent = max(1, (os.cpu_count() or 1) // max(1, base.num_of_threads))
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def solve_one(count, spread):
+            distinguisher = IntegralDistinguisher(self.params)
+            distinguisher.cp_solver = cp_solver
+            async with semaphore:
+                search_result = await distinguisher.solve_async(cp_model=cp_model, monitor_memory=False,
+                                                                constraints=self.epsilon_constraints(count, spread))
+            return {"num_of_lazy_cells": count, "spread": spread, "status": search_result.status,
+                    "objective": search_result.objective, "proven": search_result.status == "OPTIMAL_SOLUTION",
+                    "distinguisher": distinguisher,
+                    "elapsed_time": search_result.record["elapsed_time"]}
+        self.points = await asyncio.gather(*[solve_one(count, spread) for count, spread in self.sub_problems()])
+        return self.front()
+
+    def run(self):
+        """
+        Blocking version of run_async
+        """
+
+        return asyncio.run(self.run_async())
+
+    def front(self):
+        """
+        Return the non-dominated solved points, sorted by the number of lazy tweak cells
+
+        The objective of a sub-solve that was not proven optimal (e.g., stopped by the time limit)
+        is only a lower bound on its optimum: it may still dominate other points, but it is never
+        dominated itself, since its optimum could be larger.
+        """
+
+        sign = 1 if self.direction == "min" else -1
+        solved = [point for point in self.points if point["objective"] is not None]
+        def dominates(a, b):
+            if not b["proven"]:
+                return False
+            better = [a["objective"] >= b["objective"], sign*a["num_of_lazy_cells"] <= sign*b["num_of_lazy_cells"]]
+            strictly = [a["objective"] > b["objective"], sign*a["num_of_lazy_cells"] < sign*b["num_of_lazy_cells"]]
+            if self.spread:
+                better.append(a["spread"] <= b["spread"])
+                strictly.append(a["spread"] < b["spread"])
+            return all(better) and any(strictly)
+        front = [point for point in solved if not any(dominates(other, point) for other in solved)]
+        return sorted(front, key=lambda point: (point["num_of_lazy_cells"], point["spread"] or 0))
+
+    def front_mark(self, point, front):
+        if not any(point is other for other in front):
+            return ""
+        return "*" if point["proven"] else "?"
+
+    def print_front(self, front):
+        """
+        Print all sub-solves and mark the points of the front (* proven, ? lower bound only)
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Pareto front (input mask vs. {} lazy tweak cells{}):\n".format("fewer" if self.direction == "min" else "more",
+                                                                                   ", fewer state columns" if self.spread else "")
+        str_output += "{:>10}{:>8}{:>11}  {:<20}{:>10}{:>7}\n".format("Lazy cells", "Spread", "Objective", "Status", "Time (s)", "Front")
+        for point in self.points:
+            str_output += "{:>10}{:>8}{:>11}  {:<20}{:>10.02f}{:>7}\n".format(point["num_of_lazy_cells"], "-" if point["spread"] is None else point["spread"],
+                                                                          "-" if point["objective"] is None else point["objective"], point["status"],
+                                                                          point["elapsed_time"], self.front_mark(point, front))
+        if any(not point["proven"] for point in front):
+            str_output += "?: the objective was not proven optimal and is a lower bound, the point may be dominated\n"
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and compute the Pareto front
+    '''
+
+    parser = ArgumentParser(description="This tool computes the Pareto front between the input mask and the number of lazy tweak cells for Qarma-v2-64\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=4, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=13, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-sl", default="ortools", type=str,
+                        choices=['gecode', 'chuffed', 'cbc', 'gurobi', 'picat', 'scip', 'choco', 'ortools'],
+                        help="choose a cp solver\n")
+    parser.add_argument("-p", default=2, type=int, help="number of threads of every sub-solve\n")
+    parser.add_argument("-tl", default=600, type=int, help="time limit of every sub-solve in seconds\n")
+    parser.add_argument("-j", default=None, type=int, help="number of sub-solves run in parallel (default: number of CPUs / threads)\n")
+    parser.add_argument("-maxc", default=None, type=int, help="largest number of lazy tweak cells to consider (default: all tweak cells)\n")
+    parser.add_argument("-spread", default=False, action="store_true",
+                        help="also split the sub-solves by the number of state columns of the lazy tweak cells\n")
+    parser.add_argument("-dir", default="min", type=str, choices=["min", "max"], help="whether fewer or more lazy tweak cells are preferred\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the points of the front are appended\n")
+    parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    args = parser.parse_args()
+    params = default_parameters()
+    params.update(RU=args.RU, RL=args.RL, KR=args.KR, cp_solver_name=args.sl, num_of_threads=args.p,
+                  time_limit=args.tl, output_file_name=args.o)
+    pareto = ParetoFront(params, max_concurrent=args.j, spread=args.spread, direction=args.dir, max_lazy_cells=args.maxc)
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        base = IntegralDistinguisher(params)
+        ResultArchive.check_file(args.ar, base.RU, base.RL, base.KR, base.NPT, base.tk_interpretation)
+    front = pareto.run()
+    print(pareto.print_front(front))
+    if front == []:
+        print("No solution was found")
+        return
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        distinguisher = front[0]["distinguisher"]
+        ResultArchive.append_to_file(args.ar, [point["distinguisher"].result for point in front],
+                                     distinguisher.RU, distinguisher.RL, distinguisher.KR, distinguisher.NPT,
+                                     distinguisher.tk_interpretation)
+    # Draw the point with the largest input mask
+    max(front, key=lambda point: point["objective"])["distinguisher"].report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import math
+import time
+import itertools
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from mixcolumnqarma64 import MixColumnTable
+line_separator = "#"*55
+
+class MaskPropagator:
+    """
+    Batched NumPy implementation of the propagation rules of distinguisherqarma64.mzn
+
+    Masks: 0 (zero), 1 (nonzero with a fixed linear combination given by the class),
+    2 (nonzero), 3 (unknown). The leading axis of every array runs over the batch.
+    """
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=2) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        tk_interpretation selects tkp_sequence[max_ru_rl - 1] (0), tkp_sequence[min_ru_rl - 1] (1) or tkp_sequence[ceil((KR - 2) / 2) - 1] (2) for round 1
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.num_of_cells = 16
+        self.tweakey_permutation = [1, 10, 14, 6, 2, 9, 13, 5, 0, 8, 12, 4, 3, 11, 15, 7]
+        self.inv_tweakey_permutation = [8, 0, 4, 12, 11, 7, 3, 15, 9, 5, 1, 13, 10, 6, 2, 14]
+        self.state_permutation = [0, 11, 6, 13, 10, 1, 12, 7, 5, 14, 3, 8, 15, 4, 9, 2]
+        self.sb_table = np.array([0, 2, 2, 3], dtype=np.int8)
+        self.mask_to_class = np.array([0, 1, -1, -2], dtype=np.int8)
+        self.mix_column_table = MixColumnTable.load()
+        self.tk_permutation_per_round = self.generate_tk_permutation_per_round()
+        # inv_tk_permutation_per_round[r][t] is the state cell to which the tweak cell t is added in round r
+        self.inv_tk_permutation_per_round = np.argsort(self.tk_permutation_per_round, axis=1)
+
+    def generate_tkp_sequence(self):
+        """
+        Compute tkp_sequence exactly as the CP model does
+        """
+
+        max_ru_rl = max(self.RU, self.RL, 2)
+        tkp_sequence = [list(range(16))]
+        for n in range(1, max_ru_rl + self.KR + 1):
+            tkp_sequence.append([self.tweakey_permutation[tkp_sequence[n - 1][i]] for i in range(16)])
+        return tkp_sequence
+
+    def generate_tk_permutation_per_round(self):
+        """
+        Compute tk_permutation_per_round exactly as the CP model does
+        """
+
+        max_ru_rl = max(self.RU, self.RL, 2)
+        tkp_sequence = self.generate_tkp_sequence()
+        min_ru_rl = min(self.RU, self.RL)
+        tk_start = [max_ru_rl - 1, min_ru_rl - 1, math.ceil((self.KR - 2) / 2) - 1][self.tk_interpretation]
+        tk_permutation_per_round = [list(range(16)), tkp_sequence[tk_start]]
+        for r in range(2, self.RD + self.KR):
+            if r % 2 == 0:
+                tk_permutation_per_round.append([self.tweakey_permutation[tk_permutation_per_round[r - 2][i]] for i in range(16)])
+            else:
+                tk_permutation_per_round.append([self.inv_tweakey_permutation[tk_permutation_per_round[r - 2][i]] for i in range(16)])
+        return np.array(tk_permutation_per_round, dtype=np.int64)
+
+    #############################################################################################################################################
+    # Propagation rules
+
+    def sb_operation(self, mask_in):
+        """
+        Apply sb_operation (a deterministic map on masks) and return the output mask and class
+        """
+
+        mask_out = self.sb_table[mask_in]
+        return mask_out, self.mask_to_class[mask_out]
+
+    def mix_column(self, mask, cls):
+        """
+        Apply mix_column on all columns of the state after the permutation (looked up in MixColumnTable)
+
+        mask and cls have shape (..., 16); returns the output masks/classes with shape (..., 16)
+        and the auxiliary masks/classes with shape (..., 4, 2)
+        """
+
+        # columns[j, k] is the cell in row k of column j
+        columns = np.array([[self.state_permutation[4*k + j] for k in range(4)] for j in range(4)])
+        column_mask, column_class = self.mix_column_table.lookup(mask[..., columns], cls[..., columns])
+        out_mask = np.swapaxes(column_mask[..., :4], -1, -2).reshape(mask.shape)
+        out_class = np.swapaxes(column_class[..., :4], -1, -2).reshape(cls.shape)
+        aux_mask = column_mask[..., 4:]
+        aux_class = column_class[..., 4:]
+        return out_mask, out_class, aux_mask, aux_class
+
+    def forward(self, input_mask, input_class=None):
+        """
+        Propagate a batch of input masks (shape (N, 16)) through EU
+        """
+
+        mask = np.asarray(input_mask, dtype=np.int8).reshape(-1, 16)
+        cls = self.mask_to_class[mask] if input_class is None else np.asarray(input_class, dtype=np.int8).reshape(-1, 16)
+        output = {"forward_mask_x": [mask], "forward_class_x": [cls],
+                  "forward_mask_sbx": [], "forward_class_sbx": [],
+                  "forward_mask_aux": [], "forward_class_aux": []}
+        for r in range(self.RU):
+            mask, cls = self.sb_operation(mask)
+            output["forward_mask_sbx"].append(mask)
+            output["forward_class_sbx"].append(cls)
+            mask, cls, aux_mask, aux_class = self.mix_column(mask, cls)
+            output["forward_mask_aux"].append(aux_mask)
+            output["forward_class_aux"].append(aux_class)
+            output["forward_mask_x"].append(mask)
+            output["forward_class_x"].append(cls)
+        return {key: np.stack(value, axis=1) for key, value in output.items()}
+
+    def backward(self, output_mask, output_class=None):
+        """
+        Propagate a batch of output masks of both branches (shape (N, 2, 16)) through EL
+        """
+
+        mask = np.asarray(output_mask, dtype=np.int8).reshape(-1, 2, 16)
+        cls = self.mask_to_class[mask] if output_class is None else np.asarray(output_class, dtype=np.int8).reshape(-1, 2, 16)
+        output = {"backward_mask_x": [mask], "backward_class_x": [cls],
+                  "backward_mask_sbx": [], "backward_class_sbx": [],
+                  "backward_mask_aux": [], "backward_class_aux": []}
+        for r in range(self.RL + 1):
+            mask, cls = self.sb_operation(mask)
+            output["backward_mask_sbx"].append(mask)
+            output["backward_class_sbx"].append(cls)
+            if r == self.RL:
+                break
+            mask, cls, aux_mask, aux_class = self.mix_column(mask, cls)
+            output["backward_mask_aux"].append(aux_mask)
+            output["backward_class_aux"].append(aux_class)
+            output["backward_mask_x"].append(mask)
+            output["backward_class_x"].append(cls)
+        return {key: np.stack(value, axis=1) for key, value in output.items()}
+
+    #############################################################################################################################################
+    # Tweakey activity and contradiction
+
+    def forward_activity(self, forward_mask_sbx):
+        """
+        Count the EU rounds in which every tweak cell meets a nonzero/unknown (any) or a nonzero (only) mask
+
+        Returns two arrays of shape (N, 16) indexed by the tweak cell
+        """
+
+        no_of_any = np.zeros((forward_mask_sbx.shape[0], 16), dtype=np.int16)
+        no_of_only = np.zeros((forward_mask_sbx.shape[0], 16), dtype=np.int16)
+        for r in range(self.RU):
+            mask = forward_mask_sbx[:, r, self.inv_tk_permutation_per_round[r]]
+            no_of_any += (mask != 0)
+            no_of_only += (mask == 1) | (mask == 2)
+        return no_of_any, no_of_only
+
+    def backward_activity(self, backward_mask_sbx):
+        """
+        Count the EL rounds in which every tweak cell meets a nonzero/unknown (any) or a nonzero (only) mask
+
+        Returns two arrays of shape (N, 2, 16) indexed by the branch and the tweak cell
+        """
+
+        no_of_any = np.zeros((backward_mask_sbx.shape[0], 2, 16), dtype=np.int16)
+        no_of_only = np.zeros((backward_mask_sbx.shape[0], 2, 16), dtype=np.int16)
+        for r in range(self.RL):
+            mask = backward_mask_sbx[:, r][..., self.inv_tk_permutation_per_round[self.RD - r - 1]]
+            no_of_any += (mask != 0)
+            no_of_only += (mask == 1) | (mask == 2)
+        return no_of_any, no_of_only
+
+    def contradict(self, forward_any, forward_only, backward_any, backward_only):
+        """
+        Combine the forward and backward activity counts (broadcast over leading axes) into contradict[.., branch, cell]
+        """
+
+        no_of_any_or_nonzero = forward_any[..., None, :] + backward_any
+        no_of_only_nonzero = forward_only[..., None, :] + backward_only
+        return ((no_of_any_or_nonzero <= self.NPT) & (no_of_only_nonzero >= 1)) | (no_of_any_or_nonzero == 0)
+
+    def is_contradiction(self, contradict):
+        """
+        Check whether some tweak cell is lazy in both branches
+        """
+
+        return (contradict[..., 0, :] & contradict[..., 1, :]).any(axis=-1)
+
+    #############################################################################################################################################
+    # Prefilter
+
+    def output_cell_pairs(self):
+        """
+        Enumerate backward_mask_x[0] for all pairs of output cells allowed by the model
+        (one active cell per branch, both in the same column, different cells)
+        """
+
+        pairs = [(a, b) for a in range(16) for b in range(16) if a != b and a % 4 == b % 4]
+        output_mask = np.zeros((len(pairs), 2, 16), dtype=np.int8)
+        for q, (a, b) in enumerate(pairs):
+            output_mask[q, 0, a] = 1
+            output_mask[q, 1, b] = 1
+        return output_mask
+
+    def input_patterns(self):
+        """
+        Enumerate all input masks with cells in {0, 3}
+        """
+
+        codes = np.arange(2**16, dtype=np.int64)
+        return (3*((codes[:, None] >> np.arange(16)) & 1)).astype(np.int8)
+
+    def single_cell_rounds(self):
+        """
+        For every input cell s, tweak cell t and EU round r, decide whether an input mask
+        consisting of s alone activates the cell where t is added in round r
+        """
+
+        unit_patterns = 3*np.eye(16, dtype=np.int8)
+        forward_mask_sbx = self.forward(unit_patterns)["forward_mask_sbx"]
+        hits = np.zeros((16, self.RU, 16), dtype=bool)
+        for r in range(self.RU):
+            hits[:, r, :] = forward_mask_sbx[:, r, self.inv_tk_permutation_per_round[r]] != 0
+        return hits
+
+    def upper_bounds(self, backward_any):
+        """
+        Upper bound the objective for a batch of output cell pairs
+
+        Only the condition no_of_any_or_nonzero <= NPT on both branches is kept. Since the
+        nonzero-ness of a cell in EU is the OR of the nonzero-ness induced by every single input
+        cell, the largest input mask meeting this condition for a tweak cell is the largest set
+        of input cells whose activity on that tweak cell stays within NPT rounds.
+        """
+
+        hits = self.single_cell_rounds()
+        # largest[c, t]: number of input cells that can be active together if the tweak cell t
+        # is allowed to be active in at most c rounds of EU
+        largest = np.zeros((self.NPT + 1, 16), dtype=np.int64)
+        for c in range(self.NPT + 1):
+            for rounds in itertools.combinations(range(self.RU), min(c, self.RU)):
+                outside = np.ones(self.RU, dtype=bool)
+                outside[list(rounds)] = False
+                fits = ~(hits[:, outside, :].any(axis=1))
+                largest[c] = np.maximum(largest[c], fits.sum(axis=0))
+        capacity = self.NPT - backward_any.max(axis=1)
+        bound = np.where(capacity >= 0, largest[np.clip(capacity, 0, self.NPT), np.arange(16)], 0)
+        return 3*bound.max(axis=1)
+
+    def prefilter(self, output_mask=None, input_mask=None, chunk_size=4096):
+        """
+        Evaluate every output cell pair against a batch of input masks before any solver call
+
+        By default all pairs allowed by the model and all 2^16 input masks in {0, 3} are
+        evaluated, so the upper bound of every pair is exact. If the input masks are given,
+        the best input mask among them is reported next to the relaxation-based upper bound.
+        """
+
+        output_mask = self.output_cell_pairs() if output_mask is None else np.asarray(output_mask, dtype=np.int8).reshape(-1, 2, 16)
+        exhaustive = input_mask is None
+        input_mask = self.input_patterns() if exhaustive else np.asarray(input_mask, dtype=np.int8).reshape(-1, 16)
+        backward_any, backward_only = self.backward_activity(self.backward(output_mask)["backward_mask_sbx"])
+        num_of_pairs = output_mask.shape[0]
+        best_objective = np.full(num_of_pairs, -1, dtype=np.int64)
+        best_pattern = np.zeros((num_of_pairs, 16), dtype=np.int8)
+        for start in range(0, input_mask.shape[0], chunk_size):
+            patterns = input_mask[start:start + chunk_size]
+            forward_any, forward_only = self.forward_activity(self.forward(patterns)["forward_mask_sbx"])
+            contradict = self.contradict(forward_any[:, None], forward_only[:, None], backward_any[None], backward_only[None])
+            feasible = self.is_contradiction(contradict) & (patterns.sum(axis=1) >= 1)[:, None]
+            objective = np.where(feasible, patterns.sum(axis=1, dtype=np.int64)[:, None], -1)
+            index = objective.argmax(axis=0)
+            improved = objective[index, np.arange(num_of_pairs)] > best_objective
+            best_objective[improved] = objective[index, np.arange(num_of_pairs)][improved]
+            best_pattern[improved] = patterns[index[improved]]
+        upper_bound = best_objective.clip(0) if exhaustive else np.maximum(self.upper_bounds(backward_any), best_objective)
+        return {"output_mask": output_mask,
+                "feasible": upper_bound >= 1,
+                "upper_bound": upper_bound,
+                "best_objective": best_objective,
+                "best_pattern": best_pattern,
+                "exact": exhaustive}
+
+    def prefilter_constraints(self, prefilter):
+        """
+        Translate the outcome of the prefilter into MiniZinc constraints
+        """
+
+        feasible_pairs = []
+        for q in np.flatnonzero(prefilter["feasible"]):
+            a = int(np.flatnonzero(prefilter["output_mask"][q, 0])[0])
+            b = int(np.flatnonzero(prefilter["output_mask"][q, 1])[0])
+            feasible_pairs.append("(backward_mask_x[0, 0, {}] = 1 /\\ backward_mask_x[0, 1, {}] = 1)".format(a, b))
+        constraints = "constraint inputmask_distinguisher <= {};\n".format(int(prefilter["upper_bound"].max()))
+        constraints += "constraint " + " \\/\n    ".join(feasible_pairs) + ";\n"
+        return constraints
+
+    def print_prefilter_summary(self, prefilter):
+        """
+        Print the outcome of the prefilter
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Prefilter of the output cell pairs:\n"
+        str_output += "Number of pairs:                 {}\n".format(len(prefilter["feasible"]))
+        str_output += "Number of feasible pairs:        {}\n".format(int(prefilter["feasible"].sum()))
+        str_output += "Upper bound on the objective:    {}{}\n".format(int(prefilter["upper_bound"].max()), "" if prefilter["exact"] else " (relaxation)")
+        for q in np.argsort(-prefilter["upper_bound"], kind="stable"):
+            if not prefilter["feasible"][q]:
+                continue
+            a = int(np.flatnonzero(prefilter["output_mask"][q, 0])[0])
+            b = int(np.flatnonzero(prefilter["output_mask"][q, 1])[0])
+            str_output += "Output cells ({:02d}, {:02d}): upper bound {:02d}, best input mask {:02d}\n".format(a, b,
+                int(prefilter["upper_bound"][q]), int(prefilter["best_objective"][q]))
+        str_output += line_separator + "\n"
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and run the prefilter
+    '''
+
+    parser = ArgumentParser(description="This tool prefilters the output cells of integral distinguishers for Qarma-v2-64 with a NumPy mask propagator\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=4, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=13, type=int, help="Number of rounds for key recovery")
+    args = parser.parse_args()
+    start_time = time.time()
+    propagator = MaskPropagator(args.RU - 1, args.RL - 1, args.KR)
+    prefilter = propagator.prefilter()
+    print(propagator.print_prefilter_summary(prefilter))
+    print("Elapsed time: {:0.02f} seconds".format(time.time() - start_time))
+
+if __name__ == "__main__":
+    main()
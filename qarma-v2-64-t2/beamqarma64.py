@@ -0,0 +1,339 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from argparse import ArgumentParser, RawTextHelpFormatter
+from propagatorqarma64 import MaskPropagator, line_separator
+
+class BeamSearch:
+    """
+    Solver-free beam search for integral distinguishers
+
+    For every output cell pair, the input mask is grown from the empty mask by one cell at a time
+    (cell_values are the masks a cell can take). The extensions of the masks of the beam are
+    propagated through EU and joined with the EL activity of the pair. The extensions that keep a
+    tweak cell lazy in both branches are ranked by their input mask, then by their number of lazy
+    tweak cells (more room for the next cells), then by their number of active subtweakey cells in
+    EU, and the best width of them form the next beam. The search of a pair stops when no extension
+    keeps a lazy tweak cell. Output cell pairs with the same EL activity share one search, the
+    searches of a chunk advance in lockstep (every distinct input mask of a step is propagated once)
+    and the chunks run in a process pool. The best objective found is shared by all chunks: at every
+    step, the searches whose upper bound (MaskPropagator.upper_bounds) does not exceed it are dropped,
+    and the search ends when no EL activity can improve it or when time_limit is spent. The
+    objective is a lower bound of inputmask_distinguisher.
+    """
+
+    cell_values = [3]
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1, width=16, num_of_workers=None, chunk_size=None, time_limit=None) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1); by default,
+        the EL activities are split into enough chunks to keep every worker busy
+        """
+
+        self.propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.width = width
+        self.num_of_workers = (os.cpu_count() or 1) if num_of_workers is None else num_of_workers
+        self.chunk_size = chunk_size
+        self.time_limit = time_limit
+        self.num_of_cells = 16
+
+    def lazy_cells(self, contradict):
+        """
+        Count the tweak cells that are lazy in both branches
+        """
+
+        return (contradict[..., 0, :, :] & contradict[..., 1, :, :]).sum(axis=(-2, -1))
+
+    def extensions(self, beam):
+        """
+        Raise one cell of every mask of the beam to a larger value of cell_values
+
+        Returns the new masks and the indices of the masks of the beam from which they are obtained
+        """
+
+        children, parents = [], []
+        for value in self.cell_values:
+            for cell in range(self.num_of_cells):
+                index = np.flatnonzero(beam[:, cell] < value)
+                child = beam[index]
+                child[:, cell] = value
+                children.append(child)
+                parents.append(index)
+        return np.concatenate(children, axis=0), np.concatenate(parents)
+
+    def keys(self, masks):
+        """
+        Pack a batch of masks into integers (two bits per cell)
+        """
+
+        shifts = 2*np.arange(self.num_of_cells, dtype=np.uint64)
+        return (masks.astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+
+    def search_activities(self, backward_any, backward_only, upper_bound=None, incumbent=None, deadline=None):
+        """
+        Run the beam searches of a chunk of EL activities in lockstep
+
+        upper_bound bounds the objective of every search; incumbent, if given, is the best objective
+        shared with the other chunks (a multiprocessing.Value), and the searches that cannot exceed
+        it are dropped. Returns the best objective of every search (-1 if no input mask is found),
+        its input mask and whether the chunk was stopped by the deadline.
+        """
+
+        num_of_searches = backward_any.shape[0]
+        upper_bound = np.full(num_of_searches, max(self.cell_values)*self.num_of_cells) if upper_bound is None else upper_bound
+        best_objective = np.full(num_of_searches, -1, dtype=np.int64)
+        best_mask = np.zeros((num_of_searches, self.num_of_cells), dtype=np.int8)
+        # beam holds the masks of all searches, owner the search to which every mask belongs
+        beam = np.zeros((num_of_searches, self.num_of_cells), dtype=np.int8)
+        owner = np.arange(num_of_searches)
+        interrupted = False
+        while beam.shape[0] > 0:
+            if deadline is not None and time.time() >= deadline:
+                interrupted = True
+                break
+            children, parents = self.extensions(beam)
+            if children.shape[0] == 0:
+                break
+            children_owner = owner[parents]
+            _, representative, inverse = np.unique(self.keys(children), return_index=True, return_inverse=True)
+            distinct, inverse = children[representative], inverse.reshape(-1)
+            # A mask reached from several masks of the same beam is ranked once
+            _, first = np.unique(children_owner*len(distinct) + inverse, return_index=True)
+            children, children_owner, inverse = children[first], children_owner[first], inverse[first]
+            forward_any, forward_only = self.propagator.forward_activity(self.propagator.forward(distinct)["forward_mask_sbx"])
+            lazy = self.lazy_cells(self.propagator.contradict(forward_any[inverse], forward_only[inverse],
+                                                              backward_any[children_owner], backward_only[children_owner]))
+            feasible = lazy >= 1
+            if not feasible.any():
+                break
+            children, children_owner, lazy, inverse = children[feasible], children_owner[feasible], lazy[feasible], inverse[feasible]
+            objective = children.sum(axis=1, dtype=np.int64)
+            activity = forward_any.reshape(len(distinct), -1).sum(axis=1, dtype=np.int64)[inverse]
+            # Sort every search by its ranking and keep the first width masks of each
+            order = np.lexsort((activity, -lazy, -objective, children_owner))
+            sorted_owner = children_owner[order]
+            rank = np.arange(len(order)) - np.searchsorted(sorted_owner, sorted_owner, side="left")
+            keep = order[rank < self.width]
+            beam, owner = children[keep], children_owner[keep]
+            top = order[rank == 0]
+            improved = top[objective[top] > best_objective[children_owner[top]]]
+            best_objective[children_owner[improved]] = objective[improved]
+            best_mask[children_owner[improved]] = children[improved]
+            bound = int(best_objective.max())
+            if incumbent is not None:
+                with incumbent.get_lock():
+                    incumbent.value = max(incumbent.value, bound)
+                    bound = incumbent.value
+            alive = upper_bound[owner] > bound
+            beam, owner = beam[alive], owner[alive]
+        return best_objective, best_mask, interrupted
+
+    def search(self, output_mask=None):
+        """
+        Run the beam search for all output cell pairs allowed by the model (or the given ones)
+        """
+
+        start_time = time.time()
+        output_mask = self.propagator.output_cell_pairs() if output_mask is None else np.asarray(output_mask, dtype=np.int8).reshape(-1, 2, 16)
+        backward_any, backward_only = self.propagator.backward_activity(self.propagator.backward(output_mask)["backward_mask_sbx"])
+        # Output cell pairs with the same EL activity have the same input masks
+        activities = np.concatenate([backward_any.reshape(backward_any.shape[0], -1), backward_only.reshape(backward_only.shape[0], -1)], axis=1)
+        _, first, inverse = np.unique(activities, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        # The EL activities are searched by decreasing upper bound, chunk by chunk, until the upper
+        # bound of the remaining ones does not exceed the best objective found so far
+        upper_bound = self.propagator.upper_bounds(backward_any[first])
+        order = np.argsort(-upper_bound, kind="stable")
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            # Small chunks keep every worker busy and let the later chunks start from a better incumbent
+            chunk_size = max(1, min(256, -(-len(order) // (4*self.num_of_workers))))
+        chunks = [order[start:start + chunk_size] for start in range(0, len(order), chunk_size)]
+        objective = np.full(len(first), -1, dtype=np.int64)
+        input_mask = np.zeros((len(first), self.num_of_cells), dtype=np.int8)
+        searched = np.zeros(len(first), dtype=bool)
+        deadline = None if self.time_limit is None else start_time + self.time_limit
+        incumbent = multiprocessing.Value("q", -1)
+        interrupted = False
+        executor = None
+        if self.num_of_workers > 1 and len(chunks) > 1:
+            executor = ProcessPoolExecutor(max_workers=self.num_of_workers, initializer=share_incumbent, initargs=(incumbent,))
+        running = dict()
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunks) or running != dict():
+                if next_chunk < len(chunks):
+                    if upper_bound[chunks[next_chunk][0]] <= incumbent.value:
+                        # The chunks are sorted by decreasing upper bound, hence none of the remaining ones can improve
+                        next_chunk = len(chunks)
+                    elif deadline is not None and time.time() >= deadline:
+                        interrupted = True
+                        next_chunk = len(chunks)
+                outcomes = []
+                if executor is None:
+                    if next_chunk < len(chunks):
+                        chunk = chunks[next_chunk]
+                        next_chunk += 1
+                        outcomes.append((chunk, self.search_activities(backward_any[first[chunk]], backward_only[first[chunk]],
+                                                                       upper_bound[chunk], incumbent, deadline)))
+                else:
+                    while next_chunk < len(chunks) and len(running) < self.num_of_workers:
+                        chunk = chunks[next_chunk]
+                        next_chunk += 1
+                        future = executor.submit(search_chunk, (self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation, self.width),
+                                                 backward_any[first[chunk]], backward_only[first[chunk]], upper_bound[chunk], deadline)
+                        running[future] = chunk
+                    if running != dict():
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        outcomes = [(running.pop(future), future.result()) for future in done]
+                for chunk, (chunk_objective, chunk_mask, chunk_interrupted) in outcomes:
+                    objective[chunk], input_mask[chunk], searched[chunk] = chunk_objective, chunk_mask, True
+                    interrupted = interrupted or chunk_interrupted
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        return {"output_mask": output_mask,
+                "objective": objective[inverse],
+                "input_mask": input_mask[inverse],
+                "found": objective[inverse] >= 1,
+                "searched": searched[inverse],
+                "num_of_activities": len(first),
+                "num_of_searches": int(searched.sum()),
+                "interrupted": interrupted,
+                "elapsed_time": time.time() - start_time}
+
+    def best(self, search):
+        """
+        Return the index of the output cell pair with the largest input mask (None if nothing is found)
+        """
+
+        if not search["found"].any():
+            return None
+        return int(search["objective"].argmax())
+
+    def build_result(self, input_mask, output_mask):
+        """
+        Collect the variables of distinguisherqarma64.mzn for an input mask and an output cell pair (see MeetInTheMiddle.build_result)
+        """
+
+        from mitmqarma64 import MeetInTheMiddle
+        return MeetInTheMiddle(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation, num_of_workers=1).build_result(input_mask, output_mask)
+
+    def print_search_summary(self, search, max_lines=8):
+        """
+        Print the outcome of the search (the max_lines output cell pairs with the largest input mask)
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Beam search (width {}):\n".format(self.width)
+        str_output += "Number of output cell pairs:      {}\n".format(len(search["found"]))
+        str_output += "Number of distinct EL activities: {} ({} searched)\n".format(search["num_of_activities"], search["num_of_searches"])
+        str_output += "Number of feasible pairs:         {}\n".format(int(search["found"].sum()))
+        str_output += "Best objective:                   {}\n".format(int(search["objective"].max()) if search["found"].any() else "-")
+        order = [q for q in np.argsort(-search["objective"], kind="stable") if search["found"][q]]
+        for q in order[:max_lines]:
+            a = int(np.flatnonzero(search["output_mask"][q, 0])[0])
+            b = int(np.flatnonzero(search["output_mask"][q, 1])[0])
+            str_output += "Output cells ({:02d}, {:02d}): input mask {:02d}\n".format(a, b, int(search["objective"][q]))
+        if len(order) > max_lines:
+            str_output += "... and {} more\n".format(len(order) - max_lines)
+        str_output += "Elapsed time: {:0.02f} seconds{}\n".format(search["elapsed_time"], " (stopped by the time limit)" if search["interrupted"] else "")
+        str_output += line_separator
+        return str_output
+
+# Best objective shared by the worker processes of a search (see share_incumbent)
+shared_incumbent = None
+
+def share_incumbent(incumbent):
+    '''
+    Initialize a worker process with the best objective shared by the chunks
+    '''
+
+    global shared_incumbent
+    shared_incumbent = incumbent
+
+def search_chunk(arguments, backward_any, backward_only, upper_bound, deadline):
+    '''
+    Run the beam search for a chunk of EL activities in a worker process
+    '''
+
+    return BeamSearch(*arguments, num_of_workers=1).search_activities(backward_any, backward_only, upper_bound, shared_incumbent, deadline)
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and run the beam search
+    '''
+
+    parser = ArgumentParser(description="This tool finds integral distinguishers for Qarma-v2-64 with a solver-free beam search\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=4, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=13, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-b", default=16, type=int, help="width of the beam\n")
+    parser.add_argument("-w", default=None, type=int, help="number of worker processes (default: number of CPUs)\n")
+    parser.add_argument("-tl", default=None, type=int, help="time limit of the search in seconds (the best distinguisher found so far is reported)\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the best distinguisher is appended\n")
+    parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    args = parser.parse_args()
+    from distinguisherqarma64 import IntegralDistinguisher, default_parameters
+    params = default_parameters()
+    params.update(RU=args.RU, RL=args.RL, KR=args.KR, tk_interpretation=args.tki, output_file_name=args.o)
+    integral__distinguisher = IntegralDistinguisher(params)
+    beam = BeamSearch(integral__distinguisher.RU, integral__distinguisher.RL, args.KR,
+                      integral__distinguisher.NPT, args.tki, width=args.b, num_of_workers=args.w, time_limit=args.tl)
+    search = beam.search()
+    print(beam.print_search_summary(search))
+    q = beam.best(search)
+    if q is None:
+        print("No output cell pair leads to a contradiction")
+        return
+    integral__distinguisher.result = beam.build_result(search["input_mask"][q], search["output_mask"][q])
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        ResultArchive.append_to_file(args.ar, [integral__distinguisher.result], beam.RU, beam.RL, beam.KR, beam.NPT, beam.tk_interpretation)
+    integral__distinguisher.report()
+
+if __name__ == "__main__":
+    main()
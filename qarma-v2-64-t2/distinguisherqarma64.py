@@ -27,16 +27,210 @@ SOFTWARE.
 email: hsn.hadipour@gmail.com
 """
 
+import os
+import json
+import shutil
+import itertools
+import types
 import time
-import minizinc
+import copy
+import asyncio
+import threading
+import contextlib
 import datetime
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor
 from argparse import ArgumentParser, RawTextHelpFormatter
-from drawdistinguisherqarma64 import *
 from pathlib import Path
 line_separator = "#"*55
+cipher_variant = "qarma-v2-64-t2"
+# minizinc (which runs the MiniZinc executable on import), NumPy and the drawing module are
+# imported where they are needed, so that --help and loading a stored result start quickly
+solver_cache_file_name = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "qarmav2-integral", "solvers.json")
+# Interpretations of the reduced round: the entry of tkp_sequence that initiates the second tweakey permutation
+tk_interpretations = ["max_ru_rl - 1", "min_ru_rl - 1", "ceil((KR - 2) / 2) - 1"]
+# Parameters that can be varied in a compile-only grid (-grid key=value,value,...)
+grid_parameters = {"RU": ("RU", int), "RL": ("RL", int), "KR": ("KR", int), "NPT": ("NPT", int),
+                   "sl": ("cp_solver_name", str), "enc": ("encoding", str), "tki": ("tk_interpretation", int),
+                   "be": ("backend", str)}
+
+def decode_boolean_result(result):
+    """
+    Map a result of distinguisherqarma64bool.mzn back to the variables of distinguisherqarma64.mzn
+
+    <direction>_<state>_bits (the last axis holds [mask >= 2, mask is odd, class bits 0..3]) gives
+    <direction>_mask_<state> and <direction>_class_<state>, and <name>_bool gives the 0/1 array <name>
+    """
+
+    import numpy as np
+    if result is None or result.solution is None:
+        return result
+    fields = dict()
+    for name, value in vars(result.solution).items():
+        if name.endswith("_bits"):
+            direction, state = name[:-len("_bits")].split("_", 1)
+            bits = np.array(value, dtype=np.int64)
+            mask = 2*bits[..., 0] + bits[..., 1]
+            class_value = np.where(mask == 1, bits[..., 2:] @ np.array([1, 2, 4, 8]), np.array([0, 0, -1, -2])[mask])
+            fields["{}_mask_{}".format(direction, state)] = mask.tolist()
+            fields["{}_class_{}".format(direction, state)] = class_value.tolist()
+        elif name.endswith("_bool"):
+            fields[name[:-len("_bool")]] = np.array(value, dtype=np.int64).tolist()
+        else:
+            fields[name] = value
+    return dataclasses.replace(result, solution=types.SimpleNamespace(**fields))
+
+def lookup_solver(solver_name):
+    """
+    Look up a MiniZinc solver configuration, caching the output of `minizinc --solvers-json` on disk
+
+    The cache is keyed by the path and the modification time of the MiniZinc executable,
+    hence it is refreshed whenever MiniZinc is reinstalled or updated
+    """
+
+    import minizinc
+    if minizinc.default_driver is None:
+        return minizinc.Solver.lookup(solver_name)
+    executable = str(minizinc.default_driver.executable)
+    key = "{}@{}".format(executable, os.path.getmtime(executable))
+    try:
+        with open(solver_cache_file_name, "r") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        cache = dict()
+    if cache.get("key") != key:
+        cache = {"key": key, "solvers": dict()}
+    if solver_name in cache["solvers"]:
+        configuration = cache["solvers"][solver_name]
+        configuration["extraFlags"] = [tuple(flag) for flag in configuration["extraFlags"]]
+        return minizinc.Solver(**configuration)
+    solver = minizinc.Solver.lookup(solver_name)
+    cache["solvers"][solver_name] = dataclasses.asdict(solver)
+    try:
+        os.makedirs(os.path.dirname(solver_cache_file_name), exist_ok=True)
+        temporary_file_name = "{}.{}.tmp".format(solver_cache_file_name, os.getpid())
+        with open(temporary_file_name, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(temporary_file_name, solver_cache_file_name)
+    except OSError:
+        pass
+    return solver
+
+class SolverMemoryMonitor:
+    """
+    Sample the RSS of the MiniZinc/solver subprocesses and kill them once it exceeds the memory limit
+
+    The limit is a budget on the sampled RSS, not an rlimit: RLIMIT_AS bounds the virtual address
+    space, which multi-threaded and JVM-based solvers reserve far beyond their RSS.
+    """
+
+    def __init__(self, memory_limit=None, interval=0.05) -> None:
+        """
+        memory_limit is given in MB (None means no cap)
+        """
+
+        self.memory_limit = None if memory_limit is None else memory_limit * 2**20
+        self.interval = interval
+        self.peak_rss = None
+        self.exceeded = False
+        try:
+            import psutil
+            self.psutil = psutil
+        except ImportError:
+            if self.memory_limit is not None:
+                raise ImportError("The Python package psutil is required to apply a memory limit")
+            self.psutil = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.psutil is not None:
+            self.peak_rss = 0
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+        return False
+
+    def _sample(self):
+        """
+        Record the total RSS of the subprocesses and kill them once it exceeds the memory limit
+        """
+
+        this_process = self.psutil.Process()
+        while not self._stop_event.wait(self.interval):
+            children = this_process.children(recursive=True)
+            rss = 0
+            for child in children:
+                try:
+                    rss += child.memory_info().rss
+                except (self.psutil.NoSuchProcess, self.psutil.AccessDenied, ProcessLookupError):
+                    continue
+            self.peak_rss = max(self.peak_rss, rss)
+            if self.memory_limit is not None and rss > self.memory_limit:
+                self.exceeded = True
+                for child in children:
+                    try:
+                        child.kill()
+                    except self.psutil.NoSuchProcess:
+                        pass
+
+    def is_memory_error(self, error):
+        """
+        Decide whether a MiniZinc error was caused by the memory limit
+        """
+
+        if self.memory_limit is None:
+            return False
+        message = str(error).lower()
+        return self.exceeded or any(pattern in message for pattern in ["bad_alloc", "out of memory", "cannot allocate memory", "memoryerror"])
+
+def trace_statistics(statistics):
+    '''
+    Convert the solver statistics of an intermediate solution into JSON-friendly values
+    '''
+
+    converted = dict()
+    for key, value in statistics.items():
+        if isinstance(value, datetime.timedelta):
+            converted[key] = value.total_seconds()
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            converted[key] = value
+        else:
+            converted[key] = str(value)
+    return converted
+
+@dataclasses.dataclass
+class SearchResult:
+    """
+    Outcome of one search: the run record (parameters, status, elapsed time, peak RSS, objective)
+    and the solver result, which can be passed to IntegralDistinguisher.report or ResultArchive
+    """
+
+    record: dict
+    result: object = None
+    prefilter_summary: str = None
+
+    @property
+    def status(self):
+        return self.record["status"]
+
+    @property
+    def solved(self):
+        return self.status in ["OPTIMAL_SOLUTION", "SATISFIED", "ALL_SOLUTIONS"]
+
+    @property
+    def objective(self):
+        return self.record.get("objective")
 
 class IntegralDistinguisher:
     ID_counter = 0
+    # Attributes set while solving, which a portfolio copies back from its winning copy
+    solve_attributes = ["presolve_summary", "lazy_index_summary", "native_summary", "heuristic_summary", "heuristic_result"]
 
     def __init__(self, params) -> None:
         IntegralDistinguisher.ID_counter += 1
@@ -46,23 +240,73 @@ class IntegralDistinguisher:
 
         self.RU = params["RU"] - 1
         self.RL = params["RL"] - 1
+        # The same bounds as the MiniZinc models, so that both backends accept the same parameters
+        assert(self.RU >= 1 and self.RL >= 1), "RU and RL must be at least 2 (got RU={}, RL={})".format(params["RU"], params["RL"])
         self.KR = params["KR"]
         self.cp_solver_name = params["cp_solver_name"]
         self.time_limit = params["time_limit"]
         self.num_of_threads = params["num_of_threads"]
         self.output_file_name = params["output_file_name"]
+        self.memory_limit = params["memory_limit"]
+        self.prefilter = params["prefilter"]
+        self.tk_interpretation = params["tk_interpretation"]
+        self.encoding = params["encoding"]
+        self.mix_column_table = params["mix_column_table"]
+        self.archive_file_name = params["archive_file_name"]
+        self.random_seed = params["random_seed"]
+        self.portfolio_size = params["portfolio_size"]
+        self.record_trace = params["record_trace"]
+        self.trace_file_name = params["trace_file_name"]
+        self.check_certificate = params["check_certificate"]
+        self.presolve = params["presolve"]
+        self.implied_constraints = params["implied_constraints"]
+        self.presolve_summary = None
+        self.lazy_index = params["lazy_index"]
+        self.lazy_index_summary = None
+        self.beam_width = params["beam_width"]
+        self.beam_time_limit = params["beam_time_limit"]
+        self.heuristic_summary = None
+        self.heuristic_result = None
+        # Backend: the MiniZinc model, or the native CP-SAT model of cpsatqarma64.py
+        self.backend = params["backend"]
+        self.native = None
+        self.native_summary = None
 
         self.supported_cp_solvers = ['gecode', 'chuffed', 'cbc', 'gurobi',
                                      'picat', 'scip', 'choco', 'ortools']
+        assert(self.cp_solver_name in self.supported_cp_solvers), "Unsupported solver: {}".format(self.cp_solver_name)
+        # Search annotation, restart policy and solver flags tuned by tunerqarma64.py (integer encoding only)
+        self.search_profile = params["search_profile"]
+        if self.search_profile is None and params["tuned_profile"] and self.encoding == "int" and self.backend == "minizinc":
+            from tunerqarma64 import Autotuner
+            self.search_profile = Autotuner.load_profile(self.cp_solver_name)
+        assert(not (self.search_profile is not None and self.encoding == "bool")), "A search profile requires the integer encoding"
+        # An explicit number of threads (-p) takes precedence over the one of the profile
+        if self.search_profile is not None and "num_of_threads" in self.search_profile and params["profile_threads"]:
+            self.num_of_threads = self.search_profile["num_of_threads"]
         ##################################################
         # Use this block if you install Or-Tools bundeled with MiniZinc
         if self.cp_solver_name == "ortools":
             self.cp_solver_name = "com.google.ortools.sat"
         ################################################## 
-        assert(self.cp_solver_name in self.supported_cp_solvers)
-        self.cp_solver = minizinc.Solver.lookup(self.cp_solver_name)
-        self.mzn_file_name = "distinguisherqarma64.mzn"
-        self.NPT = 1        
+        self.cp_solver = None
+        assert(self.encoding in ["int", "bool"]), "Unknown encoding: {}".format(self.encoding)
+        assert(not (self.mix_column_table and self.encoding == "bool")), "The MixColumn table requires the integer encoding"
+        assert(not (self.presolve and self.encoding == "bool")), "The presolve requires the integer encoding"
+        assert(not (self.implied_constraints != [] and self.encoding == "bool")), "Implied constraints require the integer encoding"
+        # The copies of a portfolio run their solvers side by side, so a memory cap could not tell them apart
+        assert(not (self.memory_limit is not None and self.portfolio_size > 1)), "A memory limit cannot be combined with a portfolio"
+        assert(self.backend in ["minizinc", "cpsat"]), "Unknown backend: {}".format(self.backend)
+        if self.backend == "cpsat":
+            # The native model replaces the integer encoding of the MiniZinc model and has its own search
+            assert(params["cp_solver_name"] == "ortools" and self.encoding == "int"), "The cpsat backend requires ortools and the integer encoding"
+            assert(not self.presolve and self.implied_constraints == [] and self.search_profile is None), "The cpsat backend does not support the presolve, implied constraints or search profiles"
+            assert(self.memory_limit is None), "The cpsat backend does not support a memory limit"
+        if self.encoding == "bool":
+            self.mzn_file_name = "distinguisherqarma64bool.mzn"
+        else:
+            self.mzn_file_name = "distinguisherqarma64.mzn"
+        self.NPT = params["NPT"]        
                     
     #############################################################################################################################################
     #############################################################################################################################################
@@ -73,51 +317,494 @@ class IntegralDistinguisher:
     #  ___) || (_) || | \ V /|  __/ | |_ | | | ||  __/ | |  | || (_) || (_| ||  __/| |
     # |____/  \___/ |_|  \_/  \___|  \__||_| |_| \___| |_|  |_| \___/  \__,_| \___||_|
         
-    def search(self):
+    def tkp_sequence_index(self):
         """
-        Search for a zero-correlation distinguisher optimized for key recovery
+        Return the entry of tkp_sequence that initiates the second tweakey permutation
         """
 
-        if self.time_limit != -1:
-            time_limit = datetime.timedelta(seconds=self.time_limit)
-        else:
-            time_limit = None
-    
-        start_time = time.time()
-        ####################################################################################################
-        ####################################################################################################
-        self.cp_model = minizinc.Model()
-        self.cp_model.add_file(self.mzn_file_name)
+        max_ru_rl = max(self.RU, self.RL, 2)
+        min_ru_rl = min(self.RU, self.RL)
+        return [max_ru_rl - 1, min_ru_rl - 1, -(-(self.KR - 2) // 2) - 1][self.tk_interpretation]
+
+    def build_instance(self, cp_model=None):
+        """
+        Create the MiniZinc instance (cp_model is parsed from mzn_file_name unless a shared model is given)
+        """
+
+        import minizinc
+        if self.cp_solver is None:
+            self.cp_solver = lookup_solver(self.cp_solver_name)
+        if cp_model is None:
+            cp_model = minizinc.Model()
+            cp_model.add_file(self.mzn_file_name)
+        self.cp_model = cp_model
         self.cp_inst = minizinc.Instance(solver=self.cp_solver, model=self.cp_model)
         self.cp_inst["RU"] = self.RU
         self.cp_inst["RL"] = self.RL
         self.cp_inst["KR"] = self.KR
-        self.cp_inst["NPT"] = self.NPT        
-        self.result = self.cp_inst.solve(timeout=time_limit, 
-                                         processes=self.num_of_threads, 
-                                         #verbose=True, 
-                                         debug_output=Path("./debug_output.txt", intermediate_solutions=True),                                         
-                                         optimisation_level=2)
-        ####################################################################################################
-        ####################################################################################################
-        elapsed_time = time.time() - start_time
-        print("Elapsed time: {:0.02f} seconds".format(elapsed_time))
-
-        if self.result.status == minizinc.Status.OPTIMAL_SOLUTION or self.result.status == minizinc.Status.SATISFIED or \
-                            self.result.status == minizinc.Status.ALL_SOLUTIONS:           
-            attack_summary = self.print_attack_parameters()
-            attack_summary += line_separator + "\n"
-            print(attack_summary)
-            draw = Draw(self, output_file_name=self.output_file_name, attack_summary=attack_summary)
-            draw.generate_attack_shape()
-        elif self.result.status == minizinc.Status.UNSATISFIABLE:
+        self.cp_inst["NPT"] = self.NPT
+        self.cp_inst["tk_interpretation"] = self.tk_interpretation
+        if self.encoding == "int":
+            if self.mix_column_table:
+                from mixcolumnqarma64 import MixColumnTable
+                self.cp_inst.add_file(MixColumnTable.dzn_file_name(), parse_data=False)
+            else:
+                self.cp_inst.add_string("mix_column_transitions = array2d(1..0, 1..20, []);\n")
+            search_profile = dict() if self.search_profile is None else self.search_profile
+            self.cp_inst.add_string("search_annotation = {};\nrestart_annotation = {};\n".format(
+                search_profile.get("search_annotation", "seq_search([])"), search_profile.get("restart_annotation", "restart_none")))
+            if self.implied_constraints != []:
+                from impliedqarma64 import ImpliedConstraints
+                implied = ImpliedConstraints(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+                self.cp_inst.add_string(implied.constraints(self.implied_constraints))
+            if self.presolve:
+                # Fix the variables forced by the round structure before flattening
+                from presolveqarma64 import Presolve
+                presolve = Presolve(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+                self.cp_inst.add_string(presolve.constraints())
+                self.presolve_summary = presolve.print_summary()
+                self.presolve_fixed_variables = presolve.num_of_fixed
+        if self.lazy_index:
+            # Restrict contradict to the tweak cells that can be lazy (cached index of lazycellsqarma64.py)
+            from lazycellsqarma64 import LazyCellIndex
+            lazy_cell_index = LazyCellIndex.load(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+            self.cp_inst.add_string(lazy_cell_index.constraints())
+            self.lazy_index_summary = lazy_cell_index.print_summary()
+            self.num_of_lazy_candidates = int(lazy_cell_index.lazy_candidates().sum())
+        return self.cp_inst
+
+    def build_native(self):
+        """
+        Build the native CP-SAT model of cpsatqarma64.py instead of the MiniZinc instance
+        """
+
+        from cpsatqarma64 import CpSatModel
+        self.native = CpSatModel(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation).build()
+        if self.lazy_index:
+            from lazycellsqarma64 import LazyCellIndex
+            lazy_cell_index = LazyCellIndex.load(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+            self.native.restrict_lazy_cells(lazy_cell_index)
+            self.lazy_index_summary = lazy_cell_index.print_summary()
+            self.num_of_lazy_candidates = int(lazy_cell_index.lazy_candidates().sum())
+        self.native_summary = self.native.print_model_summary()
+        return self.native
+
+    def compile(self, time_limit=None, fzn_directory=None):
+        """
+        Flatten the instance for the selected solver without solving it and return a compile record
+        (parameters, flatten time, FlatZinc variable and constraint counts, or the MiniZinc error)
+
+        If fzn_directory is given, the FlatZinc file is kept there. With the native CP-SAT backend,
+        the record holds the time to build the model and its variable and constraint counts instead.
+        """
+
+        record = {"RU": self.RU + 1,
+                  "RL": self.RL + 1,
+                  "KR": self.KR,
+                  "NPT": self.NPT,
+                  "tk_interpretation": self.tk_interpretation,
+                  "encoding": self.encoding,
+                  "mix_column_table": self.mix_column_table,
+                  "presolve": self.presolve,
+                  "lazy_index": self.lazy_index,
+                  "implied_constraints": self.implied_constraints,
+                  "cp_solver_name": self.cp_solver_name,
+                  "backend": self.backend,
+                  "mzn_file_name": self.mzn_file_name,
+                  "error": None}
+        if self.backend == "cpsat":
+            start_time = time.time()
+            self.build_native()
+            record["flatten_time"] = time.time() - start_time
+            record["num_of_variables"] = len(self.native.model.proto.variables)
+            record["num_of_constraints"] = len(self.native.model.proto.constraints)
+            return record
+        import minizinc
+        flat_arguments = dict(optimisation_level=2)
+        if time_limit is not None:
+            flat_arguments["time_limit"] = datetime.timedelta(seconds=time_limit)
+        start_time = time.time()
+        try:
+            self.build_instance()
+            with self.cp_inst.flat(**flat_arguments) as (fzn, ozn, statistics):
+                record["flatten_time"] = time.time() - start_time
+                record["num_of_variables"] = sum(int(value) for key, value in statistics.items() if key.startswith("flat") and key.endswith("Vars"))
+                record["num_of_constraints"] = sum(int(value) for key, value in statistics.items() if key.startswith("flat") and key.endswith("Constraints"))
+                record["statistics"] = {key: str(value) for key, value in statistics.items()}
+                if fzn_directory is not None:
+                    os.makedirs(fzn_directory, exist_ok=True)
+                    record["fzn_file_name"] = os.path.join(fzn_directory, "{}_RU{}_RL{}_KR{}_NPT{}_tki{}_{}_{}.fzn".format(
+                        Path(self.mzn_file_name).stem, self.RU + 1, self.RL + 1, self.KR, self.NPT,
+                        self.tk_interpretation, "table" if self.mix_column_table else "xor", self.cp_solver_name))
+                    shutil.copyfile(fzn.name, record["fzn_file_name"])
+        except (minizinc.MiniZincError, LookupError) as error:
+            # LookupError: the solver is not installed
+            record["flatten_time"] = time.time() - start_time
+            record["error"] = str(error).strip().splitlines()[-1] if str(error).strip() != "" else type(error).__name__
+        return record
+
+    async def solve_async(self, cp_model=None, debug_output=None, monitor_memory=True, constraints=None, progress=None):
+        """
+        Solve the model and return a SearchResult without printing, drawing or writing anything
+        (apart from debug_output, if given); constraints is extra MiniZinc code added to the instance,
+        and progress, if given, is called with the trace entry of every intermediate solution
+        """
+
+        if self.time_limit is not None and self.time_limit != -1:
+            time_limit = datetime.timedelta(seconds=self.time_limit)
+        else:
+            time_limit = None
+        if self.backend == "cpsat":
+            # Extra constraints are MiniZinc code
+            assert(constraints is None)
+            self.build_native()
+        else:
+            self.build_instance(cp_model)
+        if constraints is not None:
+            self.cp_inst.add_string(constraints)
+        start_time = time.time()
+        self.run_record = {"variant": cipher_variant,
+                           "RU": self.RU + 1,
+                           "RL": self.RL + 1,
+                           "KR": self.KR,
+                           "NPT": self.NPT,
+                           "tk_interpretation": self.tk_interpretation,
+                           "tkp_sequence_index": self.tkp_sequence_index(),
+                           "encoding": self.encoding,
+                           "mix_column_table": self.mix_column_table,
+                           "presolve": self.presolve,
+                           "lazy_index": self.lazy_index,
+                           "implied_constraints": self.implied_constraints,
+                           "cp_solver_name": self.cp_solver_name,
+                           "backend": self.backend,
+                           "num_of_threads": self.num_of_threads,
+                           "time_limit": self.time_limit,
+                           "memory_limit": self.memory_limit}
+        if self.presolve:
+            self.run_record["presolve_fixed_variables"] = self.presolve_fixed_variables
+        if self.lazy_index:
+            self.run_record["lazy_candidates"] = self.num_of_lazy_candidates
+        if self.backend == "cpsat":
+            self.run_record["build_time"] = self.native.build_time
+        if self.search_profile is not None:
+            self.run_record["search_profile"] = self.search_profile["name"]
+        self.result = None
+        prefilter_summary = None
+        if self.prefilter:
+            # Discard the output cells that cannot lead to a contradiction before calling the solver
+            from propagatorqarma64 import MaskPropagator
+            propagator = MaskPropagator(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+            prefilter = await asyncio.get_running_loop().run_in_executor(None, propagator.prefilter)
+            prefilter_summary = propagator.print_prefilter_summary(prefilter)
+            self.run_record["prefilter_feasible_pairs"] = int(prefilter["feasible"].sum())
+            if not prefilter["feasible"].any():
+                self.run_record["status"] = "UNSATISFIABLE"
+                self.run_record["elapsed_time"] = time.time() - start_time
+                self.run_record["peak_rss"] = None
+                return SearchResult(record=self.run_record, result=None, prefilter_summary=prefilter_summary)
+            if self.backend == "cpsat":
+                self.native.restrict_output_pairs(prefilter)
+            else:
+                self.cp_inst.add_string(propagator.prefilter_constraints(prefilter))
+        if self.beam_width is not None:
+            # Bound the objective from below by the best input mask of the beam search
+            from beamqarma64 import BeamSearch
+            beam = BeamSearch(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation, width=self.beam_width,
+                              time_limit=self.beam_time_limit)
+            heuristic = await asyncio.get_running_loop().run_in_executor(None, beam.search)
+            self.heuristic_summary = beam.print_search_summary(heuristic)
+            q = beam.best(heuristic)
+            self.run_record["heuristic_objective"] = None if q is None else int(heuristic["objective"][q])
+            if q is not None:
+                self.heuristic_result = beam.build_result(heuristic["input_mask"][q], heuristic["output_mask"][q])
+                if self.backend == "cpsat":
+                    # The distinguisher of the beam search is also the starting point of CP-SAT
+                    self.native.add_lower_bound(self.run_record["heuristic_objective"])
+                    self.native.add_hint(self.heuristic_result)
+                else:
+                    self.cp_inst.add_string("constraint inputmask_distinguisher >= {};\n".format(self.run_record["heuristic_objective"]))
+        self.run_record["random_seed"] = self.random_seed
+        solve_arguments = dict(timeout=time_limit,
+                               processes=self.num_of_threads,
+                               optimisation_level=2)
+        if self.random_seed is not None:
+            solve_arguments["random_seed"] = self.random_seed
+        if self.search_profile is not None:
+            solve_arguments.update(self.search_profile["solver_flags"])
+        if debug_output is not None:
+            solve_arguments["debug_output"] = debug_output
+        memory_monitor = SolverMemoryMonitor(memory_limit=self.memory_limit)
+        if self.backend == "cpsat":
+            # CP-SAT runs in this process, hence there is no solver subprocess to cap or to sample
+            self.result = await self.solve_native_async(start_time, progress)
+        else:
+            import minizinc
+            try:
+                with memory_monitor if monitor_memory else contextlib.nullcontext():
+                    if self.record_trace or progress is not None:
+                        self.result = await self.solve_with_trace_async(solve_arguments, start_time, progress)
+                    else:
+                        self.result = await self.cp_inst.solve_async(**solve_arguments)
+            except minizinc.MiniZincError as error:
+                if not memory_monitor.is_memory_error(error):
+                    raise
+        self.run_record["elapsed_time"] = time.time() - start_time
+        self.run_record["peak_rss"] = memory_monitor.peak_rss
+        if memory_monitor.exceeded or self.result is None:
+            self.run_record["status"] = "MEMORY_LIMIT"
+        else:
+            if self.encoding == "bool":
+                self.result = decode_boolean_result(self.result)
+            self.run_record["status"] = self.result.status if self.backend == "cpsat" else self.result.status.name
+            if self.result.solution is not None:
+                self.run_record["objective"] = self.result["inputmask_distinguisher"]
+                if self.check_certificate:
+                    from checkerqarma64 import CertificateChecker
+                    checker = CertificateChecker(self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+                    self.run_record["certificate_violations"] = checker.check(self.result)
+        return SearchResult(record=self.run_record, result=self.result, prefilter_summary=prefilter_summary)
+
+    async def solve_with_trace_async(self, solve_arguments, start_time, progress=None):
+        """
+        Solve like Instance.solve_async, but append the wall time, the objective and the solver
+        statistics of every intermediate solution to run_record["trace"] (and pass them to progress)
+        """
+
+        import minizinc
+        status = minizinc.Status.UNKNOWN
+        solution = None
+        statistics = dict()
+        self.run_record["trace"] = []
+        async for result in self.cp_inst.solutions(intermediate_solutions=True, **solve_arguments):
+            status = result.status
+            statistics.update(result.statistics)
+            if result.solution is not None:
+                solution = result.solution
+                self.run_record["trace"].append({"elapsed_time": time.time() - start_time,
+                                                 "objective": result["inputmask_distinguisher"],
+                                                 "statistics": trace_statistics(result.statistics)})
+                if progress is not None:
+                    progress(self.run_record["trace"][-1])
+        return minizinc.Result(status, solution, statistics)
+
+    async def solve_native_async(self, start_time, progress=None):
+        """
+        Solve the native CP-SAT model in a worker thread with num_of_threads workers and return its CpSatResult
+
+        With record_trace or progress, the intermediate solutions are traced like in solve_with_trace_async.
+        Cancelling the task stops the solver.
+        """
+
+        loop = asyncio.get_running_loop()
+        def append_entry(entry):
+            self.run_record["trace"].append(entry)
+            if progress is not None:
+                progress(entry)
+        def trace_solution(objective, statistics):
+            # Called from the solver thread
+            entry = {"elapsed_time": time.time() - start_time, "objective": objective, "statistics": statistics}
+            loop.call_soon_threadsafe(append_entry, entry)
+        on_solution = None
+        if self.record_trace or progress is not None:
+            self.run_record["trace"] = []
+            on_solution = trace_solution
+        time_limit = self.time_limit if self.time_limit is not None and self.time_limit != -1 else None
+        try:
+            return await loop.run_in_executor(None, lambda: self.native.solve(num_of_workers=self.num_of_threads, time_limit=time_limit,
+                                                                              random_seed=self.run_record["random_seed"], on_solution=on_solution))
+        except asyncio.CancelledError:
+            self.native.stop()
+            raise
+
+    def write_trace(self, run_record):
+        """
+        Append a run record (with its trace) as one JSON line to trace_file_name
+        """
+
+        with open(self.trace_file_name, "a") as trace_file:
+            trace_file.write(json.dumps(run_record) + "\n")
+
+    def solve(self, cp_model=None, debug_output=None):
+        """
+        Blocking version of solve_async
+        """
+
+        return asyncio.run(self.solve_async(cp_model=cp_model, debug_output=debug_output))
+
+    def portfolio_seeds(self):
+        """
+        Return the fixed seeds of the portfolio (consecutive seeds starting at random_seed, or at 0)
+        """
+
+        first_seed = 0 if self.random_seed is None else self.random_seed
+        return list(range(first_seed, first_seed + self.portfolio_size))
+
+    async def solve_portfolio_async(self, seeds, cp_model=None):
+        """
+        Run one copy of the solver per seed concurrently and return the SearchResult of the winner
+
+        The first copy that proves optimality or unsatisfiability wins and the other copies are
+        stopped; otherwise the best objective at the deadline wins. The threads are split evenly
+        between the copies, and the outcome of every seed is kept in record["portfolio"].
+        """
+
+        if self.backend == "minizinc":
+            import minizinc
+            if self.cp_solver is None:
+                self.cp_solver = lookup_solver(self.cp_solver_name)
+            if cp_model is None:
+                cp_model = minizinc.Model()
+                cp_model.add_file(self.mzn_file_name)
+        start_time = time.time()
+        copies = dict()
+        distinguishers = dict()
+        for seed in seeds:
+            distinguishers[seed] = copy.copy(self)
+            distinguishers[seed].random_seed = seed
+            distinguishers[seed].num_of_threads = max(1, self.num_of_threads // len(seeds))
+            copies[asyncio.ensure_future(distinguishers[seed].solve_async(cp_model=cp_model, monitor_memory=False))] = seed
+        outcomes = dict()
+        errors = dict()
+        winner = None
+        pending = set(copies.keys())
+        while pending != set() and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # A failing copy is reported in the portfolio and leaves the other copies running
+                if task.exception() is not None:
+                    errors[copies[task]] = task.exception()
+                    continue
+                outcomes[copies[task]] = task.result()
+                if winner is None and outcomes[copies[task]].status in ["OPTIMAL_SOLUTION", "UNSATISFIABLE"]:
+                    winner = outcomes[copies[task]]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if outcomes == dict():
+            # Nothing to return if every copy failed
+            raise errors[seeds[0]]
+        if winner is None:
+            solved = [outcomes[seed] for seed in seeds if seed in outcomes and outcomes[seed].solved]
+            winner = max(solved, key=lambda search_result: search_result.objective) if solved != [] else outcomes[min(outcomes.keys(), key=seeds.index)]
+        portfolio = []
+        for seed in seeds:
+            if seed in outcomes:
+                portfolio.append({"random_seed": seed,
+                                  "status": outcomes[seed].status,
+                                  "objective": outcomes[seed].objective,
+                                  "elapsed_time": outcomes[seed].record["elapsed_time"]})
+            elif seed in errors:
+                portfolio.append({"random_seed": seed, "status": "ERROR", "objective": None, "elapsed_time": None,
+                                  "error": "{}: {}".format(type(errors[seed]).__name__, errors[seed])})
+            else:
+                portfolio.append({"random_seed": seed, "status": "CANCELLED", "objective": None, "elapsed_time": None})
+        winner.record["portfolio"] = portfolio
+        winner.record["portfolio_elapsed_time"] = time.time() - start_time
+        # The summaries of the presolve, the indices, the native model and the beam search are set on the winning copy
+        winning_seed = next(seed for seed in outcomes if outcomes[seed] is winner)
+        for attribute in IntegralDistinguisher.solve_attributes:
+            setattr(self, attribute, getattr(distinguishers[winning_seed], attribute))
+        self.result = winner.result
+        self.run_record = winner.record
+        return winner
+
+    def print_portfolio(self, search_result):
+        """
+        Print the outcome of every seed of a portfolio run
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Seed portfolio (winning seed: {}):\n".format(search_result.record["random_seed"])
+        for outcome in search_result.record["portfolio"]:
+            str_output += "Seed {:03d}: {}".format(outcome["random_seed"], outcome["status"])
+            if "error" in outcome:
+                str_output += " ({})".format(outcome["error"])
+            if outcome["objective"] is not None:
+                str_output += ", objective {}".format(outcome["objective"])
+            if outcome["elapsed_time"] is not None:
+                str_output += ", {:0.02f} seconds".format(outcome["elapsed_time"])
+            str_output += "\n"
+        str_output += line_separator
+        return str_output
+
+    def search(self):
+        """
+        Search for a zero-correlation distinguisher optimized for key recovery
+        """
+
+        if self.archive_file_name is not None:
+            # Reject an archive of other parameters before solving rather than after
+            from storageqarma64 import ResultArchive
+            ResultArchive.check_file(self.archive_file_name, self.RU, self.RL, self.KR, self.NPT, self.tk_interpretation)
+        if self.portfolio_size > 1:
+            search_result = asyncio.run(self.solve_portfolio_async(self.portfolio_seeds()))
+            print(self.print_portfolio(search_result))
+        else:
+            search_result = self.solve(debug_output=Path("./debug_output.txt", intermediate_solutions=True))
+        if search_result.prefilter_summary is not None:
+            print(search_result.prefilter_summary)
+        if self.presolve_summary is not None:
+            print(self.presolve_summary)
+        if self.lazy_index_summary is not None:
+            print(self.lazy_index_summary)
+        if self.native_summary is not None:
+            print(self.native_summary)
+        if self.heuristic_summary is not None:
+            print(self.heuristic_summary)
+        if self.trace_file_name is not None:
+            self.write_trace(search_result.record)
+        print("Elapsed time: {:0.02f} seconds".format(search_result.record["elapsed_time"]))
+        if search_result.record["peak_rss"] is not None:
+            print("Peak RSS of the solver: {:0.02f} MB".format(search_result.record["peak_rss"] / 2**20))
+        if search_result.status == "MEMORY_LIMIT":
+            print("Solving process exceeded the memory limit of {} MB".format(self.memory_limit))
+        elif search_result.solved:
+            if "certificate_violations" in search_result.record:
+                violations = search_result.record["certificate_violations"]
+                print("Certificate check: {}".format("valid" if violations == [] else "INVALID (" + "; ".join(violations) + ")"))
+            if self.archive_file_name is not None:
+                from storageqarma64 import ResultArchive
+                ResultArchive.append_to_file(self.archive_file_name, [self.result], self.RU, self.RL, self.KR, self.NPT,
+                                             self.tk_interpretation)
+            self.report()
+        elif search_result.status == "UNSATISFIABLE":
             print("Model is unsatisfiable")
         else:
             print("Solving process was interrupted")
+            if self.heuristic_result is not None:
+                print("Drawing the distinguisher found by the beam search")
+                self.result = self.heuristic_result
+                self.report()
     #############################################################################################################################################
     #############################################################################################################################################
     #############################################################################################################################################
 
+    def report(self):
+        """
+        Print the attack parameters of self.result and draw the shape of the attack
+        """
+
+        from drawdistinguisherqarma64 import Draw
+        from keyrecoveryqarma64 import KeyRecoveryEstimator
+        attack_summary = self.print_attack_parameters()
+        attack_summary += KeyRecoveryEstimator(self.RU, self.RL, self.KR, self.NPT).print_key_recovery_parameters(self.result)
+        attack_summary += line_separator + "\n"
+        print(attack_summary)
+        draw = Draw(self, output_file_name=self.output_file_name, attack_summary=attack_summary)
+        draw.generate_attack_shape()
+
+    def load_result(self, archive_file_name, index):
+        """
+        Load a result from a packed archive (memory-mapped) instead of solving the model
+        """
+
+        from storageqarma64 import ResultArchive
+        archive = ResultArchive.load(archive_file_name)
+        self.RU, self.RL, self.KR, self.NPT = archive.RU, archive.RL, archive.KR, archive.NPT
+        if archive.tk_interpretation is not None:
+            self.tk_interpretation = archive.tk_interpretation
+        self.result = archive[index]
+
     def print_attack_parameters(self):
         """
         Print attack parameters
@@ -155,20 +842,205 @@ class IntegralDistinguisher:
 # | |_| |\__ \|  __/| |     | | | | | || |_|  __/| |   |  _|| (_| || (__|  __/
 #  \___/ |___/ \___||_|    |___||_| |_| \__|\___||_|   |_|   \__,_| \___|\___|
     
-def loadparameters(args):
+def default_parameters():
     '''
-    Extract parameters from the argument list and input file
+    Return the default parameters of IntegralDistinguisher
     '''
 
-    # Load default values
-    params = {
+    return {
               "RU": 3,
               "RL": 3,
               "KR": 14,
               "cp_solver_name" : "ortools",
               "num_of_threads" : 8,
               "time_limit" : None,
-              "output_file_name" : "output.tex"}
+              "output_file_name" : "output.tex",
+              "memory_limit" : None,
+              "prefilter" : False,
+              "tk_interpretation" : 1,
+              "compare_tk_interpretations" : False,
+              "NPT" : 1,
+              "encoding" : "int",
+              "mix_column_table" : False,
+              "archive_file_name" : None,
+              "load_index" : None,
+              "random_seed" : None,
+              "portfolio_size" : 1,
+              "record_trace" : False,
+              "trace_file_name" : None,
+              "check_certificate" : False,
+              "presolve" : False,
+              "lazy_index" : False,
+              "implied_constraints" : [],
+              "tuned_profile" : True,
+              "profile_threads" : True,
+              "search_profile" : None,
+              "beam_width" : None,
+              "beam_time_limit" : 30,
+              "backend" : "minizinc"}
+
+def search_many(param_sets, max_concurrent=None):
+    '''
+    Solve a batch of parameter sets concurrently and return one SearchResult per set (in order)
+
+    Missing parameters take their default values. Every model file is loaded into a single
+    minizinc.Model shared by its instances and every solver is looked up once (the native
+    CP-SAT backend builds its own model per set). Nothing is
+    printed, drawn or written. Memory limits are not supported here, since the solver processes
+    of concurrent runs cannot be told apart.
+    '''
+
+    distinguishers = []
+    for param_set in param_sets:
+        params = default_parameters()
+        params.update(param_set)
+        assert(params["memory_limit"] is None), "Memory limits are not supported by search_many"
+        distinguishers.append(IntegralDistinguisher(params))
+    if distinguishers == []:
+        return []
+    cp_solvers = dict()
+    cp_models = dict()
+    minizinc_distinguishers = [distinguisher for distinguisher in distinguishers if distinguisher.backend == "minizinc"]
+    if minizinc_distinguishers != []:
+        import minizinc
+    for distinguisher in minizinc_distinguishers:
+        if distinguisher.cp_solver_name not in cp_solvers:
+            cp_solvers[distinguisher.cp_solver_name] = lookup_solver(distinguisher.cp_solver_name)
+        distinguisher.cp_solver = cp_solvers[distinguisher.cp_solver_name]
+        if distinguisher.mzn_file_name not in cp_models:
+            cp_models[distinguisher.mzn_file_name] = minizinc.Model()
+            cp_models[distinguisher.mzn_file_name].add_file(distinguisher.mzn_file_name)
+    if max_concurrent is None:
+        max_concurrent = max(1, (os.cpu_count() or 1) // max(1, min(distinguisher.num_of_threads for distinguisher in distinguishers)))
+
+    async def solve_all():
+        semaphore = asyncio.Semaphore(max_concurrent)
+        async def solve_one(distinguisher):
+            async with semaphore:
+                return await distinguisher.solve_async(cp_model=cp_models.get(distinguisher.mzn_file_name), monitor_memory=False)
+        return await asyncio.gather(*[solve_one(distinguisher) for distinguisher in distinguishers])
+    return asyncio.run(solve_all())
+
+def compare_tk_interpretations(params, max_concurrent=None):
+    '''
+    Solve one parameter point under every tweakey interpretation concurrently (see search_many)
+    '''
+
+    param_sets = []
+    for tk_interpretation in range(len(tk_interpretations)):
+        param_set = dict(params)
+        param_set["tk_interpretation"] = tk_interpretation
+        param_sets.append(param_set)
+    return search_many(param_sets, max_concurrent)
+
+def print_tk_interpretations(search_results):
+    '''
+    Print the results of compare_tk_interpretations side by side
+    '''
+
+    str_output = line_separator + "\n"
+    str_output += "{:<24}{:>6}  {:<22}{:>10}{:>10}\n".format("Interpretation", "Index", "Status", "Objective", "Time (s)")
+    for search_result in search_results:
+        record = search_result.record
+        str_output += "{:<24}{:>6}  {:<22}{:>10}{:>10.02f}\n".format(tk_interpretations[record["tk_interpretation"]],
+                                                                   record["tkp_sequence_index"],
+                                                                   search_result.status,
+                                                                   "-" if search_result.objective is None else search_result.objective,
+                                                                   record["elapsed_time"])
+    str_output += line_separator
+    return str_output
+
+def compile_one(param_set, time_limit=None, fzn_directory=None):
+    '''
+    Flatten one parameter set (see IntegralDistinguisher.compile); invalid parameters are reported as an error
+    '''
+
+    params = default_parameters()
+    params.update(param_set)
+    try:
+        distinguisher = IntegralDistinguisher(params)
+    except AssertionError as error:
+        return compile_error_record(params, error)
+    return distinguisher.compile(time_limit=time_limit, fzn_directory=fzn_directory)
+
+def compile_error_record(params, error):
+    '''
+    Compile record of a parameter set that could not be flattened, with the reason as its error
+    '''
+
+    record = {key: params[key] for key in ["RU", "RL", "KR", "NPT", "tk_interpretation", "encoding", "mix_column_table", "presolve", "lazy_index", "implied_constraints", "cp_solver_name", "backend"]}
+    record.update(mzn_file_name=None, flatten_time=0.0, error=str(error) or type(error).__name__)
+    return record
+
+def compile_grid(param_sets, max_workers=None, time_limit=None, fzn_directory=None):
+    '''
+    Flatten a batch of parameter sets in a process pool without starting any solver and return
+    one compile record per set (in order)
+    '''
+
+    if param_sets == []:
+        return []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(compile_one, param_set, time_limit, fzn_directory) for param_set in param_sets]
+        records = []
+        for param_set, future in zip(param_sets, futures):
+            # A failure of one grid point (including a crashed worker) is recorded as its error
+            try:
+                records.append(future.result())
+            except Exception as error:
+                params = default_parameters()
+                params.update(param_set)
+                records.append(compile_error_record(params, "{}: {}".format(type(error).__name__, error)))
+        return records
+
+def parse_grid(grid, params):
+    '''
+    Expand the -grid items (key=value,value,...) into the cartesian product of parameter sets around params
+    '''
+
+    axes = []
+    for item in grid:
+        key, _, values = item.partition("=")
+        if key not in grid_parameters or values == "":
+            raise ValueError("Invalid grid item: {} (expected key=value,value,... with key in {})".format(item, ", ".join(grid_parameters)))
+        name, value_type = grid_parameters[key]
+        axes.append([(name, value_type(value)) for value in values.split(",")])
+    param_sets = []
+    for point in itertools.product(*axes):
+        param_set = dict(params)
+        param_set.update(point)
+        param_sets.append(param_set)
+    return param_sets
+
+def print_compile_records(records):
+    '''
+    Print the records of compile_grid as a table
+    '''
+
+    str_output = line_separator + "\n"
+    str_output += "{:>4}{:>4}{:>4}{:>5}{:>5}  {:<24}{:<6}{:>12}{:>13}{:>10}  {}\n".format("RU", "RL", "KR", "NPT", "TKI", "Solver", "Enc.",
+                                                                                       "Variables", "Constraints", "Time (s)", "Error")
+    for record in records:
+        str_output += "{:>4}{:>4}{:>4}{:>5}{:>5}  {:<24}{:<6}{:>12}{:>13}{:>10.02f}  {}\n".format(record["RU"], record["RL"], record["KR"],
+                                                                                             record["NPT"], record["tk_interpretation"],
+                                                                                             record["cp_solver_name"] if record.get("backend", "minizinc") == "minizinc" else "cpsat (native)",
+                                                                                             record["encoding"],
+                                                                                             record.get("num_of_variables", "-"),
+                                                                                             record.get("num_of_constraints", "-"),
+                                                                                             record["flatten_time"],
+                                                                                             "-" if record["error"] is None else record["error"])
+    str_output += "Compiled: {}, failed: {}\n".format(sum(record["error"] is None for record in records),
+                                                     sum(record["error"] is not None for record in records))
+    str_output += line_separator
+    return str_output
+
+def loadparameters(args):
+    '''
+    Extract parameters from the argument list and input file
+    '''
+
+    # Load default values
+    params = default_parameters()
     # Overwrite parameters if they are set on command line
     if args.RU is not None:
         params["RU"] = args.RU
@@ -176,14 +1048,57 @@ def loadparameters(args):
         params["RL"] = args.RL
     if args.KR is not None:
         params["KR"] = args.KR
+    if args.NPT is not None:
+        params["NPT"] = args.NPT
     if args.sl is not None:
         params["cp_solver_name"] = args.sl
     if args.p is not None:
         params["num_of_threads"] = args.p
+        params["profile_threads"] = False
     if args.tl is not None:
         params["time_limit"] = args.tl
     if args.o is not None:
         params["output_file_name"] = args.o
+    if args.mem is not None:
+        params["memory_limit"] = args.mem
+    if args.pf is not None:
+        params["prefilter"] = args.pf
+    if args.tki is not None:
+        params["tk_interpretation"] = args.tki
+    if args.enc is not None:
+        params["encoding"] = args.enc
+    if args.mct is not None:
+        params["mix_column_table"] = args.mct
+    if args.cmp is not None:
+        params["compare_tk_interpretations"] = args.cmp
+    if args.ar is not None:
+        params["archive_file_name"] = args.ar
+    if args.ld is not None:
+        params["load_index"] = args.ld
+    if args.seed is not None:
+        params["random_seed"] = args.seed
+    if args.ps is not None:
+        params["portfolio_size"] = args.ps
+    if args.trace is not None:
+        params["record_trace"] = True
+        params["trace_file_name"] = args.trace
+    if args.chk is not None:
+        params["check_certificate"] = args.chk
+    if args.pre is not None:
+        params["presolve"] = args.pre
+    if args.lazy is not None:
+        params["lazy_index"] = args.lazy
+    if args.nt is not None:
+        params["tuned_profile"] = not args.nt
+    if args.ic is not None:
+        from impliedqarma64 import ImpliedConstraints
+        params["implied_constraints"] = ImpliedConstraints.parse_names(args.ic)
+    if args.beam is not None:
+        params["beam_width"] = args.beam
+    if args.btl is not None:
+        params["beam_time_limit"] = args.btl
+    if args.be is not None:
+        params["backend"] = args.be
     return params
 
 def main():
@@ -197,28 +1112,101 @@ def main():
 
     parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
     parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
     parser.add_argument("-KR", default=14, type=int, help="Number of rounds for key recovery")
 
 
     parser.add_argument("-sl", default="ortools", type=str,
                         choices=['gecode', 'chuffed', 'coin-bc', 'gurobi', 'picat', 'scip', 'choco', 'ortools'],
                         help="choose a cp solver\n") 
-    parser.add_argument("-p", default=8, type=int, help="number of threads for solvers supporting multi-threading\n")    
+    parser.add_argument("-p", default=None, type=int,
+                        help="number of threads for solvers supporting multi-threading (default: 8, or the number of the tuned profile)\n")    
     parser.add_argument("-tl", default=4000, type=int, help="set a time limit for the solver in seconds\n")
     parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    parser.add_argument("-mem", default=None, type=int, help="memory limit for the MiniZinc/solver subprocesses in MB (requires psutil, not with -ps or -cmp)\n")
+    parser.add_argument("-pf", default=False, action="store_true", help="prefilter the output cells with the NumPy mask propagator before solving\n")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2],
+                        help="entry of tkp_sequence that initiates the second tweakey permutation\n"
+                             "0: max_ru_rl - 1, 1: min_ru_rl - 1, 2: ceil((KR - 2) / 2) - 1\n")
+    parser.add_argument("-enc", default="int", type=str, choices=["int", "bool"],
+                        help="encoding of the masks and classes: integers, or booleans (distinguisherqarma64bool.mzn)\n")
+    parser.add_argument("-mct", default=False, action="store_true",
+                        help="model mix_column as a table constraint over the precomputed relation (mixcolumnqarma64.dzn, integer encoding only)\n")
+    parser.add_argument("-cmp", default=False, action="store_true", help="solve all tweakey interpretations concurrently and compare them (ignores -tki)\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the results are appended\n")
+    parser.add_argument("-ld", default=None, type=int, help="draw the result with the given index of the archive (-ar) instead of solving\n")
+    parser.add_argument("-seed", default=None, type=int, help="random seed of the solver (first seed of the portfolio with -ps)\n")
+    parser.add_argument("-ps", default=1, type=int, help="number of solver copies with consecutive fixed seeds run in parallel\n")
+    parser.add_argument("-trace", default=None, type=str,
+                        help="record the objective-versus-time trace of the intermediate solutions and append the run to this JSON lines file\n"
+                             "(aggregated by anytimeqarma64.py)\n")
+    parser.add_argument("-chk", default=False, action="store_true",
+                        help="check the returned solution against the model with the independent checker (checkerqarma64.py)\n")
+    parser.add_argument("-pre", default=False, action="store_true",
+                        help="fix and restrict the variables forced by the round structure before flattening (presolveqarma64.py, integer encoding only)\n")
+    parser.add_argument("-lazy", default=False, action="store_true",
+                        help="fix contradict to 0 for the tweak cells that cannot be lazy (cached index of lazycellsqarma64.py)\n")
+    parser.add_argument("-ic", default=[], type=str, nargs="*", choices=["column_activity", "round_monotonicity", "count_bounds", "subtweakey_links", "all"],
+                        help="add implied constraints of impliedqarma64.py (integer encoding only)\n")
+    parser.add_argument("-beam", default=None, type=int,
+                        help="bound the objective from below with a beam search of this width before solving (beamqarma64.py)\n")
+    parser.add_argument("-btl", default=None, type=int, help="time limit of the beam search of -beam in seconds (default: 30)\n")
+    parser.add_argument("-be", default="minizinc", type=str, choices=["minizinc", "cpsat"],
+                        help="backend: the MiniZinc model, or the native OR-Tools CP-SAT model of cpsatqarma64.py (with -sl ortools;\n"
+                             "supports -pf, -lazy, -beam, -ps, -trace and -chk)\n")
+    parser.add_argument("-nt", default=False, action="store_true",
+                        help="ignore the tuned search profile of the solver (tunedqarma64.json, written by tunerqarma64.py)\n")
+    parser.add_argument("-co", default=False, action="store_true",
+                        help="compile only: flatten the grid given by -grid in a process pool and report the model sizes\n")
+    parser.add_argument("-grid", default=[], type=str, nargs="*",
+                        help="grid of the compile-only mode as key=value,value,... (keys: RU, RL, KR, NPT, sl, enc, tki, be)\n"
+                             "e.g. -grid RU=3,4,5 RL=4,5 sl=gecode,chuffed\n")
+    parser.add_argument("-w", default=None, type=int, help="number of worker processes of the compile-only mode (default: number of CPUs)\n")
+    parser.add_argument("-fzn", default=None, type=str, help="directory in which the compile-only mode keeps the FlatZinc files\n")
 
     # Parse command line arguments and construct parameter list
     args = parser.parse_args()
+    if args.ld is not None and args.ar is None:
+        parser.error("-ld requires the archive to read from (-ar)")
+    if args.cmp and args.mem is not None:
+        parser.error("-cmp solves the interpretations concurrently and does not support -mem")
     params = loadparameters(args)
+    if args.co:
+        param_sets = parse_grid(args.grid, params)
+        print("Flattening {} instances with {} worker processes".format(len(param_sets), args.w if args.w is not None else os.cpu_count()))
+        print(print_compile_records(compile_grid(param_sets, max_workers=args.w, time_limit=params["time_limit"], fzn_directory=args.fzn)))
+        return
     integral__distinguisher = IntegralDistinguisher(params)    
+    if params["load_index"] is not None:
+        integral__distinguisher.load_result(params["archive_file_name"], params["load_index"])
+        integral__distinguisher.report()
+        return
     print(line_separator)
     print("Searching for an integral distinguisher for Qarma-v2-64 with the following parameters")
     print("RU:              {}".format(params["RU"]))
     print("RL:              {}".format(params["RL"]))    
     print("CP solver:       {}".format(params["cp_solver_name"]))
-    print("No. of threads:  {}".format(params["num_of_threads"]))
+    print("Backend:         {}".format(params["backend"]))
+    print("No. of threads:  {}".format(integral__distinguisher.num_of_threads))
     print("Time limit:      {}".format(params["time_limit"]))
+    print("Memory limit:    {}".format(params["memory_limit"]))
+    print("Prefilter:       {}".format(params["prefilter"]))
+    print("Encoding:        {}".format(params["encoding"]))
+    print("MixColumn table: {}".format(params["mix_column_table"]))
+    print("Tweakey interp.: {}".format("all" if params["compare_tk_interpretations"] else tk_interpretations[params["tk_interpretation"]]))
+    print("Random seed:     {}".format(params["random_seed"]))
+    print("Portfolio size:  {}".format(params["portfolio_size"]))
+    print("Check result:    {}".format(params["check_certificate"]))
+    print("Presolve:        {}".format(params["presolve"]))
+    print("Lazy cell index: {}".format(params["lazy_index"]))
+    print("Implied constr.: {}".format(", ".join(params["implied_constraints"]) or None))
+    print("Beam width:      {}".format(params["beam_width"]))
+    print("Beam time limit: {}".format(params["beam_time_limit"]))
+    print("Search profile:  {}".format("default" if integral__distinguisher.search_profile is None else integral__distinguisher.search_profile["name"]))
     print(line_separator)
+    if params["compare_tk_interpretations"]:
+        print(print_tk_interpretations(compare_tk_interpretations(params)))
+        return
     integral__distinguisher.search()
     
 #############################################################################################################################################
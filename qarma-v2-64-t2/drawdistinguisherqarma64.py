@@ -70,16 +70,33 @@ class Draw():
         self.lazy_tweak_cells_numeric_zero = integral_object.lazy_tweak_cells_numeric_zero
         self.lazy_tweak_cells_numeric_one = integral_object.lazy_tweak_cells_numeric_one
 
+    def pack(self, state, permutation=None):
+        """
+        Pack the fill codes of a state into one digit per cell (see \PackedFill in qarmavtwo64.sty);
+        cell i of the state is drawn at cell permutation[i]
+        """
+
+        packed = ["0"]*16
+        for i in range(16):
+            packed[i if permutation is None else permutation[i]] = str(state[i])
+        return "".join(packed)
+
+    def pack_frames(self, round_number):
+        """
+        Pack the cells of the subtweakey of a round into which a lazy tweak cell is added
+        """
+
+        tk_permutation_per_round = self.result["tk_permutation_per_round"][round_number]
+        lazy_tweak_cells = self.lazy_tweak_cells_numeric_zero if round_number%2 == 0 else self.lazy_tweak_cells_numeric_one
+        return "".join("1" if tk_permutation_per_round[j] in lazy_tweak_cells else "0" for j in range(16))
+
     def gen_round_tweakey_labels(self, round_number):
         """
         Generate the round tweakey labels
         """
         
         round_tweakey_state = self.result["tk_permutation_per_round"][round_number]          
-        text = ""
-        for i in range(16):
-            text += "\Cell{{s{0}}}{{\\texttt{{{1}}}}}".format(i, hex(round_tweakey_state[i])[2:])
-        return text
+        return "\\PackedLabels{{{0}}}".format(",".join(hex(round_tweakey_state[i])[2:] for i in range(16)))
     
     def draw_eu(self, r):
         """
@@ -87,28 +104,12 @@ class Draw():
         """
         
         output = dict()
-        output["before_sb"] = ""              
-        output["after_sb"] = ""
-        output["after_addtk"] = ""
-        output["after_pr"] = ""
-        output["subtweakey"] = ""
-        output["after_mix_columns"] = ""
-        tk_permutation_per_round = self.result["tk_permutation_per_round"][r]              
-        for i in range(16):
-            output["before_sb"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][r][i]], i)
-            output["after_sb"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i]], i)
-            output["after_addtk"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i]], i)                
-            output["after_pr"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i]], self.inv_permutation[i])
-            output["after_mix_columns"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][r + 1][i]], i)               
-        for i in range(16):                        
-            output["subtweakey"] += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_sbx"][r][i]], i)
-        for j in range(16):
-            if r%2 == 0:
-                if tk_permutation_per_round[j] in self.lazy_tweak_cells_numeric_zero:
-                    output["subtweakey"] += "\FrameCell[filter]{{s{0}}}".format(j)
-            else:
-                if tk_permutation_per_round[j] in self.lazy_tweak_cells_numeric_one:
-                    output["subtweakey"] += "\FrameCell[filter]{{s{0}}}".format(j)
+        output["before_sb"] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][r]))
+        output["after_sb"] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_sbx"][r]))
+        output["after_addtk"] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_sbx"][r]))
+        output["after_pr"] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_sbx"][r], self.inv_permutation))
+        output["after_mix_columns"] = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][r + 1]))
+        output["subtweakey"] = "\\PackedFill{{{0}}}\\PackedFrame{{{1}}}".format(self.pack(self.result["forward_mask_sbx"][r]), self.pack_frames(r))
         return output
 
     def draw_el(self, r):
@@ -117,35 +118,15 @@ class Draw():
         """
         
         output = dict()
-        output["before_sinv"] = ""
-        output["after_sinv"] = ""              
-        output["after_minv"] = ""
-        output["after_prinv"] = ""
-        output["subtweakey"] = ""
-        tk_permutation_per_round = self.result["tk_permutation_per_round"][self.RU + r]
-        for i in range(16):            
-            output["after_minv"] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][0][i]], self.inv_permutation[i]) 
-            output["after_prinv"] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][0][i]], i)
-            output["before_sinv"] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][0][i]], i)
-            output["after_sinv"] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL - r - 1][0][i]], i)               
-        for i in range(16):
-            output["subtweakey"] += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][0][i]], i)
-
-        for i in range(16):            
-            output["after_minv"] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][1][i]], self.inv_permutation[i]) 
-            output["after_prinv"] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][1][i]], i)
-            output["before_sinv"] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][1][i]], i)
-            output["after_sinv"] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL - r - 1][1][i]], i)               
-        for i in range(16):
-            output["subtweakey"] += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_sbx"][self.RL - r - 1][1][i]], i)
-           
-        for j in range(16):
-            if (self.RU + r)%2 == 0:
-                if tk_permutation_per_round[j] in self.lazy_tweak_cells_numeric_zero:
-                    output["subtweakey"] += "\FrameCell[filter]{{s{0}}}".format(j)
-            else:
-                if tk_permutation_per_round[j] in self.lazy_tweak_cells_numeric_one:
-                    output["subtweakey"] += "\FrameCell[filter]{{s{0}}}".format(j)
+        backward_mask_sbx = self.result["backward_mask_sbx"][self.RL - r - 1]
+        backward_mask_x = self.result["backward_mask_x"][self.RL - r - 1]
+        output["after_minv"] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_sbx[0], self.inv_permutation),
+                                                                              self.pack(backward_mask_sbx[1], self.inv_permutation))
+        output["after_prinv"] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_sbx[0]), self.pack(backward_mask_sbx[1]))
+        output["before_sinv"] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_sbx[0]), self.pack(backward_mask_sbx[1]))
+        output["after_sinv"] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}".format(self.pack(backward_mask_x[0]), self.pack(backward_mask_x[1]))
+        output["subtweakey"] = "\\PackedTFill{{{0}}}\\PackedBFill{{{1}}}\\PackedFrame{{{2}}}".format(self.pack(backward_mask_sbx[0]), self.pack(backward_mask_sbx[1]),
+                                                                                                 self.pack_frames(self.RU + r))
         return output
     
     def generate_attack_shape(self):
@@ -153,12 +134,10 @@ class Draw():
         Draw the figure of the Rectangle distinguisher
         """
 
-        contents = ""
-        initial_state = ""
-        for i in range(16):
-            initial_state += "\Fill[{0}]{{s{1}}}".format(self.fillcolor[self.result["forward_mask_x"][0][i]], i)
+        contents = []
+        initial_state = "\\PackedFill{{{0}}}".format(self.pack(self.result["forward_mask_x"][0]))
         # head lines
-        contents += trim(r"""
+        contents.append(trim(r"""
                     \documentclass[varwidth=50cm]{standalone}
                     \usepackage{qarmavtwo64}
                     \usepackage{comment}
@@ -166,13 +145,13 @@ class Draw():
                     %\begin{figure}
                     %\centering
                     \begin{tikzpicture}
-                    \QarmaInit{""" + initial_state + r"""} % init coordinates, print labels""") + "\n\n"
+                    \QarmaInit{""" + initial_state + r"""} % init coordinates, print labels""") + "\n\n")
         # draw EU
         for r in range(0, self.RU):
             state = self.draw_eu(r)
             state["subtweakey"] += self.gen_round_tweakey_labels(r)
             if r < self.RU - 1:
-                contents += trim(r"""
+                contents.append(trim(r"""
                 \QarmaForwardNewLine
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"] + r"""} % state after first operation (S)
@@ -181,14 +160,10 @@ class Draw():
                     {$\tau$} % second operation name (\tau or S')
                     {""" + state["after_pr"] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
-                    {""" + state["after_mix_columns"] + r"""} % state after third operation (M)""") + "\n\n"
+                    {""" + state["after_mix_columns"] + r"""} % state after third operation (M)""") + "\n\n")
 
             elif r == (self.RU - 1):
-                output_state = ""
-                for i in range(16):
-                    output_state += "\TFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL][0][i]], i)        
-                    output_state += "\BFill[{0}]{{s{1}}}".format(self.fillcolor[self.result["backward_mask_x"][self.RL][1][i]], i)
-                contents += trim(r"""
+                contents.append(trim(r"""
                 \QarmaForwardFinal               
                     {$S$} % first operation name (S or \tau')
                     {""" + state["after_sb"] + r"""} % state after first operation (S)
@@ -197,13 +172,13 @@ class Draw():
                     {$\tau$} % second operation name (\tau or S')
                     {""" + state["after_pr"] + r"""} % state after second operation (\tau)
                     {$M$} % third operation name (M or M')
-                    {""" + state["after_mix_columns"] + r"""} % state after third operation (M)""") + "\n\n"
+                    {""" + state["after_mix_columns"] + r"""} % state after third operation (M)""") + "\n\n")
                             
         # draw EL
         for r in range(0, self.RL):
             state = self.draw_el(r)
             state["subtweakey"] += self.gen_round_tweakey_labels(self.RU + r)            
-            contents += trim(r"""
+            contents.append(trim(r"""
                         \QarmaBackwardNewLine              
                             {$\bar{M}$} % M^-1
                             {""" + state["after_minv"] + r"""} % state after M^-1
@@ -212,17 +187,17 @@ class Draw():
                             {""" + state["subtweakey"] + r"""} % tweakey state
                             {""" + state["before_sinv"] + r"""} % state before sinverse
                             {$\bar{S}$} % S^-1
-                            {""" + state["after_sinv"] + r"""} % state after S^-1""") + "\n\n"
+                            {""" + state["after_sinv"] + r"""} % state after S^-1""") + "\n\n")
 
             
-        contents += r"""%\IntegralDistinguisherLegend""" + "\n"
-        contents += r"""\end{tikzpicture}""" + "\n"
-        contents += r"""%\caption{Integral distinguisher for """ +  str(self.RD + 2) +\
-                    r""" rounds of QARMA-v2-64""" + "}\n"
-        contents += trim(r"""%\end{figure}""") + "\n"
-        contents += trim(r"""\begin{comment}""") + "\n"
-        contents += self.attack_summary
-        contents += trim(r"""\end{comment}""") + "\n"
-        contents += trim(r"""\end{document}""")
-        with open(self.output_file_name, "w") as output_file:
-            output_file.write(contents)
+        contents.append(r"""%\IntegralDistinguisherLegend""" + "\n")
+        contents.append(r"""\end{tikzpicture}""" + "\n")
+        contents.append(r"""%\caption{Integral distinguisher for """ +  str(self.RD + 2) +\
+                    r""" rounds of QARMA-v2-64""" + "}\n")
+        contents.append(trim(r"""%\end{figure}""") + "\n")
+        contents.append(trim(r"""\begin{comment}""") + "\n")
+        contents.append(self.attack_summary)
+        contents.append(trim(r"""\end{comment}""") + "\n")
+        contents.append(trim(r"""\end{document}"""))
+        with open(self.output_file_name, "w", buffering=2**16) as output_file:
+            output_file.writelines(contents)
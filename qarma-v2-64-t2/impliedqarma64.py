@@ -0,0 +1,361 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from propagatorqarma64 import MaskPropagator
+line_separator = "#"*55
+
+class ImpliedConstraints:
+    """
+    Library of implied (redundant) constraints of distinguisherqarma64.mzn, switchable by name
+
+    column_activity:    per MixColumn column, the number of active (nonzero or unknown) and unknown output
+                        cells is bounded by the number of active and unknown input cells (the inputs leave
+                        sb_operation, so they never have mask 1 and nothing cancels)
+    round_monotonicity: the number of active and of unknown cells of the state does not decrease over the
+                        rounds of EU and of every branch of EL
+    count_bounds:       per tweak cell, no_of_only_nonzero <= no_of_any_or_nonzero <= number of rounds of the
+                        parity, the two branches differ by at most the number of EL rounds of the parity,
+                        and contradict implies no_of_any_or_nonzero <= NPT
+    subtweakey_links:   only_nonzero_subtweakeys <= any_or_nonzero_subtweakey, and both are equal in the two
+                        branches in the rounds of EU
+
+    check_soundness verifies every constraint on assignments generated with MaskPropagator and verifies
+    column_activity exhaustively on the MixColumn relation.
+    """
+
+    names = ["column_activity", "round_monotonicity", "count_bounds", "subtweakey_links"]
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        # columns[j, k] is the input cell in row k of column j, whose output cell is output_columns[j, k] = 4*k + j
+        self.columns = np.array([[self.propagator.state_permutation[4*k + j] for k in range(4)] for j in range(4)])
+        self.output_columns = np.array([[4*k + j for k in range(4)] for j in range(4)])
+
+    @classmethod
+    def parse_names(cls, names):
+        """
+        Expand "all" and check the names
+        """
+
+        if "all" in names:
+            return list(cls.names)
+        for name in names:
+            assert(name in cls.names), "Unknown implied constraint: {}".format(name)
+        return [name for name in cls.names if name in names]
+
+    #############################################################################################################################################
+    # MiniZinc code
+
+    @staticmethod
+    def column_activity():
+        return """% Implied: activity of the MixColumn columns
+predicate implied_column_activity(array[0..3] of var 0..3: mask_in, array[0..3] of var 0..3: mask_out) =
+    let {
+        var 0..4: active_in = sum(k in 0..3)(bool2int(mask_in[k] >= 1)),
+        var 0..4: unknown_in = sum(k in 0..3)(bool2int(mask_in[k] = 3)),
+        var 0..4: active_out = sum(k in 0..3)(bool2int(mask_out[k] >= 1))
+    } in
+    active_out >= min(4, 3*active_in) /\\ active_out <= 4*bool2int(active_in >= 1) /\\
+    sum(k in 0..3)(bool2int(mask_out[k] = 3)) >= min(4, 3*unknown_in)
+;
+constraint forall(r in 0..(RU - 1), j in 0..3)
+(
+    implied_column_activity(array1d(0..3, [forward_mask_sbx[r, state_permutation[4*k + j]] | k in 0..3]),
+                            array1d(0..3, [forward_mask_x[r + 1, 4*k + j] | k in 0..3]))
+);
+constraint forall(r in 0..(RL - 1), t in 0..1, j in 0..3)
+(
+    implied_column_activity(array1d(0..3, [backward_mask_sbx[r, t, state_permutation[4*k + j]] | k in 0..3]),
+                            array1d(0..3, [backward_mask_x[r + 1, t, 4*k + j] | k in 0..3]))
+);
+"""
+
+    @staticmethod
+    def round_monotonicity():
+        return """% Implied: the numbers of active and unknown cells do not decrease in EU and EL
+constraint forall(r in 0..(RU - 1))
+(
+    sum(i in 0..15)(bool2int(forward_mask_x[r + 1, i] >= 1)) >= sum(i in 0..15)(bool2int(forward_mask_x[r, i] >= 1)) /\\
+    sum(i in 0..15)(bool2int(forward_mask_x[r + 1, i] = 3)) >= sum(i in 0..15)(bool2int(forward_mask_x[r, i] = 3))
+);
+constraint forall(r in 0..(RL - 1), t in 0..1)
+(
+    sum(i in 0..15)(bool2int(backward_mask_x[r + 1, t, i] >= 1)) >= sum(i in 0..15)(bool2int(backward_mask_x[r, t, i] >= 1)) /\\
+    sum(i in 0..15)(bool2int(backward_mask_x[r + 1, t, i] = 3)) >= sum(i in 0..15)(bool2int(backward_mask_x[r, t, i] = 3))
+);
+"""
+
+    @staticmethod
+    def count_bounds():
+        return """% Implied: bounds of the activity counts of every tweak cell and round parity
+constraint forall(k in 0..1, i in 0..1, j in 0..15)
+(
+    no_of_only_nonzero[k, i, j] <= no_of_any_or_nonzero[k, i, j] /\\
+    no_of_any_or_nonzero[k, i, j] <= (RD + 1 - i) div 2 /\\
+    (contradict[k, i, j] = 1 -> no_of_any_or_nonzero[k, i, j] <= NPT)
+);
+constraint forall(i in 0..1, j in 0..15)
+(
+    abs(no_of_any_or_nonzero[0, i, j] - no_of_any_or_nonzero[1, i, j]) <= sum(r in RU..(RD - 1) where r mod 2 == i)(1) /\\
+    abs(no_of_only_nonzero[0, i, j] - no_of_only_nonzero[1, i, j]) <= sum(r in RU..(RD - 1) where r mod 2 == i)(1)
+);
+"""
+
+    @staticmethod
+    def subtweakey_links():
+        return """% Implied: links between the subtweakey activities
+constraint forall(r in 0..(RD - 1), k in 0..1, j in 0..15)
+(
+    only_nonzero_subtweakeys[r, k, j] <= any_or_nonzero_subtweakey[r, k, j]
+);
+constraint forall(r in 0..(RU - 1), j in 0..15)
+(
+    any_or_nonzero_subtweakey[r, 0, j] = any_or_nonzero_subtweakey[r, 1, j] /\\
+    only_nonzero_subtweakeys[r, 0, j] = only_nonzero_subtweakeys[r, 1, j]
+);
+"""
+
+    def constraints(self, names):
+        """
+        Return the MiniZinc code of the selected implied constraints
+        """
+
+        return "".join(getattr(self, name)() for name in self.parse_names(names))
+
+    #############################################################################################################################################
+    # Soundness
+
+    def sample_fields(self, num_of_samples=2000, seed=0):
+        """
+        Generate assignments of the model with MaskPropagator: random input masks and random pairs of output cells
+        """
+
+        rng = np.random.default_rng(seed)
+        propagator = self.propagator
+        input_mask = 3*(rng.random((num_of_samples, 16)) < rng.random((num_of_samples, 1))).astype(np.int8)
+        output_cell_pairs = propagator.output_cell_pairs()
+        output_mask = output_cell_pairs[rng.integers(len(output_cell_pairs), size=num_of_samples)]
+        fields = dict(propagator.forward(input_mask))
+        fields.update(propagator.backward(output_mask))
+        any_subtweakey = np.zeros((num_of_samples, self.RD, 2, 16), dtype=bool)
+        only_subtweakey = np.zeros((num_of_samples, self.RD, 2, 16), dtype=bool)
+        for r in range(self.RU):
+            mask = fields["forward_mask_sbx"][:, r, propagator.inv_tk_permutation_per_round[r]]
+            any_subtweakey[:, r] = (mask != 0)[:, None]
+            only_subtweakey[:, r] = ((mask == 1) | (mask == 2))[:, None]
+        for r in range(self.RL):
+            q = self.RD - r - 1
+            mask = fields["backward_mask_sbx"][:, r][..., propagator.inv_tk_permutation_per_round[q]]
+            any_subtweakey[:, q] = mask != 0
+            only_subtweakey[:, q] = (mask == 1) | (mask == 2)
+        fields["any_or_nonzero_subtweakey"] = any_subtweakey
+        fields["only_nonzero_subtweakeys"] = only_subtweakey
+        # [branch, parity, cell] as in the model
+        fields["no_of_any_or_nonzero"] = np.stack([any_subtweakey[:, parity::2].sum(axis=1) for parity in range(2)], axis=2)
+        fields["no_of_only_nonzero"] = np.stack([only_subtweakey[:, parity::2].sum(axis=1) for parity in range(2)], axis=2)
+        fields["contradict"] = (((fields["no_of_any_or_nonzero"] <= self.NPT) & (fields["no_of_only_nonzero"] >= 1))
+                                | (fields["no_of_any_or_nonzero"] == 0))
+        return fields
+
+    @staticmethod
+    def column_bounds_hold(mask_in, mask_out):
+        """
+        Evaluate implied_column_activity on columns (the last axis holds the four cells)
+        """
+
+        active_in = (mask_in >= 1).sum(axis=-1)
+        active_out = (mask_out >= 1).sum(axis=-1)
+        unknown_in = (mask_in == 3).sum(axis=-1)
+        return ((active_out >= np.minimum(4, 3*active_in)) & (active_out <= 4*(active_in >= 1))
+                & ((mask_out == 3).sum(axis=-1) >= np.minimum(4, 3*unknown_in)))
+
+    def holds(self, name, fields):
+        """
+        Evaluate an implied constraint on a batch of assignments and return one boolean per assignment
+        """
+
+        if name == "column_activity":
+            forward = self.column_bounds_hold(fields["forward_mask_sbx"][..., self.columns], fields["forward_mask_x"][:, 1:, self.output_columns])
+            backward = self.column_bounds_hold(fields["backward_mask_sbx"][:, :self.RL][..., self.columns],
+                                               fields["backward_mask_x"][:, 1:][..., self.output_columns])
+            return forward.all(axis=(1, 2)) & backward.all(axis=(1, 2, 3))
+        if name == "round_monotonicity":
+            valid = np.ones(len(fields["forward_mask_x"]), dtype=bool)
+            for mask in [fields["forward_mask_x"], fields["backward_mask_x"]]:
+                for count in [(mask >= 1).sum(axis=-1), (mask == 3).sum(axis=-1)]:
+                    valid &= (np.diff(count, axis=1) >= 0).reshape(len(count), -1).all(axis=1)
+            return valid
+        if name == "count_bounds":
+            no_of_any, no_of_only = fields["no_of_any_or_nonzero"], fields["no_of_only_nonzero"]
+            rounds = np.array([(self.RD + 1 - parity) // 2 for parity in range(2)])[:, None]
+            el_rounds = np.array([sum(1 for r in range(self.RU, self.RD) if r % 2 == parity) for parity in range(2)])[:, None]
+            valid = ((no_of_only <= no_of_any) & (no_of_any <= rounds) & (~fields["contradict"] | (no_of_any <= self.NPT))).all(axis=(1, 2, 3))
+            for count in [no_of_any, no_of_only]:
+                valid &= (np.abs(count[:, 0].astype(np.int64) - count[:, 1]) <= el_rounds).all(axis=(1, 2))
+            return valid
+        if name == "subtweakey_links":
+            any_subtweakey, only_subtweakey = fields["any_or_nonzero_subtweakey"], fields["only_nonzero_subtweakeys"]
+            valid = (only_subtweakey <= any_subtweakey).all(axis=(1, 2, 3))
+            for subtweakey in [any_subtweakey, only_subtweakey]:
+                valid &= (subtweakey[:, :self.RU, 0] == subtweakey[:, :self.RU, 1]).all(axis=(1, 2))
+            return valid
+        raise ValueError("Unknown implied constraint: {}".format(name))
+
+    def check_column_table(self):
+        """
+        Count the columns of the MixColumn relation (with inputs produced by sb_operation) that violate implied_column_activity
+        """
+
+        sb_masks = np.unique(self.propagator.sb_table)
+        mask_in = np.array(np.meshgrid(*[sb_masks]*4, indexing="ij")).reshape(4, -1).T
+        mask_out, _ = self.propagator.mix_column_table.lookup(mask_in, self.propagator.mask_to_class[mask_in])
+        return int((~self.column_bounds_hold(mask_in, mask_out[:, :4])).sum())
+
+    def check_soundness(self, num_of_samples=2000, seed=0):
+        """
+        Return the number of violating assignments of every implied constraint
+        """
+
+        fields = self.sample_fields(num_of_samples, seed)
+        violations = {name: int((~self.holds(name, fields)).sum()) for name in self.names}
+        violations["column_activity"] += self.check_column_table()
+        return violations
+
+    def print_soundness(self, violations, num_of_samples):
+        str_output = line_separator + "\n"
+        str_output += "Soundness of the implied constraints ({} sampled assignments, exhaustive MixColumn relation):\n".format(num_of_samples)
+        for name, count in violations.items():
+            str_output += "{:<22}{}\n".format(name, "sound" if count == 0 else "VIOLATED ({})".format(count))
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def measure(params, names, instances, max_workers=None, max_concurrent=None):
+    '''
+    Flatten and solve every instance without implied constraints, with each of them alone and with all
+    of them, and return one row per (instance, configuration)
+    '''
+
+    from distinguisherqarma64 import compile_grid, search_many
+    configurations = [[]] + [[name] for name in names] + ([list(names)] if len(names) > 1 else [])
+    param_sets = []
+    for (RU, RL), implied_constraints in ((instance, configuration) for instance in instances for configuration in configurations):
+        param_set = dict(params)
+        param_set.update(RU=RU, RL=RL, implied_constraints=implied_constraints)
+        param_sets.append(param_set)
+    compile_records = compile_grid(param_sets, max_workers=max_workers, time_limit=params["time_limit"])
+    search_results = search_many(param_sets, max_concurrent=max_concurrent)
+    rows = []
+    for param_set, compile_record, search_result in zip(param_sets, compile_records, search_results):
+        rows.append({"RU": param_set["RU"], "RL": param_set["RL"],
+                     "configuration": "+".join(param_set["implied_constraints"]) or "none",
+                     "num_of_variables": compile_record.get("num_of_variables"),
+                     "num_of_constraints": compile_record.get("num_of_constraints"),
+                     "flatten_time": compile_record["flatten_time"],
+                     "error": compile_record["error"],
+                     "status": search_result.status,
+                     "objective": search_result.objective,
+                     "elapsed_time": search_result.record["elapsed_time"]})
+    return rows
+
+def print_measurements(rows):
+    '''
+    Print the flatten size and the solve time of every configuration relative to the run without implied constraints
+    '''
+
+    str_output = line_separator + "\n"
+    str_output += "Effect of the implied constraints:\n"
+    str_output += "{:>4}{:>4}  {:<72}{:>10}{:>12}{:>10}{:>12}{:>10}  {:<20}{:>10}\n".format("RU", "RL", "Implied constraints", "Variables", "Constraints",
+                                                                                        "Flatten", "Solve (s)", "Speedup", "Status", "Objective")
+    baseline = dict()
+    for row in rows:
+        if row["configuration"] == "none":
+            baseline[(row["RU"], row["RL"])] = row
+    for row in rows:
+        base = baseline[(row["RU"], row["RL"])]
+        if row["error"] is not None:
+            str_output += "{:>4}{:>4}  {:<72}{}\n".format(row["RU"], row["RL"], row["configuration"], row["error"])
+            continue
+        speedup = "-" if row["elapsed_time"] <= 0 else "{:0.02f}x".format(base["elapsed_time"] / row["elapsed_time"])
+        str_output += "{:>4}{:>4}  {:<72}{:>10}{:>12}{:>9.02f}s{:>12.02f}{:>10}  {:<20}{:>10}\n".format(row["RU"], row["RL"], row["configuration"],
+            row["num_of_variables"], row["num_of_constraints"], row["flatten_time"], row["elapsed_time"], speedup,
+            row["status"], "-" if row["objective"] is None else row["objective"])
+    str_output += line_separator
+    return str_output
+
+def main():
+    '''
+    Parse the arguments, check the soundness of the implied constraints and measure their effect
+    '''
+
+    parser = ArgumentParser(description="This tool checks the implied constraints of the model for Qarma-v2-64 and measures their effect\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=14, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-n", default=2000, type=int, help="number of sampled assignments of the soundness check\n")
+    parser.add_argument("-ic", default=["all"], type=str, nargs="*", choices=ImpliedConstraints.names + ["all"],
+                        help="implied constraints to measure\n")
+    parser.add_argument("-report", default=None, type=str, nargs="*",
+                        help="flatten and solve these instances (RU,RL) with and without the implied constraints\n")
+    parser.add_argument("-sl", default="ortools", type=str,
+                        choices=['gecode', 'chuffed', 'cbc', 'gurobi', 'picat', 'scip', 'choco', 'ortools'],
+                        help="choose a cp solver\n")
+    parser.add_argument("-p", default=2, type=int, help="number of threads of every solve\n")
+    parser.add_argument("-tl", default=600, type=int, help="time limit of every solve in seconds\n")
+    parser.add_argument("-j", default=None, type=int, help="number of solves run in parallel (default: number of CPUs / threads)\n")
+    args = parser.parse_args()
+    implied = ImpliedConstraints(args.RU - 1, args.RL - 1, args.KR, args.NPT, args.tki)
+    print(implied.print_soundness(implied.check_soundness(args.n), args.n))
+    if args.report is not None:
+        from distinguisherqarma64 import default_parameters
+        params = default_parameters()
+        params.update(KR=args.KR, NPT=args.NPT, tk_interpretation=args.tki, cp_solver_name=args.sl,
+                      num_of_threads=args.p, time_limit=args.tl)
+        instances = [tuple(map(int, instance.split(","))) for instance in args.report]
+        print(print_measurements(measure(params, ImpliedConstraints.parse_names(args.ic), instances, max_concurrent=args.j)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Email: hsn.hadipour@gmail.com
+"""
+
+import numpy as np
+
+line_separator = "#"*55
+
+import numpy as np
+
+line_separator = "#"*55
+
+class KeyRecoveryEstimator():
+    """
+    Estimate the complexity of the key recovery attack built on top of integral distinguishers
+
+    The distinguisher covers the RU + RL + 2 rounds around the reflector, and the remaining
+    KR - (RU + RL + 2) rounds are split between the plaintext side (prepended to EU) and the
+    ciphertext side (appended to EL). Every split is evaluated and the cheapest one is kept.
+    On the plaintext side, every column of MixColumns that reaches a cell taking all values is
+    made to take all values as well, so that the plaintexts form a union of structures and no
+    key cell is guessed. On the ciphertext side, the balanced cells (the active cells of
+    backward_mask_x[0]) are traced back through the inverse MixColumns and ShuffleCells, and the
+    sum over each structure is computed with the partial-sum technique, processing one column of
+    MixColumns at a time.
+    A lazy tweak cell (contradict = 1 in both branches) takes all values in every structure: on the
+    plaintext side the column it is added to takes all values, and on the ciphertext side the
+    counters are indexed by it until its last use. The cheapest lazy tweak cell is kept.
+    Structures with distinct values of the other tweak cells use distinct codebooks, hence the
+    data complexity may exceed the block size. The time complexity is capped at exhaustive key search.
+    Round keys alternate between K0 and K1, hence a key cell is identified by (round parity, cell).
+    """
+
+    def __init__(self, RU, RL, KR, NPT=1):
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.key_recovery_rounds = max(0, self.KR - (self.RD + 2))
+        self.cell_size = 4
+        self.num_of_cells = 16
+        self.block_size = 64
+        self.tweak_size = 128
+        self.key_size = 128
+        self.state_permutation = [0, 11, 6, 13, 10, 1, 12, 7, 5, 14, 3, 8, 15, 4, 9, 2]
+        self.inv_state_permutation = [0, 5, 15, 10, 13, 8, 2, 7, 11, 14, 4, 1, 6, 3, 9, 12]
+        self.tweakey_permutation = [1, 10, 14, 6, 2, 9, 13, 5, 0, 8, 12, 4, 3, 11, 15, 7]
+        self.inv_tweakey_permutation = [8, 0, 4, 12, 11, 7, 3, 15, 9, 5, 1, 13, 10, 6, 2, 14]
+        self.partial_sum_cache = dict()
+
+    def mix_column_outputs(self, cell):
+        """
+        Return the cells of the state after MixColumns (one round closer to the ciphertext) that
+        the given cell before the permutation depends on through the inverse MixColumns and ShuffleCells
+
+        MixColumns is involutory with a zero diagonal, hence a cell depends on the three other cells
+        of the column into which the permutation moves it.
+        """
+
+        row, column = divmod(self.inv_state_permutation[cell], 4)
+        return [4*k + column for k in range(4) if k != row]
+
+    def mix_column_index(self, cell):
+        """
+        Return the column of MixColumns into which the permutation moves the given cell
+        """
+
+        return self.inv_state_permutation[cell] % 4
+
+    def prepend_round(self, varying_cells, tweak_cells):
+        """
+        Trace the cells that take all values in a batch of structures one round towards the plaintext
+
+        varying_cells is a boolean array (batch, cell) at the output of the round, and tweak_cells
+        the cell to which the lazy tweak cell is added in the round (-1 if it is not added).
+        """
+
+        columns = varying_cells.reshape(-1, 4, 4).any(axis=1)
+        tweaked = np.flatnonzero(tweak_cells >= 0)
+        columns[tweaked, np.array(self.inv_state_permutation)[tweak_cells[tweaked]] % 4] = True
+        output = np.zeros_like(varying_cells)
+        output[:, self.state_permutation] = columns[:, np.arange(self.num_of_cells) % 4]
+        return output
+
+    def partial_sum_steps(self, balanced_cells, rounds):
+        """
+        Generate the partial-sum steps needed to compute the balanced cells from the ciphertext
+        over the given number of appended rounds
+
+        Returns the list of guessed key cells and a list of (number of guessed key cells,
+        number of cells stored in the counters, appended round, cells the round key is added to)
+        for every step
+        """
+
+        balanced_cells = tuple(sorted(balanced_cells))
+        if (balanced_cells, rounds) in self.partial_sum_cache:
+            return self.partial_sum_cache[(balanced_cells, rounds)]
+        # Trace the dependency of the balanced cells from the distinguisher towards the ciphertext
+        dependency = [set(balanced_cells)]
+        for a in range(rounds):
+            outer_cells = set()
+            for cell in dependency[-1]:
+                outer_cells.update(self.mix_column_outputs(cell))
+            dependency.append(outer_cells)
+        # Peel off the appended rounds from the ciphertext side, one column at a time
+        guessed_key_cells = set()
+        steps = []
+        for a in reversed(range(rounds)):
+            inner_cells = dependency[a]
+            stored_cells = set(dependency[a + 1])
+            key_parity = (self.RD + a) % 2
+            for column in range(4):
+                column_cells = [cell for cell in inner_cells if self.mix_column_index(cell) == column]
+                if column_cells == []:
+                    continue
+                # The round key is added to the cells of the column before they are inverted
+                needed_cells = set()
+                for cell in column_cells:
+                    needed_cells.update(self.mix_column_outputs(cell))
+                guessed_key_cells.update((key_parity, cell) for cell in needed_cells)
+                steps.append((len(guessed_key_cells), len(stored_cells), a, sorted(needed_cells)))
+                stored_cells = (stored_cells - needed_cells) | set(column_cells)
+        output = (sorted(guessed_key_cells), steps)
+        self.partial_sum_cache[(balanced_cells, rounds)] = output
+        return output
+
+    def tabulate_partial_sums(self, unique_codes, rounds):
+        """
+        Tabulate the partial-sum steps of every distinct set of balanced cells
+
+        Returns the number of guessed key cells per set and, per set and step, the guessed key
+        and counter sizes in log2, the appended round and the cells the round key is added to
+        """
+
+        num_of_steps = max(1, 4*rounds)
+        key_cells = np.zeros(len(unique_codes), dtype=np.int64)
+        step_keys = np.full((len(unique_codes), num_of_steps), -np.inf)
+        step_cells = np.full((len(unique_codes), num_of_steps), -np.inf)
+        step_round = np.full((len(unique_codes), num_of_steps), -1, dtype=np.int64)
+        step_needed = np.zeros((len(unique_codes), num_of_steps, self.num_of_cells), dtype=np.bool_)
+        for u, code in enumerate(unique_codes):
+            balanced_cells = [j for j in range(self.num_of_cells) if (int(code) >> j) & 1]
+            guessed_key_cells, steps = self.partial_sum_steps(balanced_cells, rounds)
+            key_cells[u] = len(guessed_key_cells)
+            for s, (num_of_keys, num_of_stored_cells, a, needed_cells) in enumerate(steps):
+                step_keys[u, s] = self.cell_size*num_of_keys
+                step_cells[u, s] = self.cell_size*num_of_stored_cells
+                step_round[u, s] = a
+                step_needed[u, s, needed_cells] = True
+        return key_cells, step_keys, step_cells, step_round, step_needed
+
+    def lazy_tweak_cells(self, contradict):
+        """
+        Return a boolean array (batch, candidate) of the lazy tweak cells of a batch
+        """
+
+        return (contradict == 1).all(axis=1).reshape(-1, 32)
+
+    def tweak_rounds(self, candidate):
+        """
+        Return the tweak cell of a lazy tweak cell candidate and the parity of the rounds in which
+        it is added (None if it is added in every round)
+
+        The candidate 16*i + j is the tweak cell j of the rounds of parity i.
+        """
+
+        parity, cell = divmod(candidate, 16)
+        return cell, parity
+
+    def tweak_positions(self, tk_permutation_per_round):
+        """
+        Return the cell to which every tweak cell is added in the rounds -key_recovery_rounds, ...,
+        RD + key_recovery_rounds - 1 of a batch, as an array (batch, round + key_recovery_rounds, tweak cell)
+
+        The rounds before the distinguisher follow the tweakey schedule backwards.
+        """
+
+        permutations = {r: tk_permutation_per_round[:, r] for r in range(tk_permutation_per_round.shape[1])}
+        for r in range(1, 1 - self.key_recovery_rounds, -1):
+            # Round r is round r - 2 permuted by tweakey_permutation (r even) or its inverse (r odd)
+            inverse = self.inv_tweakey_permutation if r % 2 == 0 else self.tweakey_permutation
+            permutations[r - 2] = np.array(inverse)[permutations[r]]
+        rounds = range(-self.key_recovery_rounds, self.RD + self.key_recovery_rounds)
+        return np.argsort(np.stack([permutations[r] for r in rounds], axis=1), axis=2)
+
+    def extract_arrays(self, results):
+        """
+        Stack the arrays of a batch of solved distinguishers into numpy arrays
+        """
+
+        input_mask = np.array([result["forward_mask_x"][0] for result in results], dtype=np.int8).reshape(-1, 16)
+        output_mask = np.array([result["backward_mask_x"][0] for result in results], dtype=np.int8).reshape(-1, 2, 16)
+        contradict = np.array([result["contradict"] for result in results], dtype=np.int8).reshape(-1, 2, 2, 16)
+        tk_permutation_per_round = np.array([result["tk_permutation_per_round"] for result in results], dtype=np.int64).reshape(len(results), -1, 16)
+        return input_mask, output_mask, contradict, tk_permutation_per_round
+
+    def estimate(self, results):
+        """
+        Estimate the data/time/memory complexity of a batch of solved distinguishers
+
+        All complexities are given in log2. The estimation is vectorized over the batch; the
+        partial-sum steps only depend on the set of balanced cells and are computed once per set.
+        Every split of the key-recovery rounds and every lazy tweak cell is evaluated, and the
+        valid one with the lowest time, data and memory complexity is kept.
+        """
+
+        input_mask, output_mask, contradict, tk_permutation_per_round = self.extract_arrays(results)
+        num_of_results = input_mask.shape[0]
+        rows = np.arange(num_of_results)
+        active_input_cells = np.count_nonzero(input_mask == 3, axis=1)
+        balanced_cells_mask = (output_mask != 0).any(axis=1)
+        balanced_cells_code = balanced_cells_mask.astype(np.int64) @ (1 << np.arange(self.num_of_cells, dtype=np.int64))
+        unique_codes, inverse = np.unique(balanced_cells_code, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        num_of_balanced_cells = np.count_nonzero(balanced_cells_mask, axis=1)
+        lazy_tweak_cells = self.lazy_tweak_cells(contradict)
+        positions = self.tweak_positions(tk_permutation_per_round)
+        round_parity = np.arange(-self.key_recovery_rounds, self.RD + self.key_recovery_rounds) % 2
+        names = ["prepended_rounds", "lazy_tweak_cell", "key_cells", "structures", "log2_data", "log2_time", "log2_memory", "valid"]
+        candidates = {name: [] for name in names}
+        for prepended_rounds in range(self.key_recovery_rounds + 1):
+            appended_rounds = self.key_recovery_rounds - prepended_rounds
+            key_cells, step_keys, step_cells, step_round, step_needed = self.tabulate_partial_sums(unique_codes, appended_rounds)
+            key_cells, step_keys, step_cells = key_cells[inverse], step_keys[inverse], step_cells[inverse]
+            step_round, step_needed = step_round[inverse], step_needed[inverse]
+            steps = np.arange(step_round.shape[1])
+            # The balanced cells filter cell_size bits per structure each
+            structures = np.maximum(1, -(-key_cells // np.maximum(1, num_of_balanced_cells)))
+            for candidate in range(lazy_tweak_cells.shape[1]):
+                tweak_cell, parity = self.tweak_rounds(candidate)
+                tweak_positions = positions[:, :, tweak_cell].copy()
+                if parity is not None:
+                    tweak_positions[:, round_parity != parity] = -1
+                # Data: the inactive input cells, traced back to the plaintext, and the lazy tweak cell take all values
+                varying_cells = input_mask != 3
+                for p in range(prepended_rounds):
+                    varying_cells = self.prepend_round(varying_cells, tweak_positions[:, self.key_recovery_rounds - p - 1])
+                log2_structure = self.cell_size*(np.count_nonzero(varying_cells, axis=1) + 1).astype(np.float64)
+                log2_data = np.log2(structures) + log2_structure
+                # The counters are indexed by the lazy tweak cell until the last step it is added in
+                step_tweak = np.take_along_axis(tweak_positions, self.key_recovery_rounds + self.RD + np.maximum(step_round, 0), axis=1)
+                used = (step_round >= 0) & (step_tweak >= 0) & step_needed[rows[:, None], steps[None, :], np.maximum(step_tweak, 0)]
+                last_use = np.where(used, steps[None, :], -1).max(axis=1)
+                stored = step_cells + self.cell_size*(steps[None, :] <= last_use[:, None])
+                # Time: the counters never hold more entries than the structure itself
+                stored = np.minimum(stored, log2_structure[:, None])
+                log2_steps = np.logaddexp2.reduce(step_keys + stored, axis=1)
+                log2_time = np.log2(structures) + np.logaddexp2(log2_structure, log2_steps)
+                log2_time = np.logaddexp2(log2_time, self.key_size - self.cell_size*key_cells)
+                log2_time = np.minimum(log2_time, self.key_size)
+                log2_memory = np.maximum(np.max(stored, axis=1, initial=0), 0)
+                # The data must fit in the codebooks of all tweaks, and a cell that is not lazy gives no distinguisher
+                valid = lazy_tweak_cells[:, candidate] & (log2_data <= self.block_size + self.tweak_size) & (log2_time < self.key_size)
+                candidates["prepended_rounds"].append(np.full(num_of_results, prepended_rounds))
+                candidates["lazy_tweak_cell"].append(np.full(num_of_results, candidate))
+                candidates["key_cells"].append(key_cells)
+                candidates["structures"].append(structures)
+                candidates["log2_data"].append(log2_data)
+                candidates["log2_time"].append(np.where(lazy_tweak_cells[:, candidate], log2_time, np.inf))
+                candidates["log2_memory"].append(log2_memory)
+                candidates["valid"].append(valid)
+        candidates = {name: np.stack(candidates[name]) for name in names}
+        best = np.lexsort((candidates["log2_memory"], candidates["log2_data"], candidates["log2_time"], ~candidates["valid"]), axis=0)[0]
+        output = np.zeros(num_of_results, dtype=[("inputmask", np.int64),
+                                                 ("active_input_cells", np.int64),
+                                                 ("balanced_cells", np.int64),
+                                                 ("prepended_rounds", np.int64),
+                                                 ("appended_rounds", np.int64),
+                                                 ("lazy_tweak_cell", np.int64),
+                                                 ("key_cells", np.int64),
+                                                 ("structures", np.int64),
+                                                 ("log2_data", np.float64),
+                                                 ("log2_time", np.float64),
+                                                 ("log2_memory", np.float64),
+                                                 ("lazy_tweak_cells", np.int64),
+                                                 ("valid", np.bool_)])
+        output["inputmask"] = input_mask.sum(axis=1)
+        output["active_input_cells"] = active_input_cells
+        output["balanced_cells"] = num_of_balanced_cells
+        for name in names:
+            output[name] = candidates[name][best, rows]
+        output["appended_rounds"] = self.key_recovery_rounds - output["prepended_rounds"]
+        output["lazy_tweak_cells"] = np.count_nonzero(lazy_tweak_cells, axis=1)
+        return output
+
+    def rank(self, results):
+        """
+        Return the indices of the results sorted by validity, time, data and memory complexity
+        """
+
+        estimation = self.estimate(results)
+        return np.lexsort((estimation["log2_memory"], estimation["log2_data"], estimation["log2_time"], ~estimation["valid"]))
+
+    def tweak_conditions(self, result):
+        """
+        Derive the rounds in which each lazy tweak cell meets a nonzero or unknown mask
+
+        The tweak cells are counted separately on even and odd rounds, hence a lazy tweak
+        cell is identified by (round parity, cell)
+        """
+
+        fillname = {0: "zero", 1: "fixed", 2: "nonzero", 3: "any"}
+        conditions = dict()
+        tk_permutation_per_round = result["tk_permutation_per_round"]
+        for i in range(2):
+            for j in range(16):
+                if not (result["contradict"][0][i][j] == 1 and result["contradict"][1][i][j] == 1):
+                    continue
+                conditions[(i, j)] = [[], []]
+                for branch in range(2):
+                    for r in range(i, self.RU, 2):
+                        cell = list(tk_permutation_per_round[r]).index(j)
+                        if result["forward_mask_sbx"][r][cell] != 0:
+                            conditions[(i, j)][branch].append((r, fillname[result["forward_mask_sbx"][r][cell]]))
+                    for r in range(self.RL):
+                        if (self.RD - r - 1) % 2 != i:
+                            continue
+                        cell = list(tk_permutation_per_round[self.RD - r - 1]).index(j)
+                        if result["backward_mask_sbx"][r][branch][cell] != 0:
+                            conditions[(i, j)][branch].append((self.RD - r - 1, fillname[result["backward_mask_sbx"][r][branch][cell]]))
+                    conditions[(i, j)][branch].sort()
+        return conditions
+
+    def print_key_recovery_parameters(self, result):
+        """
+        Print the estimated key recovery parameters of a solved distinguisher
+        """
+
+        estimation = self.estimate([result])[0]
+        balanced_cells = [j for j in range(16) if result["backward_mask_x"][0][0][j] != 0 or result["backward_mask_x"][0][1][j] != 0]
+        guessed_key_cells, _ = self.partial_sum_steps(balanced_cells, estimation["appended_rounds"])
+        str_output = "Key recovery parameters:\n"
+        str_output += "Number of prepended rounds:      {:02d}\n".format(estimation["prepended_rounds"])
+        str_output += "Number of appended rounds:       {:02d}\n".format(estimation["appended_rounds"])
+        str_output += "Lazy tweak cell:                 T{:01d}[{:02d}]\n".format(*divmod(estimation["lazy_tweak_cell"], 16))
+        str_output += "Guessed key cells:               " + ", ".join("K{:01d}[{:02d}]".format(i, j) for (i, j) in guessed_key_cells) + "\n"
+        str_output += "Number of structures:            {}\n".format(estimation["structures"])
+        str_output += "Data complexity:                 2^({:0.02f})\n".format(estimation["log2_data"])
+        str_output += "Time complexity:                 2^({:0.02f})\n".format(estimation["log2_time"])
+        str_output += "Memory complexity:               2^({:0.02f})\n".format(estimation["log2_memory"])
+        if estimation["valid"]:
+            str_output += "Validity:                        valid\n"
+        else:
+            # More data than the codebooks of all tweaks or no faster than exhaustive search
+            str_output += "Validity:                        INFEASIBLE (data must not exceed 2^{} and time must stay below 2^{})\n".format(self.block_size + self.tweak_size, self.key_size)
+        str_output += "Tweak-cell conditions implied by contradict:\n"
+        for (i, j), branches in self.tweak_conditions(result).items():
+            for branch in range(2):
+                str_output += "T{:01d}[{:02d}] branch {}: ".format(i, j, branch)
+                str_output += ", ".join("round {:02d} ({})".format(r, kind) for (r, kind) in branches[branch]) if branches[branch] != [] else "never active"
+                str_output += "\n"
+        str_output += line_separator + "\n"
+        return str_output
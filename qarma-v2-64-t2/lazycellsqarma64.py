@@ -0,0 +1,229 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import time
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from propagatorqarma64 import MaskPropagator
+line_separator = "#"*55
+cache_directory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "qarmav2-integral", "lazy-cells")
+
+class LazyCellIndex:
+    """
+    Index of the tweak cells that can be lazy, i.e., for which contradict can hold
+
+    The activity of a tweak cell in EU only depends on the input cells that reach the state cells
+    where it is added (tk_permutation_per_round), and the nonzero-ness of a cell in EU is the OR of
+    the nonzero-ness induced by every single input cell. Hence, min_forward_any, the smallest number
+    of EU rounds in which a tweak cell is active under a nonzero input mask, is reached by a single
+    input cell. min_backward_any is the same for the EL rounds over all output cell pairs allowed by
+    the model. A tweak cell can only satisfy contradict if min_forward_any + min_backward_any <= NPT;
+    the other entries of contradict are fixed to 0 and the activity counts are bounded from below.
+    The index only depends on the variant and on (RU, RL, KR, NPT, tweakey interpretation) and is
+    cached on disk.
+    """
+
+    cipher_variant = "qarma-v2-64-t2"
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.RU = RU
+        self.RL = RL
+        self.KR = KR
+        self.NPT = NPT
+        self.tk_interpretation = tk_interpretation
+        self.propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        self.min_forward_any = None
+        self.min_backward_any = None
+        self.cached = False
+        self.elapsed_time = None
+
+    @classmethod
+    def load(cls, RU, RL, KR, NPT=1, tk_interpretation=1, use_cache=True):
+        """
+        Return the index of a parameter point, read from the cache if possible
+        """
+
+        index = cls(RU, RL, KR, NPT, tk_interpretation)
+        if not (use_cache and index.read_cache()):
+            index.run()
+            if use_cache:
+                index.write_cache()
+        return index
+
+    def run(self):
+        """
+        Compute the smallest activity counts of every tweak cell in EU and in every branch of EL
+        """
+
+        start_time = time.time()
+        propagator = self.propagator
+        single_cells = 3*np.eye(16, dtype=np.int8)
+        forward_any, _ = propagator.forward_activity(propagator.forward(single_cells)["forward_mask_sbx"])
+        backward_any, _ = propagator.backward_activity(propagator.backward(propagator.output_cell_pairs())["backward_mask_sbx"])
+        self.min_forward_any = forward_any.min(axis=0)
+        self.min_backward_any = backward_any.min(axis=0)
+        self.elapsed_time = time.time() - start_time
+        return self
+
+    #############################################################################################################################################
+    # Cache
+
+    def cache_file_name(self):
+        return os.path.join(cache_directory, "{}_RU{}_RL{}_KR{}_NPT{}_tki{}.npz".format(self.cipher_variant, self.RU, self.RL, self.KR,
+                                                                                      self.NPT, self.tk_interpretation))
+
+    def read_cache(self):
+        """
+        Read the index from the cache; entries computed for other tweak permutations are ignored
+        """
+
+        start_time = time.time()
+        try:
+            with np.load(self.cache_file_name()) as cache:
+                if not np.array_equal(cache["tk_permutation_per_round"], self.propagator.tk_permutation_per_round):
+                    return False
+                self.min_forward_any = cache["min_forward_any"]
+                self.min_backward_any = cache["min_backward_any"]
+        except (OSError, KeyError, ValueError):
+            return False
+        self.cached = True
+        self.elapsed_time = time.time() - start_time
+        return True
+
+    def write_cache(self):
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            temporary_file_name = "{}.{}.tmp.npz".format(self.cache_file_name()[:-len(".npz")], os.getpid())
+            np.savez(temporary_file_name, tk_permutation_per_round=self.propagator.tk_permutation_per_round,
+                     min_forward_any=self.min_forward_any, min_backward_any=self.min_backward_any)
+            os.replace(temporary_file_name, self.cache_file_name())
+        except OSError:
+            pass
+
+    #############################################################################################################################################
+    # Lookup
+
+    def min_any(self):
+        """
+        Return the lower bounds of no_of_any_or_nonzero[branch, parity, cell]
+        """
+
+        return self.min_forward_any[None, :, :] + self.min_backward_any
+
+    def candidates(self):
+        """
+        Return a boolean array over contradict[branch, parity, cell]: whether the entry can be 1
+        """
+
+        return self.min_any() <= self.NPT
+
+    def lazy_candidates(self):
+        """
+        Return a boolean array over (parity, cell): whether the tweak cell can be lazy in both branches
+        """
+
+        candidates = self.candidates()
+        return candidates[0] & candidates[1]
+
+    #############################################################################################################################################
+    # Constraints
+
+    def constraints(self):
+        """
+        Generate the MiniZinc constraints restricting contradict to the candidates (both encodings)
+        """
+
+        candidates = self.candidates()
+        min_any = self.min_any()
+        lines = []
+        for index in np.ndindex(candidates.shape):
+            entry = ", ".join(map(str, index))
+            if not candidates[index]:
+                lines.append("constraint contradict[{}] = 0;".format(entry))
+            if min_any[index] > 0:
+                lines.append("constraint no_of_any_or_nonzero[{}] >= {};".format(entry, min_any[index]))
+        lazy_cells = ["bool2int(contradict[0, {0}, {1}] + contradict[1, {0}, {1}] == 2)".format(parity, cell)
+                      for parity, cell in zip(*np.nonzero(self.lazy_candidates()))]
+        if lazy_cells == []:
+            # No tweak cell can be lazy: the model is unsatisfiable before search
+            lines.append("constraint false;")
+        else:
+            lines.append("constraint sum([{}]) >= 1;".format(", ".join(lazy_cells)))
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self):
+        """
+        Print the outcome of the index
+        """
+
+        candidates = self.candidates()
+        lazy_candidates = self.lazy_candidates()
+        str_output = line_separator + "\n"
+        str_output += "Lazy tweak cell index{}:\n".format(" (cached)" if self.cached else "")
+        str_output += "Candidate entries of contradict: {} of {}\n".format(int(candidates.sum()), candidates.size)
+        str_output += "Candidate lazy tweak cells:      {} of {}\n".format(int(lazy_candidates.sum()), lazy_candidates.size)
+        for parity in range(2):
+            str_output += "Parity {}:                        {}\n".format(parity, " ".join("{:x}".format(cell)
+                                                                                    for cell in np.flatnonzero(lazy_candidates[parity])) or None)
+        str_output += "Elapsed time:                    {:0.03f} seconds\n".format(self.elapsed_time)
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and build the index
+    '''
+
+    parser = ArgumentParser(description="This tool indexes the tweak cells that can be lazy in the integral distinguisher model of Qarma-v2-64\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=5, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=14, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-NPT", default=1, type=int, help="Maximum number of rounds in which a lazy tweak cell may be active")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-nc", default=False, action="store_true", help="do not read or write the cache\n")
+    parser.add_argument("-o", default=None, type=str, help="write the constraints of the index to this file\n")
+    args = parser.parse_args()
+    index = LazyCellIndex.load(args.RU - 1, args.RL - 1, args.KR, args.NPT, args.tki, use_cache=not args.nc)
+    print(index.print_summary())
+    if args.o is not None:
+        with open(args.o, "w") as output_file:
+            output_file.write(index.constraints())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import time
+import random
+import asyncio
+import itertools
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+from distinguisherqarma64 import IntegralDistinguisher, default_parameters, lookup_solver, line_separator
+
+class LargeNeighbourhoodSearch:
+    """
+    Large neighbourhood search on top of IntegralDistinguisher
+
+    Starting from the incumbent, every iteration solves num_of_workers neighbourhoods in parallel,
+    each with a short time limit and the constraint that the objective must improve. A
+    neighbourhood fixes a part of the incumbent: whole rounds of forward_mask_x, all rounds of one
+    backward branch, the lazy tweak cells chosen by contradict, or a random subset of the input and
+    output cells. The best improving solution becomes the new incumbent.
+    """
+
+    neighbourhood_kinds = ["forward_rounds", "backward_branch", "contradict", "random_cells"]
+    # Axis of contradict indexed by the branch
+    contradict_branch_axis = 0
+
+    def __init__(self, params, num_of_workers=4, neighbourhood_time_limit=60, fix_ratio=0.5, seed=0) -> None:
+        """
+        params["time_limit"] is the overall time budget; params["num_of_threads"] is split between the workers
+        """
+
+        self.params = params
+        self.num_of_workers = num_of_workers
+        self.neighbourhood_time_limit = neighbourhood_time_limit
+        self.fix_ratio = fix_ratio
+        self.random = random.Random(seed)
+        self.trace = []
+
+    def fix_constraints(self, name, values, selected):
+        """
+        Generate the constraints fixing name[index] to the incumbent for every selected index
+        """
+
+        values = np.asarray(values)
+        constraints = ""
+        for index in itertools.product(*[range(size) for size in values.shape]):
+            if selected(index):
+                constraints += "constraint {}[{}] = {};\n".format(name, ", ".join(map(str, index)), values[index])
+        return constraints
+
+    def neighbourhood_constraints(self, kind, result):
+        """
+        Generate the constraints defining a neighbourhood of the incumbent result
+        """
+
+        if kind == "forward_rounds":
+            # Keep the input mask free and fix some of the later rounds
+            num_of_rounds = len(result["forward_mask_x"])
+            fixed_rounds = set(self.random.sample(range(1, num_of_rounds), max(1, int(self.fix_ratio*(num_of_rounds - 1))))) if num_of_rounds > 1 else set()
+            return self.fix_constraints("forward_mask_x", result["forward_mask_x"], lambda index: index[0] in fixed_rounds)
+        if kind == "backward_branch":
+            branch = self.random.randrange(2)
+            return self.fix_constraints("backward_mask_x", result["backward_mask_x"], lambda index: index[1] == branch)
+        if kind == "contradict":
+            # Keep the tweak cells that are lazy in both branches
+            contradict = np.asarray(result["contradict"])
+            lazy = (contradict == 1).all(axis=self.contradict_branch_axis)
+            axis = self.contradict_branch_axis
+            return self.fix_constraints("contradict", contradict, lambda index: lazy[index[:axis] + index[axis + 1:]])
+        if kind == "random_cells":
+            constraints = self.fix_constraints("forward_mask_x", result["forward_mask_x"], lambda index: index[0] == 0 and self.random.random() < self.fix_ratio)
+            constraints += self.fix_constraints("backward_mask_x", result["backward_mask_x"], lambda index: index[0] == 0 and self.random.random() < self.fix_ratio)
+            return constraints
+        raise ValueError("Unknown neighbourhood: {}".format(kind))
+
+    def distinguisher(self, time_limit, num_of_threads, random_seed):
+        """
+        Create an IntegralDistinguisher for one sub-solve
+        """
+
+        params = dict(self.params)
+        params.update(time_limit=max(1, int(time_limit)), num_of_threads=num_of_threads, random_seed=random_seed,
+                      portfolio_size=1, memory_limit=None)
+        return IntegralDistinguisher(params)
+
+    async def run_async(self):
+        """
+        Run the search until the time budget is spent and return the distinguisher holding the incumbent
+        """
+
+        import minizinc
+        start_time = time.time()
+        deadline = start_time + self.params["time_limit"]
+        base = IntegralDistinguisher(self.params)
+        cp_solver = lookup_solver(base.cp_solver_name)
+        cp_model = minizinc.Model()
+        cp_model.add_file(base.mzn_file_name)
+        # The initial solve is retried with a doubling time limit until it finds a solution,
+        # rather than giving up on the rest of the budget after the first neighbourhood_time_limit
+        initial_time_limit = self.neighbourhood_time_limit
+        while True:
+            incumbent = self.distinguisher(min(initial_time_limit, deadline - time.time()), self.params["num_of_threads"], self.random.randrange(2**16))
+            incumbent.cp_solver = cp_solver
+            search_result = await incumbent.solve_async(cp_model=cp_model)
+            self.trace.append({"elapsed_time": time.time() - start_time, "objective": search_result.objective,
+                               "neighbourhood": "initial", "status": search_result.status})
+            if search_result.solved or search_result.status in ["UNSATISFIABLE", "MEMORY_LIMIT"] or time.time() + 1 >= deadline:
+                break
+            initial_time_limit *= 2
+        if not search_result.solved or search_result.status == "OPTIMAL_SOLUTION":
+            return incumbent
+        iteration = 0
+        while time.time() + 1 < deadline:
+            workers = []
+            for w in range(self.num_of_workers):
+                kind = self.neighbourhood_kinds[(iteration*self.num_of_workers + w) % len(self.neighbourhood_kinds)]
+                worker = self.distinguisher(min(self.neighbourhood_time_limit, deadline - time.time()),
+                                            max(1, self.params["num_of_threads"] // self.num_of_workers),
+                                            self.random.randrange(2**16))
+                worker.cp_solver = cp_solver
+                constraints = self.neighbourhood_constraints(kind, incumbent.result)
+                constraints += "constraint inputmask_distinguisher > {};\n".format(incumbent.run_record["objective"])
+                workers.append((kind, worker, worker.solve_async(cp_model=cp_model, monitor_memory=False, constraints=constraints)))
+            outcomes = await asyncio.gather(*[task for (_, _, task) in workers])
+            improved = [(outcome.objective, kind, worker) for (kind, worker, _), outcome in zip(workers, outcomes) if outcome.solved]
+            if improved != []:
+                objective, kind, incumbent = max(improved, key=lambda item: item[0])
+                self.trace.append({"elapsed_time": time.time() - start_time, "objective": objective,
+                                   "neighbourhood": kind, "status": incumbent.run_record["status"]})
+            iteration += 1
+        return incumbent
+
+    def run(self):
+        """
+        Blocking version of run_async
+        """
+
+        return asyncio.run(self.run_async())
+
+    def print_trace(self):
+        """
+        Print the improvements of the incumbent over time
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Large neighbourhood search:\n"
+        for entry in self.trace:
+            str_output += "{:8.02f} seconds: objective {} ({}, {})\n".format(entry["elapsed_time"], entry["objective"], entry["neighbourhood"], entry["status"])
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and run the large neighbourhood search
+    '''
+
+    parser = ArgumentParser(description="This tool improves integral distinguishers for Qarma-v2-64 with a large neighbourhood search\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=4, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=13, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-sl", default="ortools", type=str,
+                        choices=['gecode', 'chuffed', 'cbc', 'gurobi', 'picat', 'scip', 'choco', 'ortools'],
+                        help="choose a cp solver\n")
+    parser.add_argument("-p", default=8, type=int, help="number of threads shared by the workers\n")
+    parser.add_argument("-tl", default=4000, type=int, help="overall time budget in seconds\n")
+    parser.add_argument("-w", default=4, type=int, help="number of neighbourhoods solved in parallel\n")
+    parser.add_argument("-nt", default=60, type=int, help="time limit of every neighbourhood in seconds (the initial solve starts with it and doubles it until a solution is found)\n")
+    parser.add_argument("-fr", default=0.5, type=float, help="fraction of rounds/cells fixed by a neighbourhood\n")
+    parser.add_argument("-seed", default=0, type=int, help="seed of the neighbourhood selection\n")
+    parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    args = parser.parse_args()
+    params = default_parameters()
+    params.update(RU=args.RU, RL=args.RL, KR=args.KR, cp_solver_name=args.sl, num_of_threads=args.p,
+                  time_limit=args.tl, output_file_name=args.o)
+    lns = LargeNeighbourhoodSearch(params, num_of_workers=args.w, neighbourhood_time_limit=args.nt, fix_ratio=args.fr, seed=args.seed)
+    incumbent = lns.run()
+    print(lns.print_trace())
+    if incumbent.result is not None and incumbent.result.solution is not None:
+        incumbent.report()
+    else:
+        print("No solution was found")
+
+if __name__ == "__main__":
+    main()
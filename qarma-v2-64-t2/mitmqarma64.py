@@ -0,0 +1,269 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser, RawTextHelpFormatter
+from propagatorqarma64 import MaskPropagator, line_separator
+
+class MeetInTheMiddle:
+    """
+    Decomposed search for integral distinguishers: EU and EL are evaluated separately and
+    joined on the tweakey contradiction
+
+    EU and EL only interact through the activity counts of the tweak cells. The EU signature of
+    an input mask at a lazy tweak cell (p, t) is the pair (no_of_any, no_of_only) of its forward
+    activity, clipped to (NPT + 1, 1) since larger values cannot change contradict. The input masks
+    are indexed by (lazy tweak cell, signature), keeping the largest input mask of every entry,
+    and every output cell pair is joined with the entries that make (p, t) lazy in both branches.
+    The join costs O(pairs * tweak cells * signatures) instead of O(pairs * input masks).
+    """
+
+    def __init__(self, RU, RL, KR, NPT=1, tk_interpretation=1, num_of_workers=None, chunk_size=4096) -> None:
+        """
+        RU and RL follow the convention of IntegralDistinguisher (number of rounds - 1)
+        """
+
+        self.propagator = MaskPropagator(RU, RL, KR, NPT, tk_interpretation)
+        self.RU = RU
+        self.RL = RL
+        self.RD = self.RU + self.RL
+        self.KR = KR
+        self.NPT = NPT
+        self.num_of_workers = (os.cpu_count() or 1) if num_of_workers is None else num_of_workers
+        self.chunk_size = chunk_size
+        self.num_of_signatures = 2*(self.NPT + 2)
+
+    def forward_signatures(self, input_mask):
+        """
+        Compute the EU signatures of a batch of input masks, one column per lazy tweak cell (p, t)
+        """
+
+        forward_any, forward_only = self.propagator.forward_activity(self.propagator.forward(input_mask)["forward_mask_sbx"])
+        forward_any = np.minimum(forward_any, self.NPT + 1).reshape(forward_any.shape[0], -1)
+        forward_only = np.minimum(forward_only, 1).reshape(forward_only.shape[0], -1)
+        return 2*forward_any + forward_only
+
+    def backward_signatures(self, output_mask):
+        """
+        Compute the EL activity of a batch of output cell pairs with shape (N, branch, lazy tweak cell)
+        """
+
+        backward_any, backward_only = self.propagator.backward_activity(self.propagator.backward(output_mask)["backward_mask_sbx"])
+        return backward_any.reshape(backward_any.shape[0], 2, -1), backward_only.reshape(backward_only.shape[0], 2, -1)
+
+    def index_chunk(self, input_mask):
+        """
+        Index one chunk of input masks: best[s, c] is the largest objective among the input masks with
+        signature c at the lazy tweak cell s, and argbest the position of that input mask in the chunk
+        """
+
+        signatures = self.forward_signatures(input_mask)
+        objective = input_mask.reshape(input_mask.shape[0], -1).sum(axis=1, dtype=np.int64)
+        objective = np.where(objective >= 1, objective, -1)
+        best = np.full((signatures.shape[1], self.num_of_signatures), -1, dtype=np.int64)
+        argbest = np.zeros((signatures.shape[1], self.num_of_signatures), dtype=np.int64)
+        for c in range(self.num_of_signatures):
+            candidates = np.where(signatures == c, objective[:, None], -1)
+            argbest[:, c] = candidates.argmax(axis=0)
+            best[:, c] = candidates[argbest[:, c], np.arange(signatures.shape[1])]
+        return best, argbest
+
+    def forward_index(self, input_mask, executor):
+        """
+        Index all input masks by lazy tweak cell and signature, processing the chunks in parallel
+        """
+
+        starts = list(range(0, input_mask.shape[0], self.chunk_size))
+        chunks = executor.map(lambda start: self.index_chunk(input_mask[start:start + self.chunk_size]), starts)
+        best, best_input = None, None
+        for start, (chunk_best, chunk_argbest) in zip(starts, chunks):
+            if best is None:
+                best = chunk_best
+                best_input = chunk_argbest + start
+                continue
+            improved = chunk_best > best
+            best[improved] = chunk_best[improved]
+            best_input[improved] = chunk_argbest[improved] + start
+        return best, best_input
+
+    def join(self, best, backward_any, backward_only):
+        """
+        Join the index of the input masks with the EL activity of every output cell pair
+
+        Returns the best objective of every pair, with the lazy tweak cell and the signature reaching it
+        """
+
+        num_of_pairs = backward_any.shape[0]
+        objective = np.full(num_of_pairs, -1, dtype=np.int64)
+        lazy_cell = np.zeros(num_of_pairs, dtype=np.int64)
+        signature = np.zeros(num_of_pairs, dtype=np.int64)
+        for c in range(self.num_of_signatures):
+            forward_any, forward_only = divmod(c, 2)
+            no_of_any_or_nonzero = forward_any + backward_any
+            no_of_only_nonzero = forward_only + backward_only
+            lazy = (((no_of_any_or_nonzero <= self.NPT) & (no_of_only_nonzero >= 1)) | (no_of_any_or_nonzero == 0)).all(axis=1)
+            candidates = np.where(lazy, best[None, :, c], -1)
+            cell = candidates.argmax(axis=1)
+            value = candidates[np.arange(num_of_pairs), cell]
+            improved = value > objective
+            objective[improved] = value[improved]
+            lazy_cell[improved] = cell[improved]
+            signature[improved] = c
+        return objective, lazy_cell, signature
+
+    def search(self, input_mask=None, output_mask=None):
+        """
+        Run the meet-in-the-middle search
+
+        By default all 2^16 input masks in {0, 3} and all output cell pairs allowed by the model are
+        used, in which case the objective of every pair is exact (the same as the exhaustive prefilter).
+        """
+
+        start_time = time.time()
+        exhaustive = input_mask is None
+        input_mask = self.propagator.input_patterns() if input_mask is None else np.asarray(input_mask, dtype=np.int8).reshape(-1, 16)
+        output_mask = self.propagator.output_cell_pairs() if output_mask is None else np.asarray(output_mask, dtype=np.int8).reshape(-1, 2, 16)
+        with ThreadPoolExecutor(max_workers=self.num_of_workers) as executor:
+            # EL runs next to the chunks of EU
+            backward = executor.submit(self.backward_signatures, output_mask)
+            best, best_input = self.forward_index(input_mask, executor)
+            backward_any, backward_only = backward.result()
+        objective, lazy_cell, signature = self.join(best, backward_any, backward_only)
+        found = objective >= 1
+        return {"output_mask": output_mask,
+                "objective": objective,
+                "input_mask": np.where(found[:, None], input_mask[best_input[lazy_cell, signature]], 0),
+                "lazy_cell": lazy_cell,
+                "found": found,
+                "exact": exhaustive,
+                "num_of_input_masks": input_mask.shape[0],
+                "num_of_signatures": int((best >= 1).sum()),
+                "elapsed_time": time.time() - start_time}
+
+    def build_result(self, input_mask, output_mask):
+        """
+        Propagate an input mask and an output cell pair and collect the variables of distinguisherqarma64.mzn,
+        so that the distinguisher can be reported, drawn and archived like a solver result
+        """
+
+        propagator = self.propagator
+        forward = propagator.forward(input_mask)
+        backward = propagator.backward(output_mask)
+        result = {key: value[0].tolist() for key, value in list(forward.items()) + list(backward.items())}
+        any_or_nonzero_subtweakey = np.zeros((self.RD, 2, 16), dtype=np.int64)
+        only_nonzero_subtweakeys = np.zeros((self.RD, 2, 16), dtype=np.int64)
+        for r in range(self.RU):
+            mask = forward["forward_mask_sbx"][0, r, propagator.inv_tk_permutation_per_round[r]]
+            any_or_nonzero_subtweakey[r] = (mask != 0)
+            only_nonzero_subtweakeys[r] = (mask == 1) | (mask == 2)
+        for r in range(self.RL):
+            mask = backward["backward_mask_sbx"][0, r][:, propagator.inv_tk_permutation_per_round[self.RD - r - 1]]
+            any_or_nonzero_subtweakey[self.RD - r - 1] = (mask != 0)
+            only_nonzero_subtweakeys[self.RD - r - 1] = (mask == 1) | (mask == 2)
+        forward_any, forward_only = propagator.forward_activity(forward["forward_mask_sbx"])
+        backward_any, backward_only = propagator.backward_activity(backward["backward_mask_sbx"])
+        result["any_or_nonzero_subtweakey"] = any_or_nonzero_subtweakey.tolist()
+        result["only_nonzero_subtweakeys"] = only_nonzero_subtweakeys.tolist()
+        result["no_of_any_or_nonzero"] = (forward_any[:, None] + backward_any)[0].tolist()
+        result["no_of_only_nonzero"] = (forward_only[:, None] + backward_only)[0].tolist()
+        result["contradict"] = propagator.contradict(forward_any, forward_only, backward_any, backward_only)[0].astype(np.int64).tolist()
+        result["inputmask_distinguisher"] = int(np.sum(input_mask))
+        result["outputmask_distinguisher1"] = int(np.sum(output_mask[0]))
+        result["outputmask_distinguisher2"] = int(np.sum(output_mask[1]))
+        result["tk_permutation_per_round"] = propagator.tk_permutation_per_round.tolist()
+        result["tkp_sequence"] = propagator.generate_tkp_sequence()
+        return result
+
+    def print_search_summary(self, search, max_lines=16):
+        """
+        Print the outcome of the search (the max_lines output cell pairs with the largest input mask)
+        """
+
+        str_output = line_separator + "\n"
+        str_output += "Meet-in-the-middle search:\n"
+        str_output += "Number of input masks:           {}\n".format(search["num_of_input_masks"])
+        str_output += "Number of EU index entries:      {}\n".format(search["num_of_signatures"])
+        str_output += "Number of output cell pairs:     {}\n".format(len(search["found"]))
+        str_output += "Number of feasible pairs:        {}\n".format(int(search["found"].sum()))
+        str_output += "Best objective:                  {}{}\n".format(int(search["objective"].max()), "" if search["exact"] else " (over the given input masks)")
+        order = [q for q in np.argsort(-search["objective"], kind="stable") if search["found"][q]]
+        for q in order[:max_lines]:
+            a = int(np.flatnonzero(search["output_mask"][q, 0])[0])
+            b = int(np.flatnonzero(search["output_mask"][q, 1])[0])
+            parity, cell = divmod(int(search["lazy_cell"][q]), 16)
+            str_output += "Output cells ({:02d}, {:02d}): input mask {:02d}, lazy tweak cell T[{:02d}] (round parity {})\n".format(a, b,
+                int(search["objective"][q]), cell, parity)
+        if len(order) > max_lines:
+            str_output += "... and {} more\n".format(len(order) - max_lines)
+        str_output += "Elapsed time: {:0.02f} seconds\n".format(search["elapsed_time"])
+        str_output += line_separator
+        return str_output
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and run the meet-in-the-middle search
+    '''
+
+    parser = ArgumentParser(description="This tool finds integral distinguishers for Qarma-v2-64 by joining EU and EL on the tweakey contradiction\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-RU", default=4, type=int, help="Number of rounds for EU")
+    parser.add_argument("-RL", default=5, type=int, help="Number of rounds for EL")
+    parser.add_argument("-KR", default=13, type=int, help="Number of rounds for key recovery")
+    parser.add_argument("-tki", default=1, type=int, choices=[0, 1, 2], help="entry of tkp_sequence that initiates the second tweakey permutation\n")
+    parser.add_argument("-w", default=None, type=int, help="number of worker threads (default: number of CPUs)\n")
+    parser.add_argument("-ar", default=None, type=str, help="packed archive to which the best distinguisher is appended\n")
+    parser.add_argument("-o", default="output.tex", type=str, help="output file including the Tikz code to generate the shape of the attack\n")
+    args = parser.parse_args()
+    from distinguisherqarma64 import IntegralDistinguisher, default_parameters
+    params = default_parameters()
+    params.update(RU=args.RU, RL=args.RL, KR=args.KR, tk_interpretation=args.tki, output_file_name=args.o)
+    integral__distinguisher = IntegralDistinguisher(params)
+    mitm = MeetInTheMiddle(integral__distinguisher.RU, integral__distinguisher.RL, args.KR,
+                           integral__distinguisher.NPT, args.tki, num_of_workers=args.w)
+    search = mitm.search()
+    print(mitm.print_search_summary(search))
+    if not search["found"].any():
+        print("No output cell pair leads to a contradiction")
+        return
+    q = int(search["objective"].argmax())
+    integral__distinguisher.result = mitm.build_result(search["input_mask"][q], search["output_mask"][q])
+    if args.ar is not None:
+        from storageqarma64 import ResultArchive
+        ResultArchive.append_to_file(args.ar, [integral__distinguisher.result], mitm.RU, mitm.RL, mitm.KR, mitm.NPT, args.tki)
+    integral__distinguisher.report()
+
+if __name__ == "__main__":
+    main()
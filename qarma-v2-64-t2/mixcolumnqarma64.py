@@ -0,0 +1,203 @@
+#!/usr/env/bin python3
+#-*- coding: UTF-8 -*-
+
+"""
+MIT License
+
+Copyright (c) 2023 Hosein Hadipour
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+email: hsn.hadipour@gmail.com
+"""
+
+import os
+import numpy as np
+from argparse import ArgumentParser, RawTextHelpFormatter
+line_separator = "#"*55
+
+class MixColumnTable:
+    """
+    Precomputed transition relation of mix_column in distinguisherqarma64.mzn
+
+    A cell is in one of 18 states (mask, class): (0, 0), (1, 1..15), (2, -1) and (3, -2). The state
+    id of a cell is its class for the masks 0 and 1, 16 for the mask 2 and 17 for the mask 3.
+    mix_column is deterministic, hence the relation is stored as an array of shape (18, 18, 18, 18, 6)
+    mapping the states of the four input cells of a column to the states of the four output cells
+    and of the two auxiliary cells. The array is saved as a .npy file and memory-mapped on load.
+    """
+
+    num_of_states = 18
+    state_mask = np.array([0] + [1]*15 + [2, 3], dtype=np.int8)
+    state_class = np.array(list(range(16)) + [-1, -2], dtype=np.int8)
+
+    def __init__(self, table) -> None:
+        self.table = table
+
+    @staticmethod
+    def default_file_name(extension=".npy"):
+        """
+        Return the default location of the table (next to this module)
+        """
+
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "mixcolumnqarma64" + extension)
+
+    @staticmethod
+    def xor_operation(mask_a, class_a, mask_b, class_b):
+        """
+        Apply xor_operation element-wise
+        """
+
+        mask_sum = mask_a + mask_b
+        conditions = [mask_sum > 2,
+                      mask_sum == 1,
+                      (mask_a == 0) & (mask_b == 0),
+                      class_a + class_b < 0,
+                      class_a == class_b]
+        mask_c = np.select(conditions, [3, 1, 0, 2, 0], default=1).astype(np.int8)
+        class_c = np.select(conditions, [-2, class_a + class_b, 0, -1, 0], default=np.bitwise_xor(class_a, class_b)).astype(np.int8)
+        return mask_c, class_c
+
+    @classmethod
+    def state_id(cls, mask, cell_class):
+        """
+        Map (mask, class) to the state id of a cell
+        """
+
+        return np.where(mask >= 2, mask + 14, cell_class).astype(np.intp)
+
+    @classmethod
+    def generate(cls):
+        """
+        Evaluate the two xor chains of mix_column on all 18^4 column states
+        """
+
+        states = np.indices((cls.num_of_states,)*4).reshape(4, -1)
+        in_mask = cls.state_mask[states]
+        in_class = cls.state_class[states]
+        aux_mask1, aux_class1 = cls.xor_operation(in_mask[2], in_class[2], in_mask[3], in_class[3])
+        out_mask1, out_class1 = cls.xor_operation(in_mask[1], in_class[1], aux_mask1, aux_class1)
+        out_mask2, out_class2 = cls.xor_operation(in_mask[0], in_class[0], aux_mask1, aux_class1)
+        aux_mask2, aux_class2 = cls.xor_operation(in_mask[0], in_class[0], in_mask[1], in_class[1])
+        out_mask3, out_class3 = cls.xor_operation(aux_mask2, aux_class2, in_mask[3], in_class[3])
+        out_mask4, out_class4 = cls.xor_operation(aux_mask2, aux_class2, in_mask[2], in_class[2])
+        out_mask = np.stack([out_mask1, out_mask2, out_mask3, out_mask4, aux_mask1, aux_mask2], axis=-1)
+        out_class = np.stack([out_class1, out_class2, out_class3, out_class4, aux_class1, aux_class2], axis=-1)
+        return cls.state_id(out_mask, out_class).astype(np.uint8).reshape((cls.num_of_states,)*4 + (6,))
+
+    @classmethod
+    def write(cls, file_name=None):
+        """
+        Generate the table and save it as a .npy file
+        """
+
+        file_name = cls.default_file_name() if file_name is None else file_name
+        # Write to a temporary file first so that concurrent readers never see a partial table
+        temporary_file_name = "{}.{}.tmp".format(file_name, os.getpid())
+        with open(temporary_file_name, "wb") as table_file:
+            np.save(table_file, cls.generate())
+        os.replace(temporary_file_name, file_name)
+        return file_name
+
+    @classmethod
+    def load(cls, file_name=None):
+        """
+        Memory-map the table from file_name (generated first if it does not exist)
+        """
+
+        file_name = cls.default_file_name() if file_name is None else file_name
+        if not os.path.exists(file_name):
+            cls.write(file_name)
+        table = np.load(file_name, mmap_mode="r")
+        assert(table.shape == (cls.num_of_states,)*4 + (6,))
+        return cls(table)
+
+    def lookup(self, in_mask, in_class):
+        """
+        Apply mix_column to a batch of columns
+
+        in_mask and in_class have shape (..., 4) (the four input cells of every column); returns the
+        masks and classes of the four output cells followed by the two auxiliary cells, with shape (..., 6)
+        """
+
+        states = self.state_id(in_mask, in_class)
+        out_states = self.table[states[..., 0], states[..., 1], states[..., 2], states[..., 3]]
+        return self.state_mask[out_states], self.state_class[out_states]
+
+    def transitions(self):
+        """
+        List the relation as rows (in_mask1, in_class1, ..., in_mask4, in_class4, out_mask1, out_class1, ...,
+        out_mask4, out_class4, auxi_mask1, auxi_class1, auxi_mask2, auxi_class2), the argument order of mix_column
+        """
+
+        states = np.concatenate([np.indices((self.num_of_states,)*4).reshape(4, -1).T,
+                                 np.asarray(self.table).reshape(-1, 6)], axis=1)
+        return np.stack([self.state_mask[states], self.state_class[states]], axis=-1).reshape(states.shape[0], 20)
+
+    def write_dzn(self, file_name=None):
+        """
+        Write the relation as MiniZinc data for the table version of mix_column
+        """
+
+        file_name = self.default_file_name(".dzn") if file_name is None else file_name
+        transitions = self.transitions()
+        temporary_file_name = "{}.{}.tmp".format(file_name, os.getpid())
+        with open(temporary_file_name, "w") as dzn_file:
+            dzn_file.write("mix_column_transitions = array2d(1..{}, 1..20, [\n".format(transitions.shape[0]))
+            dzn_file.write(",\n".join(",".join(map(str, row)) for row in transitions.tolist()))
+            dzn_file.write("]);\n")
+        os.replace(temporary_file_name, file_name)
+        return file_name
+
+    @classmethod
+    def dzn_file_name(cls):
+        """
+        Return the default .dzn file of the relation (generated first if it does not exist)
+        """
+
+        file_name = cls.default_file_name(".dzn")
+        if not os.path.exists(file_name):
+            cls.load().write_dzn(file_name)
+        return file_name
+
+#############################################################################################################################################
+#############################################################################################################################################
+#############################################################################################################################################
+
+def main():
+    '''
+    Parse the arguments and generate the transition relation of mix_column
+    '''
+
+    parser = ArgumentParser(description="This tool precomputes the transition relation of mix_column for Qarma-v2-64\n",
+                            formatter_class=RawTextHelpFormatter)
+    parser.add_argument("-npy", default=None, type=str, help="output .npy file of the table (default: mixcolumnqarma64.npy next to this tool)\n")
+    parser.add_argument("-dzn", default=None, type=str, help="output MiniZinc data file of the table (default: mixcolumnqarma64.dzn next to this tool)\n")
+    args = parser.parse_args()
+    npy_file_name = MixColumnTable.write(args.npy)
+    mix_column_table = MixColumnTable.load(npy_file_name)
+    dzn_file_name = mix_column_table.write_dzn(args.dzn)
+    print(line_separator)
+    print("Number of transitions:  {}".format(mix_column_table.table[..., 0].size))
+    print("Table:                  {}".format(npy_file_name))
+    print("MiniZinc data:          {}".format(dzn_file_name))
+    print(line_separator)
+
+if __name__ == "__main__":
+    main()